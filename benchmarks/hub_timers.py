@@ -1,10 +1,10 @@
 #! /usr/bin/env python
 from __future__ import print_function
 
-# test timer adds & expires on hubs.hub.BaseHub
+# test timer adds & expires on hubs.hub.BaseHub, comparing the default heap
+# timer store with the timing wheel (BaseHub.set_timer_wheel)
 
-import sys
-import eventlet
+import collections
 import random
 import time
 
@@ -12,35 +12,92 @@ from eventlet.hubs import timer, get_hub
 from eventlet.support import six
 
 
-timer_count = 100000
+TIMER_COUNT = 100000
+CANCEL_RATIO = 0.0
+ITERATIONS = 2000
+BATCH = 100
 
-if len(sys.argv) >= 2:
-    timer_count = int(sys.argv[1])
 
-l = []
+fired = []
 
 
 def work(n):
-    l.append(n)
-
-timeouts = [random.uniform(0, 10) for x in six.moves.range(timer_count)]
-
-hub = get_hub()
-
-start = time.time()
-
-scheduled = []
-
-for timeout in timeouts:
-    t = timer.Timer(timeout, work, timeout)
-    t.schedule()
-
-    scheduled.append(t)
-
-hub.prepare_timers()
-hub.fire_timers(time.time() + 11)
-hub.prepare_timers()
-
-end = time.time()
-
-print("Duration: %f" % (end - start,))
+    fired.append(n)
+
+
+def run_expire(use_wheel, timeouts, cancel_ratio):
+    """Schedule every timer up front, then expire them all in one go."""
+    hub = get_hub()
+    hub.set_timer_wheel(use_wheel)
+    del fired[:]
+
+    start = time.time()
+
+    for timeout in timeouts:
+        t = timer.Timer(timeout, work, timeout)
+        t.schedule()
+        if random.random() < cancel_ratio:
+            t.cancel()
+
+    hub.prepare_timers()
+    hub.fire_timers(hub.clock() + 11)
+    hub.prepare_timers()
+
+    end = time.time()
+    hub.set_timer_wheel(False)
+    return end - start
+
+
+def run_steady(use_wheel, population, cancel_ratio):
+    """Keep *population* long timeouts alive and, on every simulated hub
+    iteration, schedule a batch of new ones while canceling old ones, the
+    way per-request socket timeouts behave on a busy server."""
+    hub = get_hub()
+    hub.set_timer_wheel(use_wheel)
+    live = collections.deque()
+    for i in six.moves.range(population):
+        live.append(hub.schedule_call_global(random.uniform(30, 90), work, i))
+    hub.prepare_timers()
+
+    start = time.time()
+
+    for i in six.moves.range(ITERATIONS):
+        for j in six.moves.range(BATCH):
+            live.append(hub.schedule_call_global(random.uniform(30, 90), work, j))
+            t = live.popleft()
+            if random.random() < cancel_ratio:
+                t.cancel()
+        hub.prepare_timers()
+        hub.fire_timers(hub.clock())
+        hub.sleep_until()
+
+    end = time.time()
+    for t in live:
+        t.cancel()
+    hub.set_timer_wheel(False)
+    hub.prepare_timers()
+    return end - start
+
+
+if __name__ == "__main__":
+    import optparse
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--timers', type='int', dest='timers',
+                      default=TIMER_COUNT)
+    parser.add_option('-c', '--cancel', type='float', dest='cancel',
+                      default=CANCEL_RATIO,
+                      help='fraction of timers canceled before they expire')
+    parser.add_option('--steady', action='store_true', dest='steady', default=False,
+                      help='simulate hub iterations over a long-lived timer population')
+
+    opts, args = parser.parse_args()
+    if args:
+        opts.timers = int(args[0])
+
+    if opts.steady:
+        print("heap:  %f" % run_steady(False, opts.timers, opts.cancel))
+        print("wheel: %f" % run_steady(True, opts.timers, opts.cancel))
+    else:
+        timeouts = [random.uniform(0, 10) for x in six.moves.range(opts.timers)]
+        print("heap:  %f" % run_expire(False, timeouts, opts.cancel))
+        print("wheel: %f" % run_expire(True, timeouts, opts.cancel))
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+from __future__ import print_function
+
+# measure hub loop iterations per second with N always-ready sockets, i.e.
+# the cost of one poll plus dispatching N callbacks
+
+import socket
+import time
+
+from eventlet import hubs
+from eventlet.support import six
+
+
+SOCKETS = 1000
+DURATION = 2.0
+
+
+def run(hub_name, count, duration, maxevents=None):
+    hubs.use_hub(hub_name)
+    hub = hubs.get_hub()
+    if maxevents:
+        hub.maxevents = maxevents
+    pairs = [socket.socketpair() for _ in six.moves.range(count)]
+    dispatched = [0]
+
+    def cb(fileno):
+        dispatched[0] += 1
+
+    listeners = []
+    for a, b in pairs:
+        b.send(b'x')
+        listeners.append(hub.add(hub.READ, a.fileno(), cb, cb, None))
+
+    iterations = 0
+    start = time.time()
+    deadline = start + duration
+    while time.time() < deadline:
+        for _ in six.moves.range(100):
+            hub.wait(0)
+        iterations += 100
+    elapsed = time.time() - start
+
+    for listener in listeners:
+        hub.remove(listener)
+    for a, b in pairs:
+        a.close()
+        b.close()
+    hubs.use_hub()
+    return iterations / elapsed, dispatched[0] / elapsed
+
+
+if __name__ == "__main__":
+    import optparse
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--sockets', type='int', dest='sockets',
+                      default=SOCKETS, help='number of ready sockets')
+    parser.add_option('-t', '--time', type='float', dest='duration',
+                      default=DURATION, help='seconds to run each hub')
+    parser.add_option('-m', '--maxevents', type='int', dest='maxevents',
+                      default=None, help='per-iteration event cap (epoll hubs)')
+    parser.add_option('--hub', action='append', dest='hubs', default=[],
+                      help='hub to measure, may be repeated')
+
+    opts, args = parser.parse_args()
+    for name in opts.hubs or ['epolls', 'poll']:
+        try:
+            loops, events = run(name, opts.sockets, opts.duration, opts.maxevents)
+        except ImportError:
+            print("%-10s unavailable" % name)
+            continue
+        print("%-10s %10.1f iterations/s %12.1f callbacks/s" % (name, loops, events))
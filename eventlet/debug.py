@@ -93,7 +93,10 @@ def format_hub_timers():
     from eventlet import hubs
     hub = hubs.get_hub()
     result = ['TIMERS:']
-    for l in hub.timers:
+    timers = hub.timers
+    if hub.timer_wheel is not None:
+        timers = sorted(hub.timer_wheel.items())
+    for l in timers:
         result.append(repr(l))
     return os.linesep.join(result)
 
@@ -1,4 +1,5 @@
 import errno
+import io
 import os
 import socket
 import sys
@@ -6,14 +7,14 @@ import time
 import warnings
 
 import eventlet
-from eventlet.hubs import trampoline, notify_opened, IOClosed
+from eventlet.hubs import trampoline, notify_opened, IOClosed, FdWaiter
 from eventlet.support import get_errno, six
 
 __all__ = [
     'GreenSocket', '_GLOBAL_DEFAULT_TIMEOUT', 'set_nonblocking',
     'SOCKET_BLOCKING', 'SOCKET_CLOSED', 'CONNECT_ERR', 'CONNECT_SUCCESS',
     'shutdown_safe', 'SSL',
-    'socket_timeout',
+    'socket_timeout', 'GreenSocketReader',
 ]
 
 BUFFER_SIZE = 4096
@@ -30,6 +31,22 @@ _original_socket = eventlet.patcher.original('socket').socket
 
 socket_timeout = eventlet.timeout.wrap_is_timeout(socket.timeout)
 
+try:
+    _memoryview = memoryview
+except NameError:
+    # Python 2.6
+    _memoryview = buffer  # noqa: F821 (Python 2 builtin)
+
+# buffers passed to one sendmsg() call; Linux refuses more than 1024
+IOV_MAX = 1024
+
+# Python 2 has no BytesIO.getbuffer()
+_bytesio_getbuffer = hasattr(io.BytesIO, 'getbuffer')
+
+
+class _GiveupOnSendfile(Exception):
+    pass
+
 
 def socket_connect(descriptor, address):
     """
@@ -147,6 +164,8 @@ class GreenSocket(object):
         if should_set_nonblocking:
             set_nonblocking(fd)
         self.fd = fd
+        # keeps fd registered with the hub across waits, see hubs.FdWaiter
+        self._waiter = None
         # when client calls setblocking(0) or settimeout(0) the socket must
         # act non-blocking
         self.act_non_blocking = False
@@ -157,7 +176,6 @@ class GreenSocket(object):
         # Only `getsockopt` is required to fix that issue, others
         # are just premature optimization to save __getattr__ call.
         self.bind = fd.bind
-        self.close = fd.close
         self.fileno = fd.fileno
         self.getsockname = fd.getsockname
         self.getsockopt = fd.getsockopt
@@ -202,6 +220,13 @@ class GreenSocket(object):
             # socket here would be useful.
             raise IOClosed()
         try:
+            if fd is self.fd:
+                waiter = self._waiter
+                if waiter is None:
+                    waiter = self._waiter = FdWaiter(fd.fileno())
+                return waiter.wait(read=read, write=write, timeout=timeout,
+                                   timeout_exc=timeout_exc,
+                                   mark_as_closed=self._mark_as_closed)
             return trampoline(fd, read=read, write=write, timeout=timeout,
                               timeout_exc=timeout_exc,
                               mark_as_closed=self._mark_as_closed)
@@ -230,10 +255,17 @@ class GreenSocket(object):
         """ Mark this socket as being closed """
         self._closed = True
 
+    def close(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            waiter.release()
+        self.fd.close()
+
     def __del__(self):
-        # This is in case self.close is not assigned yet (currently the constructor does it)
+        # This is in case the constructor failed before self.fd was assigned
         close = getattr(self, 'close', None)
-        if close is not None:
+        if close is not None and self.fd is not None:
             close()
 
     def connect(self, address):
@@ -399,8 +431,113 @@ class GreenSocket(object):
     def sendall(self, data, flags=0):
         tail = self.send(data, flags)
         len_data = len(data)
-        while tail < len_data:
-            tail += self.send(data[tail:], flags)
+        if tail < len_data:
+            # send the rest from a view rather than copies of the data
+            try:
+                data = _memoryview(data)
+            except TypeError:
+                pass
+            while tail < len_data:
+                tail += self.send(data[tail:], flags)
+
+    if hasattr(_original_socket, 'sendmsg'):
+        def sendmsg(self, buffers, *args):
+            return self._send_loop(self.fd.sendmsg, buffers, *args)
+
+    def sendall_vectored(self, buffers, flags=0):
+        """Send all of *buffers*, a sequence of bytes-like objects, as if
+        they were one string.  Where ``sendmsg`` is available the buffers
+        are handed to the kernel together and never copied or joined.
+        """
+        if not hasattr(self, 'sendmsg'):
+            self.sendall(b''.join(buffers), flags)
+            return
+        views = [_memoryview(buf).cast('B') for buf in buffers if len(buf)]
+        start = 0
+        count = len(views)
+        while start < count:
+            sent = self.sendmsg(views[start:start + IOV_MAX], (), flags)
+            while sent:
+                size = len(views[start])
+                if sent < size:
+                    views[start] = views[start][sent:]
+                    break
+                sent -= size
+                start += 1
+
+    def sendfile(self, file, offset=0, count=None):
+        """Send the contents of *file*, a file object opened in binary mode,
+        starting at *offset* and stopping after *count* bytes or at EOF, like
+        :meth:`socket.socket.sendfile`.  Regular files go through
+        ``os.sendfile`` where the platform has it, anything else is read and
+        sent with :meth:`sendall`.  Returns the number of bytes sent and
+        leaves the file position after the last byte sent.
+        """
+        if self.act_non_blocking:
+            raise ValueError("non-blocking sockets are not supported")
+        if count is not None and count <= 0:
+            return 0
+        try:
+            return self._sendfile_use_sendfile(file, offset, count)
+        except _GiveupOnSendfile:
+            return self._sendfile_use_send(file, offset, count)
+
+    def _sendfile_use_sendfile(self, file, offset, count):
+        if not hasattr(os, 'sendfile'):
+            raise _GiveupOnSendfile()
+        try:
+            fileno = file.fileno()
+            fsize = os.fstat(fileno).st_size
+        except (AttributeError, ValueError, IOError, OSError, io.UnsupportedOperation):
+            raise _GiveupOnSendfile()
+        if not fsize:
+            return 0
+        sockno = self.fileno()
+        blocksize = min(count or fsize, 1 << 30)
+        total_sent = 0
+        try:
+            while True:
+                if count:
+                    blocksize = min(count - total_sent, blocksize)
+                    if blocksize <= 0:
+                        break
+                try:
+                    sent = os.sendfile(sockno, fileno, offset, blocksize)
+                except OSError as e:
+                    eno = get_errno(e)
+                    if eno in SOCKET_BLOCKING:
+                        self._trampoline(self.fd, write=True, timeout=self.gettimeout(),
+                                         timeout_exc=socket_timeout('timed out'))
+                        continue
+                    if total_sent == 0 and eno in (errno.EINVAL, errno.ENOSYS):
+                        # not a file sendfile() can read from, e.g. a pipe
+                        raise _GiveupOnSendfile()
+                    raise
+                if sent == 0:
+                    break
+                offset += sent
+                total_sent += sent
+            return total_sent
+        finally:
+            if total_sent > 0 and hasattr(file, 'seek'):
+                file.seek(offset)
+
+    def _sendfile_use_send(self, file, offset, count):
+        if offset and hasattr(file, 'seek'):
+            file.seek(offset)
+        blocksize = min(count, 8192) if count else 8192
+        total_sent = 0
+        while True:
+            if count:
+                blocksize = min(count - total_sent, blocksize)
+                if blocksize <= 0:
+                    break
+            data = file.read(blocksize)
+            if not data:
+                break
+            self.sendall(data)
+            total_sent += len(data)
+        return total_sent
 
     def setblocking(self, flag):
         if flag:
@@ -445,6 +582,235 @@ class GreenSocket(object):
             getattr(self.fd, '_sock', self.fd)._drop()
 
 
+class GreenSocketReader(object):
+    """Buffered binary reader over a socket.
+
+    Data is received with ``recv_into`` straight into one reusable
+    :class:`bytearray` instead of going through the file object layers of
+    :meth:`GreenSocket.makefile`.  Besides the usual file methods it offers
+    :meth:`read_exactly` and :meth:`readuntil`, and its :meth:`peek`
+    returns whatever is buffered without waiting for more.
+
+    Any object with blocking ``recv`` and ``recv_into`` methods will do
+    for *sock*.  Closing the reader does not close the socket.
+    """
+
+    def __init__(self, sock, bufsize=io.DEFAULT_BUFFER_SIZE):
+        self.sock = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._pos = 0
+        self._end = 0
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.closed = True
+        self._pos = self._end = 0
+
+    @property
+    def buffered(self):
+        """Number of bytes that can be read without receiving."""
+        return self._end - self._pos
+
+    def _take(self, n):
+        pos = self._pos
+        self._pos = pos + n
+        return self._view[pos:pos + n].tobytes()
+
+    def _fill(self):
+        """Receive once into the free end of the buffer, first making room
+        if there is none.  Returns the number of bytes received, 0 at EOF.
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        pos = self._pos
+        end = self._end
+        if pos == end:
+            pos = end = 0
+        elif end == len(self._buf):
+            if pos:
+                self._view[:end - pos] = self._view[pos:end].tobytes()
+            else:
+                # never resized in place: a memoryview still held by a
+                # traceback would make that fail
+                buf = bytearray(end * 2)
+                buf[:end] = self._buf
+                self._buf = buf
+                self._view = memoryview(buf)
+            pos, end = 0, end - pos
+        self._pos = pos
+        self._end = end
+        n = self.sock.recv_into(self._view[end:])
+        self._end = end + n
+        return n
+
+    def peek(self, n=0):
+        """Return the buffered data without consuming it.  Receives only if
+        the buffer is empty."""
+        if self._pos == self._end:
+            self._fill()
+        return self._view[self._pos:self._end].tobytes()
+
+    def read1(self, n=-1):
+        """Read at most *n* bytes with at most one receive."""
+        if self._pos == self._end:
+            self._fill()
+        avail = self._end - self._pos
+        if n is None or n < 0 or n > avail:
+            n = avail
+        return self._take(n)
+
+    def read(self, n=-1):
+        """Read *n* bytes, fewer only at EOF.  Reads until EOF if *n* is
+        negative or omitted."""
+        if n is None or n < 0:
+            chunks = [self._take(self._end - self._pos)]
+            while self._fill():
+                chunks.append(self._take(self._end - self._pos))
+            return b''.join(chunks)
+        avail = self._end - self._pos
+        if n <= avail:
+            return self._take(n)
+        if n - avail > len(self._buf):
+            return self._read_large(n)
+        while self._end - self._pos < n and self._fill():
+            pass
+        return self._take(min(n, self._end - self._pos))
+
+    def _read_large(self, n):
+        # Like io.BufferedReader, receive straight into the object that is
+        # returned: every extra buffer of that size costs a page fault per
+        # page.  BytesIO.getvalue() hands its buffer over without a copy.
+        # *n* may come from the peer, so the space is not set aside all at
+        # once: it starts at a few times the buffer size and doubles as it
+        # is filled.
+        data = self._take(self._end - self._pos)
+        got = len(data)
+        size = min(n, got + 4 * len(self._buf))
+        if not _bytesio_getbuffer:
+            chunks = [data]
+            while got < n:
+                chunk = self.sock.recv(min(n, size) - got)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                got += len(chunk)
+                if got == size:
+                    size *= 2
+            return b''.join(chunks)
+        bio = io.BytesIO()
+        bio.write(data)
+        while got < n:
+            bio.seek(size - 1)
+            bio.write(b'\0')
+            view = bio.getbuffer()
+            try:
+                while got < size:
+                    received = self.sock.recv_into(view[got:])
+                    if not received:
+                        break
+                    got += received
+            finally:
+                view.release()
+            if got < size:
+                break
+            size = min(n, size * 2)
+        bio.truncate(got)
+        return bio.getvalue()
+
+    def read_exactly(self, n):
+        """Read exactly *n* bytes.  Raises :exc:`EOFError` if the peer
+        closes the connection before they arrive."""
+        data = self.read(n)
+        if len(data) < n:
+            raise EOFError('expected %d bytes, got %d before EOF' % (n, len(data)))
+        return data
+
+    def readinto(self, b):
+        """Fill the writable buffer *b*, less of it only at EOF.  Returns the
+        number of bytes read.  Large reads go straight into *b*."""
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        view = memoryview(b)
+        want = len(view)
+        got = min(want, self._end - self._pos)
+        if got:
+            view[:got] = self._view[self._pos:self._pos + got]
+            self._pos += got
+        while got < want:
+            if want - got >= len(self._buf):
+                n = self.sock.recv_into(view[got:])
+                if not n:
+                    break
+            else:
+                if not self._fill():
+                    break
+                n = min(want - got, self._end - self._pos)
+                view[got:got + n] = self._view[self._pos:self._pos + n]
+                self._pos += n
+            got += n
+        return got
+
+    def readuntil(self, delim, limit=-1):
+        """Read up to and including *delim*.  The result does not end with
+        *delim* if *limit* bytes (when non-negative) were read first, or if
+        the peer closed the connection."""
+        dlen = len(delim)
+        scanned = 0
+        while True:
+            pos = self._pos
+            avail = self._end - pos
+            if 0 <= limit < avail:
+                avail = limit
+            i = self._buf.find(delim, pos + scanned, pos + avail)
+            if i >= 0:
+                return self._take(i + dlen - pos)
+            if avail == limit:
+                return self._take(limit)
+            scanned = max(0, avail - dlen + 1)
+            if not self._fill():
+                return self._take(self._end - self._pos)
+
+    def readline(self, limit=-1):
+        if limit is None:
+            limit = -1
+        # a whole line is usually buffered already
+        pos = self._pos
+        end = self._end
+        if 0 <= limit < end - pos:
+            end = pos + limit
+        i = self._buf.find(b'\n', pos, end) + 1
+        if i:
+            self._pos = i
+            return self._view[pos:i].tobytes()
+        return self.readuntil(b'\n', limit)
+
+    def readlines(self, hint=-1):
+        if hint is None or hint <= 0:
+            return list(self)
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if total >= hint:
+                break
+        return lines
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    next = __next__
+
+
 def _operation_on_closed_file(*args, **kwargs):
     raise ValueError("I/O operation on closed file")
 
@@ -0,0 +1,285 @@
+"""Run several hubs, one per OS thread, and hand work between them.
+
+Every hub runs in the thread that created it, so a single process normally
+keeps one core busy.  Work that releases the GIL (SSL, zlib, hashing, C
+parsers) can use more cores when connections are spread over several hubs:
+
+>>> from eventlet import hubgroup
+>>> group = hubgroup.HubGroup(2)
+>>> group.start()
+>>> group.spawn(sum, [1, 2, 3]).wait()
+6
+>>> group.stop()
+
+Greenthreads can only be switched to from their own hub, so everything that
+crosses hubs goes through a :class:`Mailbox`: a queue of callables plus a
+wakeup socket that the receiving hub waits on.
+"""
+import collections
+import errno
+import sys
+
+from eventlet import convenience, event, greenio, greenthread, hubs, patcher
+from eventlet.support import get_errno, greenlets as greenlet, six
+
+__all__ = ['HubGroup', 'Mailbox', 'Event', 'get_mailbox']
+
+socket = patcher.original('socket')
+threading = patcher.original('threading')
+
+_local = threading.local()
+
+
+class Mailbox(object):
+    """Runs callables in greenthreads of the hub that created the mailbox.
+    :meth:`call` may be used from any OS thread.
+
+    Use :func:`get_mailbox` rather than creating mailboxes directly.
+    """
+
+    def __init__(self):
+        self.hub = hubs.get_hub()
+        self._queue = collections.deque()
+        self._signaled = False
+        self._closed = False
+        rsock, self._wsock = _socketpair()
+        self._wsock.setblocking(False)
+        self._rsock = greenio.GreenSocket(rsock)
+        self._reader = greenthread.spawn(self._run)
+
+    def call(self, func, *args, **kwargs):
+        """Arrange for ``func(*args, **kwargs)`` to be spawned in this
+        mailbox's hub."""
+        if self._closed:
+            raise RuntimeError('mailbox is closed')
+        self._queue.append((func, args, kwargs))
+        # the reader clears the flag before draining the queue, so an item
+        # appended while the flag is still set is always picked up
+        if not self._signaled:
+            self._signaled = True
+            try:
+                self._wsock.send(b'\0')
+            except socket.error as e:
+                # a full buffer already guarantees a wakeup
+                if get_errno(e) not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+
+    def _run(self):
+        queue = self._queue
+        while not self._closed:
+            try:
+                if not self._rsock.recv(4096):
+                    break
+            except (IOError, socket.error):
+                break
+            self._signaled = False
+            while queue:
+                func, args, kwargs = queue.popleft()
+                greenthread.spawn_n(func, *args, **kwargs)
+
+    def close(self):
+        """Stop accepting calls.  Must be called from the mailbox's hub."""
+        self._closed = True
+        self._reader.kill()
+        self._wsock.close()
+        self._rsock.close()
+
+
+def _socketpair():
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    # Windows, Python 2
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    wsock = socket.socket()
+    wsock.connect(listener.getsockname())
+    rsock = listener.accept()[0]
+    listener.close()
+    return rsock, wsock
+
+
+def get_mailbox():
+    """Return the :class:`Mailbox` of the current thread's hub, creating it
+    on first use."""
+    hub = hubs.get_hub()
+    mailbox = getattr(_local, 'mailbox', None)
+    if mailbox is None or mailbox.hub is not hub or mailbox._closed:
+        mailbox = _local.mailbox = Mailbox()
+    return mailbox
+
+
+class Event(object):
+    """Like :class:`eventlet.event.Event`, but :meth:`send` may be called
+    from any OS thread and :meth:`wait` from greenthreads of any hub.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._result = event.NOT_USED
+        self._exc = None
+
+    def ready(self):
+        return self._result is not event.NOT_USED
+
+    def send(self, result=None, exc=None):
+        with self._lock:
+            assert self._result is event.NOT_USED, 'Trying to re-send() an already-triggered event.'
+            self._result = result
+            if exc is not None and not isinstance(exc, tuple):
+                exc = (exc, )
+            self._exc = exc
+            waiters, self._waiters = self._waiters, []
+        for mailbox, local in waiters:
+            mailbox.call(_send_local, local, result, exc)
+
+    def send_exception(self, *args):
+        return self.send(None, args)
+
+    def wait(self):
+        """Wait until another greenthread or thread calls :meth:`send`, then
+        return its result or raise its exception."""
+        with self._lock:
+            if self._result is event.NOT_USED:
+                local = event.Event()
+                waiter = (get_mailbox(), local)
+                self._waiters.append(waiter)
+            else:
+                local = waiter = None
+        if local is not None:
+            try:
+                return local.wait()
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+        if self._exc is not None:
+            six.reraise(*self._exc)
+        return self._result
+
+
+def _send_local(local, result, exc):
+    if not local.ready():
+        local.send(result, exc)
+
+
+def _call_into(result, func, args, kwargs):
+    try:
+        value = func(*args, **kwargs)
+    except greenlet.GreenletExit as e:
+        result.send(e)
+    except BaseException:
+        result.send(None, sys.exc_info())
+    else:
+        result.send(value)
+
+
+class HubGroup(object):
+    """A fixed set of OS threads, each running its own hub.
+
+    *size* defaults to the number of CPUs.  *hub* selects the hub used by
+    the member threads, as accepted by :func:`eventlet.hubs.use_hub`; by
+    default they use the default hub.
+    """
+
+    def __init__(self, size=None, hub=None):
+        if size is None:
+            import multiprocessing
+            size = multiprocessing.cpu_count()
+        self.size = size
+        self.hub = hub
+        self.mailboxes = []
+        self._stopped = []
+        self._threads = []
+        self._listeners = []
+        self._next = 0
+
+    def start(self):
+        """Start the member threads and wait until their hubs run."""
+        assert not self._threads, 'HubGroup already started'
+        self.mailboxes = [None] * self.size
+        self._stopped = [None] * self.size
+        started = [threading.Event() for _ in six.moves.range(self.size)]
+        for index in six.moves.range(self.size):
+            thread = threading.Thread(target=self._run, args=(index, started[index]),
+                                      name='eventlet.hubgroup-%d' % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        for ready in started:
+            ready.wait()
+
+    def _run(self, index, started):
+        if self.hub is not None:
+            hubs.use_hub(self.hub)
+        mailbox = get_mailbox()
+        stopped = self._stopped[index] = event.Event()
+        self.mailboxes[index] = mailbox
+        started.set()
+        stopped.wait()
+        mailbox.close()
+
+    def _pick(self):
+        index = self._next
+        self._next = (index + 1) % self.size
+        return self.mailboxes[index]
+
+    def spawn(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in a greenthread of the next member
+        hub, round robin.  Returns an :class:`Event` for the result, which
+        may be waited on from any hub."""
+        result = Event()
+        self._pick().call(_call_into, result, func, args, kwargs)
+        return result
+
+    def spawn_n(self, func, *args, **kwargs):
+        """Same as :meth:`spawn`, without a way to retrieve the result."""
+        self._pick().call(func, *args, **kwargs)
+
+    def serve(self, sock, handle, concurrency=1000):
+        """Serve *sock* from every member hub, as with
+        :func:`eventlet.serve`.  Each hub accepts connections on the shared
+        listening socket whenever it is idle, so new connections go to the
+        hubs that have time for them.  Returns immediately.
+        """
+        for mailbox in self.mailboxes:
+            # a socket object must not be waited on by two hubs at once, so
+            # every hub gets its own descriptor for the listening socket
+            listener = socket.fromfd(sock.fileno(), sock.family, sock.type)
+            self._listeners.append(listener)
+            mailbox.call(_serve, listener, handle, concurrency)
+
+    def stop(self, timeout=None):
+        """Stop all member hubs and join their threads.  Greenthreads still
+        running in them are abandoned."""
+        for mailbox, stopped in zip(self.mailboxes, self._stopped):
+            mailbox.call(_stop, stopped)
+        for thread in self._threads:
+            thread.join(timeout)
+        for listener in self._listeners:
+            listener.close()
+        self._threads = []
+        self._listeners = []
+        self._stopped = []
+        self.mailboxes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _serve(sock, handle, concurrency):
+    try:
+        convenience.serve(greenio.GreenSocket(sock), handle, concurrency)
+    except (IOError, socket.error):
+        # the listening socket was closed
+        pass
+
+
+def _stop(stopped):
+    if not stopped.ready():
+        stopped.send()
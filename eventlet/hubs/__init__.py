@@ -1,10 +1,11 @@
 import os
+import warnings
 
 from eventlet import patcher
 from eventlet.support import greenlets as greenlet, six
 
 
-__all__ = ["use_hub", "get_hub", "get_default_hub", "trampoline"]
+__all__ = ["use_hub", "get_hub", "get_default_hub", "trampoline", "FdWaiter"]
 
 threading = patcher.original('threading')
 _threadlocal = threading.local()
@@ -60,9 +61,10 @@ def use_hub(mod=None):
     convention, otherwise use_hub looks for a matching setuptools entry point
     in the 'eventlet.hubs' group to load or finally tries to import
     `eventlet.hubs.mod` and use that as the hub module.  If *mod* is None,
-    use_hub uses the default hub.  Only call use_hub during application
-    initialization,  because it resets the hub's state and any existing
-    timers or listeners will never be resumed.
+    use_hub uses the default hub.  A hub module whose ``is_available()``
+    returns False is replaced by the default hub with a warning.  Only call
+    use_hub during application initialization,  because it resets the hub's
+    state and any existing timers or listeners will never be resumed.
     """
     if mod is None:
         mod = os.environ.get('EVENTLET_HUB', None)
@@ -96,6 +98,11 @@ def use_hub(mod=None):
             if not found:
                 mod = __import__(
                     'eventlet.hubs.' + mod, globals(), locals(), ['Hub'])
+    is_available = getattr(mod, 'is_available', None)
+    if is_available is not None and not is_available():
+        warnings.warn('%s is not available (%s), using the default hub instead' % (
+            mod.__name__, getattr(mod, 'unavailable_reason', None)), RuntimeWarning)
+        mod = get_default_hub()
     if hasattr(mod, 'Hub'):
         _threadlocal.Hub = mod.Hub
     else:
@@ -168,6 +175,132 @@ def trampoline(fd, read=None, write=None, timeout=None,
             t.cancel()
 
 
+class _WaitTimer(object):
+    """Timeout slot of an :class:`FdWaiter`.  Unlike
+    :class:`eventlet.hubs.timer.Timer` it can be rescheduled after it fired
+    or was canceled, which is only safe with a timer store that forgets
+    canceled timers right away (see :meth:`BaseHub.set_timer_wheel`).
+    """
+    called = True
+
+    def __init__(self):
+        self.seconds = None
+        self.greenlet = None
+        self.exc = None
+
+    def arm(self, hub, seconds, current, exc):
+        self.seconds = seconds
+        self.greenlet = current
+        self.exc = exc
+        self.called = False
+        hub.add_timer(self)
+
+    def __call__(self):
+        if not self.called:
+            self.called = True
+            self.greenlet.throw(self.exc)
+
+    def cancel(self):
+        if not self.called:
+            self.called = True
+            get_hub().timer_canceled(self)
+
+    def __lt__(self, other):
+        return id(self) < id(other)
+
+
+class FdWaiter(object):
+    """Reusable :func:`trampoline` for a single file descriptor.
+
+    A greenthread that blocks on the same descriptor over and over (a recv
+    loop on a keep-alive connection) pays for a new listener, timer and
+    timeout closure on every :func:`trampoline` call, plus registering and
+    unregistering the descriptor with the OS poller.  An FdWaiter keeps one
+    listener and one timer per direction and asks the hub to leave the
+    descriptor registered between waits; the registration is narrowed down
+    by the hub if an event arrives while nobody waits, and dropped by
+    :meth:`release`.
+
+    Hubs that track readiness in user space (:mod:`eventlet.hubs.epolls_et`)
+    are asked first whether the descriptor became ready since the last wait,
+    in which case :meth:`wait` returns without switching to the hub.
+
+    Hubs that do not support listener reuse get a plain :func:`trampoline`.
+
+    .. note :: |internal|
+    """
+
+    def __init__(self, fileno):
+        self.fileno = fileno
+        self.hub = None
+        self.listeners = None
+        self.timers = None
+
+    def _bind(self, hub):
+        self.hub = hub
+        listeners = {}
+        for evtype in (hub.READ, hub.WRITE):
+            listener = hub.lclass(evtype, self.fileno, None, None, None)
+            listener.owner = self
+            listeners[evtype] = listener
+        self.listeners = listeners
+        self.timers = {hub.READ: _WaitTimer(), hub.WRITE: _WaitTimer()}
+
+    def wait(self, read=False, write=False, timeout=None,
+             timeout_exc=timeout.Timeout, mark_as_closed=None):
+        """Same as :func:`trampoline` on this waiter's descriptor."""
+        hub = get_hub()
+        if not hub.listener_reuse:
+            return trampoline(self.fileno, read=read, write=write, timeout=timeout,
+                              timeout_exc=timeout_exc, mark_as_closed=mark_as_closed)
+        if hub is not self.hub:
+            self._bind(hub)
+        current = greenlet.getcurrent()
+        assert hub.greenlet is not current, 'do not call blocking functions from the mainloop'
+        assert not (
+            read and write), 'not allowed to trampoline for reading and writing'
+        evtype = hub.READ if read else hub.WRITE
+        if hub.consume_ready(self.fileno, evtype):
+            # an edge arrived since the last wait; let the caller retry
+            return
+        listener = self.listeners[evtype]
+        if hub.listeners[evtype].get(self.fileno) is listener:
+            # another greenthread is using this waiter; let the hub decide
+            # whether a second simultaneous wait is allowed
+            return trampoline(self.fileno, read=read, write=write, timeout=timeout,
+                              timeout_exc=timeout_exc, mark_as_closed=mark_as_closed)
+        listener.cb = current.switch
+        listener.tb = current.throw
+        listener.greenlet = current
+        listener.mark_as_closed = mark_as_closed
+        listener.spent = False
+        t = None
+        if timeout is not None:
+            if hub.timer_wheel is not None:
+                t = self.timers[evtype]
+                t.arm(hub, timeout, current, timeout_exc)
+            else:
+                t = hub.schedule_call_global(timeout, current.throw, timeout_exc)
+        try:
+            hub.add_listener(listener)
+            try:
+                return hub.switch()
+            finally:
+                hub.remove(listener)
+        finally:
+            # don't keep the socket object alive through its close callback
+            listener.mark_as_closed = None
+            if t is not None:
+                t.cancel()
+
+    def release(self):
+        """Drop the registration kept between waits.  Call this before the
+        descriptor is closed."""
+        hub = self.hub
+        if hub is not None and getattr(_threadlocal, 'hub', None) is hub:
+            hub.release_registration(self.fileno, self)
+
+
 def notify_close(fd):
     """
     A particular file descriptor has been explicitly closed. Register for any
@@ -24,7 +24,7 @@ else:
                     " NOT http://pypi.python.org/pypi/pyepoll/. "
                     " easy_install pyepoll installs the wrong version.")
 
-from eventlet.hubs.hub import BaseHub
+from eventlet.hubs.hub import BaseHub, process_id
 from eventlet.hubs import poll
 from eventlet.hubs.poll import READ, WRITE
 
@@ -35,27 +35,43 @@ from eventlet.hubs.poll import READ, WRITE
 class Hub(poll.Hub):
     def __init__(self, clock=None):
         BaseHub.__init__(self, clock)
+        self._open_epoll()
+        self.kept = {}
+
+    def _open_epoll(self):
         self.poll = epoll()
         try:
             # modify is required by select.epoll
             self.modify = self.poll.modify
         except AttributeError:
             self.modify = self.poll.register
+        self.process_id = process_id()
 
-    def add(self, evtype, fileno, cb, tb, mac):
-        oldlisteners = bool(self.listeners[READ].get(fileno) or
-                            self.listeners[WRITE].get(fileno))
-        listener = BaseHub.add(self, evtype, fileno, cb, tb, mac)
-        try:
-            if not oldlisteners:
-                # Means we've added a new listener
+    def _after_fork(self):
+        # A forked child shares the kernel side of the epoll set with its
+        # parent, so registrations kept between waits by one process could be
+        # dropped under the other's feet.  Start over with a set of our own.
+        self.poll.close()
+        self._open_epoll()
+        self.kept.clear()
+        filenos = set(self.listeners[READ]) | set(self.listeners[WRITE])
+        for fileno in filenos:
+            try:
                 self.register(fileno, new=True)
-            else:
-                self.register(fileno, new=False)
+            except ValueError:
+                pass
+
+    def add_listener(self, listener):
+        if self.process_id != process_id():
+            self._after_fork()
+        try:
+            return super(Hub, self).add_listener(listener)
         except IOError as ex:    # ignore EEXIST, #80
             if get_errno(ex) != errno.EEXIST:
                 raise
         return listener
 
     def do_poll(self, seconds):
+        if self.maxevents:
+            return self.poll.poll(seconds, self.maxevents)
         return self.poll.poll(seconds)
@@ -0,0 +1,185 @@
+"""Edge-triggered variant of the epoll hub.
+
+Descriptors waited on through a :class:`eventlet.hubs.FdWaiter` (every
+:class:`eventlet.greenio.GreenSocket`) are registered once, for reading and
+writing, with ``EPOLLET`` and stay registered until the socket is closed.
+Readiness edges that arrive while nobody waits are remembered in
+:attr:`Hub.ready` and consumed by the next wait, which then returns without
+going through the hub, so a blocking recv or send costs no ``epoll_ctl``
+calls at all.
+
+Descriptors waited on with a plain :func:`eventlet.hubs.trampoline` are
+handled level-triggered, exactly like :mod:`eventlet.hubs.epolls` does.
+
+Select it with ``eventlet.hubs.use_hub('epolls_et')`` or
+``EVENTLET_HUB=epolls_et``.
+"""
+import errno
+import sys
+
+from eventlet import patcher
+from eventlet.support import get_errno, clear_sys_exc_info
+from eventlet.hubs import epolls
+from eventlet.hubs.hub import BaseHub, process_id
+from eventlet.hubs.poll import (
+    READ, WRITE, READ_MASK, WRITE_MASK, EXC_MASK, READ_EXC_MASK, WRITE_EXC_MASK, POLLNVAL)
+
+select = patcher.original('select')
+time = patcher.original('time')
+
+EPOLLET = getattr(select, 'EPOLLET', 1 << 31)
+EDGE_MASK = READ_MASK | WRITE_MASK | EXC_MASK | EPOLLET
+
+READY_READ = 1
+READY_WRITE = 2
+_ready_flag = {READ: READY_READ, WRITE: READY_WRITE}
+
+
+class Hub(epolls.Hub):
+    def __init__(self, clock=None):
+        super(Hub, self).__init__(clock)
+        # fileno -> FdWaiter owning the edge-triggered registration
+        self.edge = {}
+        # fileno -> READY_* bits for edges nobody has waited for yet
+        self.ready = {}
+
+    def consume_ready(self, fileno, evtype):
+        bits = self.ready.get(fileno)
+        if bits:
+            flag = _ready_flag[evtype]
+            if bits & flag:
+                self.ready[fileno] = bits & ~flag
+                return True
+        return False
+
+    def add_listener(self, listener):
+        if self.process_id != process_id():
+            self._after_fork()
+        fileno = listener.fileno
+        owner = listener.owner
+        edge_owner = self.edge.get(fileno)
+        if owner is not None and edge_owner is owner:
+            return BaseHub.add_listener(self, listener)
+        if edge_owner is not None:
+            # somebody else wants this descriptor, go back to level-triggered
+            self._drop_edge(fileno)
+            listener = BaseHub.add_listener(self, listener)
+            self.register(fileno)
+            return listener
+        if owner is None or (self.listeners[READ].get(fileno) or
+                             self.listeners[WRITE].get(fileno)):
+            return super(Hub, self).add_listener(listener)
+        listener = BaseHub.add_listener(self, listener)
+        self.kept.pop(fileno, None)
+        try:
+            try:
+                self.poll.register(fileno, EDGE_MASK)
+            except IOError as ex:
+                if get_errno(ex) != errno.EEXIST:
+                    raise
+                self.modify(fileno, EDGE_MASK)
+        except ValueError:
+            self.remove_descriptor(fileno)
+            raise
+        self.edge[fileno] = owner
+        # the kernel reports the current state on registration
+        self.ready.pop(fileno, None)
+        return listener
+
+    def remove(self, listener):
+        if listener.fileno in self.edge:
+            BaseHub.remove(self, listener)
+        else:
+            super(Hub, self).remove(listener)
+
+    def release_registration(self, fileno, owner):
+        if self.edge.get(fileno) is owner:
+            self._drop_edge(fileno)
+            self.register(fileno)
+        else:
+            super(Hub, self).release_registration(fileno, owner)
+
+    def _after_fork(self):
+        self.edge.clear()
+        self.ready.clear()
+        super(Hub, self)._after_fork()
+
+    def _drop_edge(self, fileno):
+        self.edge.pop(fileno, None)
+        self.ready.pop(fileno, None)
+
+    def mark_as_reopened(self, fileno):
+        self._drop_edge(fileno)
+        super(Hub, self).mark_as_reopened(fileno)
+
+    def remove_descriptor(self, fileno):
+        self._drop_edge(fileno)
+        super(Hub, self).remove_descriptor(fileno)
+
+    def wait(self, seconds=None):
+        readers = self.listeners[READ]
+        writers = self.listeners[WRITE]
+
+        if not readers and not writers:
+            # pending edges stay queued in the kernel until the next poll
+            if seconds:
+                time.sleep(seconds)
+            return
+        try:
+            presult = self.do_poll(seconds)
+        except (IOError, select.error) as e:
+            if get_errno(e) == errno.EINTR:
+                return
+            raise
+        SYSTEM_EXCEPTIONS = self.SYSTEM_EXCEPTIONS
+
+        if self.debug_blocking:
+            self.block_detect_pre()
+
+        callbacks = []
+        append = callbacks.append
+        kept = self.kept
+        edge = self.edge
+        ready = self.ready
+        for fileno, event in presult:
+            if fileno in edge:
+                reader = readers.get(fileno) if event & READ_EXC_MASK else None
+                writer = writers.get(fileno) if event & WRITE_EXC_MASK else None
+                if reader is not None:
+                    append(reader)
+                if writer is not None:
+                    append(writer)
+                bits = 0
+                if reader is None and event & READ_EXC_MASK:
+                    bits = READY_READ
+                if writer is None and event & WRITE_EXC_MASK:
+                    bits |= READY_WRITE
+                if bits:
+                    ready[fileno] = ready.get(fileno, 0) | bits
+                continue
+            if event & POLLNVAL:
+                self.remove_descriptor(fileno)
+                continue
+            reader = readers.get(fileno) if event & READ_EXC_MASK else None
+            writer = writers.get(fileno) if event & WRITE_EXC_MASK else None
+            if reader is not None:
+                append(reader)
+            if writer is not None:
+                append(writer)
+            if fileno in kept and (
+                    (event & READ_MASK and reader is None) or
+                    (event & WRITE_MASK and writer is None) or
+                    (event & EXC_MASK and reader is None and writer is None)):
+                self.register(fileno)
+
+        for listener in callbacks:
+            try:
+                listener.cb(listener.fileno)
+            except SYSTEM_EXCEPTIONS:
+                raise
+            except BaseException:
+                self.squelch_exception(listener.fileno, sys.exc_info())
+                clear_sys_exc_info()
+
+        if self.debug_blocking:
+            self.block_detect_post()
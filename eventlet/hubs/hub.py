@@ -1,10 +1,15 @@
 import errno
 import heapq
 import math
+import os
 import signal
 import sys
 import traceback
 
+from eventlet.hubs import timer, IOClosed
+from eventlet.hubs.timerwheel import TimerWheel
+from eventlet.support import greenlets as greenlet, clear_sys_exc_info, monotonic, six
+
 arm_alarm = None
 if hasattr(signal, 'setitimer'):
     def alarm_itimer(seconds):
@@ -19,14 +24,26 @@ else:
             signal.alarm(math.ceil(seconds))
         arm_alarm = alarm_signal
 
-from eventlet.hubs import timer, IOClosed
-from eventlet.support import greenlets as greenlet, clear_sys_exc_info, monotonic, six
-
 g_prevent_multiple_readers = True
 
 READ = "read"
 WRITE = "write"
 
+if hasattr(os, 'register_at_fork'):
+    _forks = [0]
+
+    def _count_fork():
+        _forks[0] += 1
+
+    os.register_at_fork(after_in_child=_count_fork)
+
+    def process_id():
+        """ Returns a value that changes in forked children, for hubs whose
+        kernel-side state is shared with the parent after a fork. """
+        return _forks[0]
+else:
+    process_id = os.getpid
+
 
 def closed_callback(fileno):
     """ Used to de-fang a callback that may be triggered by a loop in BaseHub.wait
@@ -59,6 +76,8 @@ class FdListener(object):
         self.mark_as_closed = mark_as_closed
         self.spent = False
         self.greenlet = greenlet.getcurrent()
+        # the hubs.FdWaiter this listener is reused by, if any
+        self.owner = None
 
     def __repr__(self):
         return "%s(%r, %r, %r, %r)" % (type(self).__name__, self.evtype, self.fileno,
@@ -111,6 +130,10 @@ class BaseHub(object):
     READ = READ
     WRITE = WRITE
 
+    # True if add_listener() and release_registration() are implemented, which
+    # allows hubs.FdWaiter to reuse its listeners
+    listener_reuse = False
+
     def __init__(self, clock=None):
         self.listeners = {READ: {}, WRITE: {}}
         self.secondaries = {READ: {}, WRITE: {}}
@@ -127,6 +150,7 @@ class BaseHub(object):
         self.next_timers = []
         self.lclass = FdListener
         self.timers_canceled = 0
+        self.timer_wheel = None
         self.debug_exceptions = True
         self.debug_blocking = False
         self.debug_blocking_resolution = 1
@@ -163,6 +187,15 @@ class BaseHub(object):
         close operations from accidentally shutting down the wrong OS thread.
         """
         listener = self.lclass(evtype, fileno, cb, tb, mark_as_closed)
+        return self.add_listener(listener)
+
+    def add_listener(self, listener):
+        """ Starts waiting on an already constructed *listener*, as created by
+        :meth:`add`.  Hubs that register file descriptors with the OS
+        extend this method rather than :meth:`add`.
+        """
+        evtype = listener.evtype
+        fileno = listener.fileno
         bucket = self.listeners[evtype]
         if fileno in bucket:
             if g_prevent_multiple_readers:
@@ -175,13 +208,26 @@ class BaseHub(object):
                     "this error, call "
                     "eventlet.debug.hub_prevent_multiple_readers(False) - MY THREAD=%s; "
                     "THAT THREAD=%s" % (
-                        evtype, fileno, evtype, cb, bucket[fileno]))
+                        evtype, fileno, evtype, listener.cb, bucket[fileno]))
             # store off the second listener in another structure
             self.secondaries[evtype].setdefault(fileno, []).append(listener)
         else:
             bucket[fileno] = listener
         return listener
 
+    def release_registration(self, fileno, owner):
+        """ Drops any OS registration of *fileno* kept alive between waits on
+        behalf of *owner*, a :class:`eventlet.hubs.FdWaiter`.
+        """
+        pass
+
+    def consume_ready(self, fileno, evtype):
+        """ Returns True if *fileno* is known to have become ready for
+        *evtype* since it was last waited on, forgetting that readiness.
+        Only hubs that track readiness in user space ever return True.
+        """
+        return False
+
     def _obsolete(self, fileno):
         """ We've received an indication that 'fileno' has been obsoleted.
             Any current listeners must be defanged, and notifications to
@@ -311,6 +357,8 @@ class BaseHub(object):
         return 60.0
 
     def sleep_until(self):
+        if self.timer_wheel is not None:
+            return self.timer_wheel.next_deadline()
         t = self.timers
         if not t:
             return None
@@ -351,6 +399,8 @@ class BaseHub(object):
                 self.timers_canceled = 0
                 del self.timers[:]
                 del self.next_timers[:]
+                if self.timer_wheel is not None:
+                    self.timer_wheel.clear()
         finally:
             self.running = False
             self.stopping = False
@@ -389,10 +439,16 @@ class BaseHub(object):
 
     def add_timer(self, timer):
         scheduled_time = self.clock() + timer.seconds
-        self.next_timers.append((scheduled_time, timer))
+        if self.timer_wheel is not None:
+            self.timer_wheel.add(timer, scheduled_time)
+        else:
+            self.next_timers.append((scheduled_time, timer))
         return scheduled_time
 
     def timer_canceled(self, timer):
+        if self.timer_wheel is not None:
+            self.timer_wheel.remove(timer)
+            return
         self.timers_canceled += 1
         len_timers = len(self.timers) + len(self.next_timers)
         if len_timers > 1000 and len_timers / 2 <= self.timers_canceled:
@@ -402,6 +458,8 @@ class BaseHub(object):
             heapq.heapify(self.timers)
 
     def prepare_timers(self):
+        if self.timer_wheel is not None:
+            return
         heappush = heapq.heappush
         t = self.timers
         for item in self.next_timers:
@@ -437,6 +495,9 @@ class BaseHub(object):
         return t
 
     def fire_timers(self, when):
+        if self.timer_wheel is not None:
+            self._fire_wheel_timers(when)
+            return
         t = self.timers
         heappop = heapq.heappop
 
@@ -462,6 +523,43 @@ class BaseHub(object):
                 self.squelch_timer_exception(timer, sys.exc_info())
                 clear_sys_exc_info()
 
+    def _fire_wheel_timers(self, when):
+        for t in self.timer_wheel.expire(when):
+            try:
+                if not t.called:
+                    t()
+            except self.SYSTEM_EXCEPTIONS:
+                raise
+            except BaseException:
+                self.squelch_timer_exception(t, sys.exc_info())
+                clear_sys_exc_info()
+
+    def set_timer_wheel(self, value, resolution=0.001):
+        """Switch the timer store between the default binary heap and a
+        hierarchical timing wheel (see :mod:`eventlet.hubs.timerwheel`).
+
+        The wheel schedules and cancels timers in constant time, which pays
+        off when many timers are alive and most are canceled before they
+        fire.  *resolution* is the length of a tick of the finest wheel, in
+        seconds.  Pending timers are carried over in both directions.
+        """
+        if value:
+            if self.timer_wheel is not None:
+                return
+            self.prepare_timers()
+            wheel = TimerWheel(self.clock(), resolution)
+            for scheduled_time, t in self.timers:
+                if not t.called:
+                    wheel.add(t, scheduled_time)
+            self.timers = []
+            self.timers_canceled = 0
+            self.timer_wheel = wheel
+        else:
+            if self.timer_wheel is None:
+                return
+            self.next_timers.extend(self.timer_wheel.items())
+            self.timer_wheel = None
+
     # for debugging:
 
     def get_readers(self):
@@ -471,6 +569,8 @@ class BaseHub(object):
         return self.listeners[WRITE].values()
 
     def get_timers_count(hub):
+        if hub.timer_wheel is not None:
+            return len(hub.timer_wheel)
         return len(hub.timers) + len(hub.next_timers)
 
     def set_debug_listeners(self, value):
@@ -18,6 +18,7 @@ FILTERS = {READ: select.KQ_FILTER_READ,
 
 class Hub(BaseHub):
     MAX_EVENTS = 100
+    listener_reuse = True
 
     def __init__(self, clock=None):
         super(Hub, self).__init__(clock)
@@ -46,8 +47,10 @@ class Hub(BaseHub):
                 return self.kqueue.control(events, max_events, timeout)
             raise
 
-    def add(self, evtype, fileno, cb, tb, mac):
-        listener = super(Hub, self).add(evtype, fileno, cb, tb, mac)
+    def add_listener(self, listener):
+        listener = super(Hub, self).add_listener(listener)
+        evtype = listener.evtype
+        fileno = listener.fileno
         events = self._events.setdefault(fileno, {})
         if evtype not in events:
             try:
@@ -5,15 +5,27 @@ from eventlet import patcher
 select = patcher.original('select')
 time = patcher.original('time')
 
-from eventlet.hubs.hub import BaseHub, READ, WRITE, noop
+from eventlet.hubs.hub import BaseHub, READ, WRITE
 from eventlet.support import get_errno, clear_sys_exc_info
 
 EXC_MASK = select.POLLERR | select.POLLHUP
 READ_MASK = select.POLLIN | select.POLLPRI
 WRITE_MASK = select.POLLOUT
+READ_EXC_MASK = READ_MASK | EXC_MASK
+WRITE_EXC_MASK = WRITE_MASK | EXC_MASK
+POLLNVAL = select.POLLNVAL
 
 
 class Hub(BaseHub):
+    listener_reuse = True
+
+    # Upper bound on the number of events handled by one wait(); events
+    # beyond it stay pending in the kernel and are picked up on the next
+    # iteration, after timers have had a chance to run.  None for no limit.
+    # Only honoured by the epoll hubs, plain poll(2) cannot limit its result
+    # without always favouring the lowest registered descriptors.
+    maxevents = None
+
     def __init__(self, clock=None):
         super(Hub, self).__init__(clock)
         self.poll = select.poll()
@@ -22,22 +34,55 @@ class Hub(BaseHub):
             self.modify = self.poll.modify
         except AttributeError:
             self.modify = self.poll.register
-
-    def add(self, evtype, fileno, cb, tb, mac):
-        listener = super(Hub, self).add(evtype, fileno, cb, tb, mac)
-        self.register(fileno, new=True)
+        # fileno -> (owner, mask) for registrations left in place between
+        # the waits of a hubs.FdWaiter
+        self.kept = {}
+
+    def add_listener(self, listener):
+        fileno = listener.fileno
+        oldlisteners = bool(self.listeners[READ].get(fileno) or
+                            self.listeners[WRITE].get(fileno))
+        listener = super(Hub, self).add_listener(listener)
+        kept = self.kept.get(fileno)
+        if kept is None:
+            self.register(fileno, new=not oldlisteners)
+        elif kept[0] is not listener.owner or self._mask(fileno) & ~kept[1]:
+            self.register(fileno)
+        else:
+            # the fd is still registered from this owner's previous wait
+            return listener
+        if listener.owner is not None:
+            self.kept[fileno] = (listener.owner, self._mask(fileno))
         return listener
 
     def remove(self, listener):
         super(Hub, self).remove(listener)
+        kept = self.kept.get(listener.fileno)
+        if kept is not None and kept[0] is listener.owner:
+            # leave it registered, the owner will most likely wait again
+            return
         self.register(listener.fileno)
 
-    def register(self, fileno, new=False):
+    def release_registration(self, fileno, owner):
+        kept = self.kept.get(fileno)
+        if kept is not None and kept[0] is owner:
+            self.register(fileno)
+
+    def mark_as_reopened(self, fileno):
+        self.kept.pop(fileno, None)
+        super(Hub, self).mark_as_reopened(fileno)
+
+    def _mask(self, fileno):
         mask = 0
         if self.listeners[READ].get(fileno):
             mask |= READ_MASK | EXC_MASK
         if self.listeners[WRITE].get(fileno):
             mask |= WRITE_MASK | EXC_MASK
+        return mask
+
+    def register(self, fileno, new=False):
+        self.kept.pop(fileno, None)
+        mask = self._mask(fileno)
         try:
             if mask:
                 if new:
@@ -60,6 +105,7 @@ class Hub(BaseHub):
             raise
 
     def remove_descriptor(self, fileno):
+        self.kept.pop(fileno, None)
         super(Hub, self).remove_descriptor(fileno)
         try:
             self.poll.unregister(fileno)
@@ -95,27 +141,38 @@ class Hub(BaseHub):
         # triggering any of them. This is to keep the set
         # of callbacks in sync with the events we've just
         # polled for. It prevents one handler from invalidating
-        # another.
-        callbacks = set()
+        # another.  Each fileno appears once in presult, so a
+        # listener is collected at most once and the callbacks
+        # run in the order the events were reported.
+        callbacks = []
+        append = callbacks.append
+        kept = self.kept
         for fileno, event in presult:
-            if event & READ_MASK:
-                callbacks.add((readers.get(fileno, noop), fileno))
-            if event & WRITE_MASK:
-                callbacks.add((writers.get(fileno, noop), fileno))
-            if event & select.POLLNVAL:
+            if event & POLLNVAL:
+                # wakes up everybody waiting on fileno
                 self.remove_descriptor(fileno)
                 continue
-            if event & EXC_MASK:
-                callbacks.add((readers.get(fileno, noop), fileno))
-                callbacks.add((writers.get(fileno, noop), fileno))
-
-        for listener, fileno in callbacks:
+            reader = readers.get(fileno) if event & READ_EXC_MASK else None
+            writer = writers.get(fileno) if event & WRITE_EXC_MASK else None
+            if reader is not None:
+                append(reader)
+            if writer is not None:
+                append(writer)
+            if fileno in kept and (
+                    (event & READ_MASK and reader is None) or
+                    (event & WRITE_MASK and writer is None) or
+                    (event & EXC_MASK and reader is None and writer is None)):
+                # Nobody is waiting for this event on an fd that was left
+                # registered between waits; narrow the registration down.
+                self.register(fileno)
+
+        for listener in callbacks:
             try:
-                listener.cb(fileno)
+                listener.cb(listener.fileno)
             except SYSTEM_EXCEPTIONS:
                 raise
             except:
-                self.squelch_exception(fileno, sys.exc_info())
+                self.squelch_exception(listener.fileno, sys.exc_info())
                 clear_sys_exc_info()
 
         if self.debug_blocking:
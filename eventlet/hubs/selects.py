@@ -14,6 +14,8 @@ except AttributeError:
 
 
 class Hub(BaseHub):
+    listener_reuse = True
+
     def _remove_bad_fds(self):
         """ Iterate through fds, removing the ones that are bad per the
         operating system.
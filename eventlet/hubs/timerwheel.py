@@ -0,0 +1,189 @@
+"""Hierarchical timing wheel used as an alternative timer store by
+:class:`eventlet.hubs.hub.BaseHub`.
+
+Timers are bucketed by their expiry tick into a small number of wheels of
+increasing granularity.  Scheduling and canceling are O(1); expiring walks
+the ticks that have elapsed, cascading buckets from the coarser wheels into
+the finer ones as their time comes.  Canceled timers are removed from their
+bucket immediately, so workloads that cancel almost every timer (socket
+timeouts, :class:`eventlet.Timeout` contexts) never accumulate garbage.
+"""
+
+
+class TimerWheel(object):
+
+    def __init__(self, now, resolution=0.001, bits=6, levels=5):
+        """Create an empty wheel whose current tick corresponds to *now*.
+
+        resolution: duration of one tick of the finest wheel, in seconds
+        bits: log2 of the number of buckets in each wheel
+        levels: number of wheels; timers further away than
+            ``resolution * 2 ** (bits * levels)`` seconds are parked in the
+            last bucket of the coarsest wheel and re-bucketed when reached
+        """
+        self.resolution = resolution
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.wheels = [[{} for _ in range(self.size)] for _ in range(levels)]
+        self.counts = [0] * levels
+        self.where = {}
+        self.seq = 0
+        self.tick = self.to_tick(now)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, timer):
+        return timer in self.where
+
+    def to_tick(self, when):
+        return int(when / self.resolution)
+
+    def add(self, timer, deadline):
+        """Schedule *timer* to expire at *deadline*.  A timer that is already
+        in the wheel is moved."""
+        if timer in self.where:
+            self.remove(timer)
+        self.seq += 1
+        self._insert(timer, (deadline, self.seq))
+
+    def remove(self, timer):
+        """Forget about *timer*.  Does nothing if it is not in the wheel."""
+        try:
+            level, bucket = self.where.pop(timer)
+        except KeyError:
+            return
+        del bucket[timer]
+        self.counts[level] -= 1
+
+    def clear(self):
+        for wheel in self.wheels:
+            for bucket in wheel:
+                bucket.clear()
+        self.counts = [0] * self.levels
+        self.where.clear()
+
+    def items(self):
+        """Return a list of ``(deadline, timer)`` pairs for every timer in the
+        wheel, in no particular order."""
+        return [(entry[0], timer)
+                for wheel in self.wheels
+                for bucket in wheel
+                for timer, entry in bucket.items()]
+
+    def _insert(self, timer, entry):
+        tick = self.tick
+        exp = int(entry[0] / self.resolution)
+        delta = exp - tick
+        if delta < self.size:
+            if delta < 0:
+                exp = tick
+            level = shift = 0
+        else:
+            level = (delta.bit_length() - 1) // self.bits
+            if level >= self.levels:
+                level = self.levels - 1
+                exp = tick + (1 << (self.bits * self.levels)) - 1
+            shift = level * self.bits
+        bucket = self.wheels[level][(exp >> shift) & self.mask]
+        bucket[timer] = entry
+        self.where[timer] = (level, bucket)
+        self.counts[level] += 1
+
+    def _cascade(self, tick):
+        shift = 0
+        for level in range(1, self.levels):
+            shift += self.bits
+            if tick & ((1 << shift) - 1):
+                break
+            wheel = self.wheels[level]
+            idx = (tick >> shift) & self.mask
+            bucket = wheel[idx]
+            if bucket:
+                wheel[idx] = {}
+                self.counts[level] -= len(bucket)
+                for timer, entry in bucket.items():
+                    self._insert(timer, entry)
+
+    def _advance(self, target):
+        # Jump straight to the next tick at which anything can happen: the
+        # next tick if the finest wheel is populated, otherwise the next
+        # boundary of the finest populated wheel.
+        counts = self.counts
+        level = 0
+        while level < self.levels and not counts[level]:
+            level += 1
+        if level == self.levels:
+            self.tick = target
+            return
+        shift = self.bits * level
+        nxt = ((self.tick >> shift) + 1) << shift
+        if nxt > target:
+            self.tick = target
+            return
+        self.tick = nxt
+        self._cascade(nxt)
+
+    def expire(self, when):
+        """Remove and return the timers whose deadline is not later than
+        *when*, ordered by deadline and then by scheduling order."""
+        target = self.to_tick(when)
+        due = []
+        wheel0 = self.wheels[0]
+        where = self.where
+        while True:
+            tick = self.tick
+            if self.counts[0]:
+                bucket = wheel0[tick & self.mask]
+                if bucket:
+                    if tick < target:
+                        expired = list(bucket.items())
+                        bucket.clear()
+                    else:
+                        expired = [(timer, entry) for timer, entry in bucket.items()
+                                   if entry[0] <= when]
+                        for timer, _ in expired:
+                            del bucket[timer]
+                    self.counts[0] -= len(expired)
+                    for timer, entry in expired:
+                        del where[timer]
+                        due.append((entry, timer))
+            if tick >= target:
+                break
+            self._advance(target)
+        due.sort()
+        return [timer for _, timer in due]
+
+    def next_deadline(self):
+        """Return the time by which :meth:`expire` should next be called, or
+        None if the wheel is empty.  Timers in the finest wheel are reported
+        exactly; coarser wheels report the start of the bucket that will be
+        cascaded next, which is never later than the timers it holds."""
+        if not self.where:
+            return None
+        best = None
+        size = self.size
+        mask = self.mask
+        if self.counts[0]:
+            wheel = self.wheels[0]
+            for i in range(size):
+                bucket = wheel[(self.tick + i) & mask]
+                if bucket:
+                    best = min(bucket.values())[0]
+                    break
+        shift = 0
+        for level in range(1, self.levels):
+            shift += self.bits
+            if not self.counts[level]:
+                continue
+            wheel = self.wheels[level]
+            cur = self.tick >> shift
+            for i in range(1, size + 1):
+                if wheel[(cur + i) & mask]:
+                    when = ((cur + i) << shift) * self.resolution
+                    if best is None or when < best:
+                        best = when
+                    break
+        return best
@@ -0,0 +1,357 @@
+"""io_uring based hub for Linux.
+
+Readiness is waited for with one-shot ``IORING_OP_POLL_ADD`` requests.  The
+requests armed, re-armed and canceled during an iteration of the hub are
+queued in the submission ring and handed to the kernel together with the
+wait itself, so a hub iteration costs a single ``io_uring_enter`` call no
+matter how many descriptors changed state.
+
+The ring is driven through the raw system calls with :mod:`ctypes` and
+:mod:`mmap`; no binding library is needed.  If the kernel lacks io_uring
+(older than 5.5, disabled through ``kernel.io_uring_disabled``, filtered by
+seccomp) :func:`is_available` returns False and :func:`eventlet.hubs.use_hub`
+warns and selects the default hub instead, so ``use_hub('uring')`` and
+``EVENTLET_HUB=uring`` are always safe.
+"""
+import ctypes
+import errno
+import mmap
+import os
+import struct
+import sys
+
+from eventlet import patcher
+from eventlet.hubs.hub import BaseHub, READ, WRITE, process_id
+from eventlet.support import get_errno, clear_sys_exc_info, six
+select = patcher.original('select')
+time = patcher.original('time')
+
+SYS_io_uring_setup = 425
+SYS_io_uring_enter = 426
+
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+IORING_ENTER_GETEVENTS = 1
+IORING_FEAT_NODROP = 1 << 1
+IORING_OP_POLL_ADD = 6
+IORING_OP_POLL_REMOVE = 7
+IORING_OP_TIMEOUT = 11
+
+EXC_MASK = select.POLLERR | select.POLLHUP
+READ_MASK = select.POLLIN | select.POLLPRI
+WRITE_MASK = select.POLLOUT
+READ_EXC_MASK = READ_MASK | EXC_MASK
+WRITE_EXC_MASK = WRITE_MASK | EXC_MASK
+POLLNVAL = select.POLLNVAL
+
+# struct io_uring_params: ten u32 fields, then struct io_sqring_offsets and
+# struct io_cqring_offsets, each eight u32 fields and a u64
+_params = struct.Struct('=10I8IQ8IQ')
+_sqe = struct.Struct('=BBHiQQIIQ24x')
+_cqe = struct.Struct('=QiI')
+_u32 = struct.Struct('=I')
+_timespec = struct.Struct('=qq')
+
+# user_data of requests whose completion is of no interest
+IGNORED = 0
+
+_libc = None
+
+
+def _syscall(*args):
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.syscall.restype = ctypes.c_long
+    # variadic: pass integers at full register width
+    args = [ctypes.c_long(a) if isinstance(a, six.integer_types) else a for a in args]
+    result = _libc.syscall(*args)
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, errno.errorcode.get(err, str(err)))
+    return result
+
+
+class Ring(object):
+    """Submission and completion queues of one io_uring instance."""
+
+    def __init__(self, entries=1024):
+        params = ctypes.create_string_buffer(_params.size)
+        self.fd = _syscall(SYS_io_uring_setup, entries, params)
+        try:
+            p = _params.unpack_from(params.raw)
+            if not p[5] & IORING_FEAT_NODROP:
+                raise OSError(errno.ENOSYS, 'io_uring is too old')
+            self.sq_entries = p[0]
+            self.cq_entries = p[1]
+            sq_head, sq_tail, sq_mask, _, _, _, sq_array = p[10:17]
+            cq_head, cq_tail, cq_mask, _, _, cqes = p[19:25]
+            self.sq_ring = self._map(sq_array + self.sq_entries * 4, IORING_OFF_SQ_RING)
+            self.cq_ring = self._map(cqes + self.cq_entries * _cqe.size, IORING_OFF_CQ_RING)
+            self.sqes = self._map(self.sq_entries * _sqe.size, IORING_OFF_SQES)
+        except BaseException:
+            self.close()
+            raise
+        self.sq_tail_off = sq_tail
+        self.sq_mask = _u32.unpack_from(self.sq_ring, sq_mask)[0]
+        self.cq_head_off = cq_head
+        self.cq_tail_off = cq_tail
+        self.cq_mask = _u32.unpack_from(self.cq_ring, cq_mask)[0]
+        self.cqes_off = cqes
+        # SQE i always goes into slot i of the indirection array
+        for i in range(self.sq_entries):
+            _u32.pack_into(self.sq_ring, sq_array + i * 4, i)
+        self.tail = _u32.unpack_from(self.sq_ring, sq_head)[0]
+        self.pending = 0
+        self.timespec = ctypes.create_string_buffer(_timespec.size)
+
+    def _map(self, length, offset):
+        return mmap.mmap(self.fd, length, mmap.MAP_SHARED,
+                         mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    def close(self):
+        for name in ('sq_ring', 'cq_ring', 'sqes'):
+            ring = self.__dict__.pop(name, None)
+            if ring is not None:
+                ring.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def prep(self, opcode, fd, addr, length, op_flags, user_data, off=0):
+        """Queue a submission; it reaches the kernel with the next
+        :meth:`enter`."""
+        if self.pending >= self.sq_entries:
+            self.enter(0, 0)
+        tail = self.tail
+        _sqe.pack_into(self.sqes, (tail & self.sq_mask) * _sqe.size,
+                       opcode, 0, 0, fd, off, addr, length, op_flags, user_data)
+        self.tail = (tail + 1) & 0xffffffff
+        self.pending += 1
+
+    def prep_timeout(self, seconds):
+        """Queue a timeout that completes after *seconds*, or as soon as any
+        other request completes."""
+        sec = int(seconds)
+        _timespec.pack_into(self.timespec, 0, sec, int((seconds - sec) * 1e9))
+        self.prep(IORING_OP_TIMEOUT, -1, ctypes.addressof(self.timespec), 1, 0,
+                  IGNORED, off=1)
+
+    def enter(self, min_complete, flags):
+        """Submit everything queued and optionally wait for completions."""
+        if self.pending:
+            _u32.pack_into(self.sq_ring, self.sq_tail_off, self.tail)
+        try:
+            submitted = _syscall(SYS_io_uring_enter, self.fd, self.pending,
+                                 min_complete, flags, None, 0)
+        except OSError as e:
+            if get_errno(e) != errno.EBUSY:
+                raise
+            # the completion queue is full; reap it before submitting more
+            return
+        self.pending -= submitted
+
+    def reap(self):
+        """Return ``(user_data, result)`` for every available completion."""
+        cq = self.cq_ring
+        head = _u32.unpack_from(cq, self.cq_head_off)[0]
+        tail = _u32.unpack_from(cq, self.cq_tail_off)[0]
+        if head == tail:
+            return ()
+        mask = self.cq_mask
+        base = self.cqes_off
+        size = _cqe.size
+        unpack = _cqe.unpack_from
+        completions = []
+        while head != tail:
+            user_data, res, _ = unpack(cq, base + (head & mask) * size)
+            completions.append((user_data, res))
+            head = (head + 1) & 0xffffffff
+        _u32.pack_into(cq, self.cq_head_off, head)
+        return completions
+
+
+class Hub(BaseHub):
+    listener_reuse = True
+
+    def __init__(self, clock=None):
+        super(Hub, self).__init__(clock)
+        self._open_ring()
+
+    def _open_ring(self):
+        self.ring = Ring()
+        # fileno -> (user_data, mask) of the poll request armed for it
+        self.armed = {}
+        # user_data -> fileno for every armed poll request
+        self.tokens = {}
+        self.next_token = IGNORED + 1
+        self.process_id = process_id()
+
+    def _after_fork(self):
+        # The parent owns the ring mapped into this process; leave its
+        # requests alone and re-arm our listeners on a ring of our own.
+        self.ring.close()
+        self._open_ring()
+        filenos = set(self.listeners[READ]) | set(self.listeners[WRITE])
+        for fileno in filenos:
+            self._arm(fileno)
+
+    def _mask(self, fileno):
+        mask = 0
+        if self.listeners[READ].get(fileno):
+            mask |= READ_MASK | EXC_MASK
+        if self.listeners[WRITE].get(fileno):
+            mask |= WRITE_MASK | EXC_MASK
+        return mask
+
+    def _arm(self, fileno):
+        mask = self._mask(fileno)
+        armed = self.armed.get(fileno)
+        if armed is not None:
+            if armed[1] & mask == mask:
+                return
+            self._cancel(fileno)
+            mask |= armed[1]
+        if not mask:
+            return
+        token = self.next_token
+        self.next_token += 1
+        self.ring.prep(IORING_OP_POLL_ADD, fileno, 0, 0, mask, token)
+        self.armed[fileno] = (token, mask)
+        self.tokens[token] = fileno
+
+    def _cancel(self, fileno):
+        armed = self.armed.pop(fileno, None)
+        if armed is not None:
+            del self.tokens[armed[0]]
+            self.ring.prep(IORING_OP_POLL_REMOVE, -1, armed[0], 0, 0, IGNORED)
+
+    def add_listener(self, listener):
+        if self.process_id != process_id():
+            self._after_fork()
+        if listener.fileno < 0:
+            # same as poll.register, issue 74
+            raise ValueError('file descriptor cannot be a negative integer (%d)'
+                             % listener.fileno)
+        listener = super(Hub, self).add_listener(listener)
+        self._arm(listener.fileno)
+        return listener
+
+    def remove(self, listener):
+        super(Hub, self).remove(listener)
+        fileno = listener.fileno
+        if listener.owner is None and not self._mask(fileno):
+            # the poll request holds a reference to the file, which would
+            # keep the descriptor open in the kernel after it is closed
+            self._cancel(fileno)
+
+    def release_registration(self, fileno, owner):
+        if not self._mask(fileno):
+            self._cancel(fileno)
+
+    def mark_as_reopened(self, fileno):
+        self._cancel(fileno)
+        super(Hub, self).mark_as_reopened(fileno)
+
+    def remove_descriptor(self, fileno):
+        self._cancel(fileno)
+        super(Hub, self).remove_descriptor(fileno)
+
+    def wait(self, seconds=None):
+        readers = self.listeners[READ]
+        writers = self.listeners[WRITE]
+        ring = self.ring
+
+        if not readers and not writers:
+            if ring.pending:
+                ring.enter(0, 0)
+            if seconds:
+                time.sleep(seconds)
+            return
+        completions = ring.reap()
+        try:
+            if completions or (seconds is not None and seconds <= 0):
+                if ring.pending:
+                    ring.enter(0, 0)
+            else:
+                if seconds is not None:
+                    ring.prep_timeout(seconds)
+                ring.enter(1, IORING_ENTER_GETEVENTS)
+        except OSError as e:
+            if get_errno(e) != errno.EINTR:
+                raise
+        if completions:
+            completions.extend(ring.reap())
+        else:
+            completions = ring.reap()
+        SYSTEM_EXCEPTIONS = self.SYSTEM_EXCEPTIONS
+
+        if self.debug_blocking:
+            self.block_detect_pre()
+
+        callbacks = []
+        append = callbacks.append
+        woken = []
+        armed = self.armed
+        tokens = self.tokens
+        for token, event in completions:
+            fileno = tokens.pop(token, None)
+            if fileno is None:
+                # timeouts, cancellations and canceled polls
+                continue
+            del armed[fileno]
+            if event < 0:
+                if event != -errno.ECANCELED:
+                    self.remove_descriptor(fileno)
+                continue
+            if event & POLLNVAL:
+                self.remove_descriptor(fileno)
+                continue
+            reader = readers.get(fileno) if event & READ_EXC_MASK else None
+            writer = writers.get(fileno) if event & WRITE_EXC_MASK else None
+            if reader is not None:
+                append(reader)
+            if writer is not None:
+                append(writer)
+            woken.append(fileno)
+
+        for listener in callbacks:
+            try:
+                listener.cb(listener.fileno)
+            except SYSTEM_EXCEPTIONS:
+                raise
+            except BaseException:
+                self.squelch_exception(listener.fileno, sys.exc_info())
+                clear_sys_exc_info()
+
+        # one-shot polls: whoever is still waiting needs a new request
+        for fileno in woken:
+            if fileno not in armed:
+                self._arm(fileno)
+
+        if self.debug_blocking:
+            self.block_detect_post()
+
+
+_available = None
+unavailable_reason = None
+
+
+def is_available():
+    """Return True if io_uring works here.  The first call probes the kernel
+    by setting up a small ring; when that fails the reason is kept in
+    ``unavailable_reason``.
+    """
+    global _available, unavailable_reason
+    if _available is None:
+        try:
+            if not sys.platform.startswith('linux'):
+                raise OSError(errno.ENOSYS, 'io_uring requires Linux')
+            Ring(2).close()
+        except (OSError, AttributeError, ValueError) as e:
+            unavailable_reason = e
+            _available = False
+        else:
+            _available = True
+    return _available
@@ -2,6 +2,8 @@ import base64
 import codecs
 import collections
 import errno
+import os
+import random
 from random import Random
 from socket import error as SocketError
 import string
@@ -17,6 +19,10 @@ except ImportError:  # pragma NO COVER
     from md5 import md5
     from sha import sha as sha1
 
+from eventlet import event
+from eventlet import greenio
+from eventlet import greenthread
+from eventlet import hubs
 from eventlet import semaphore
 from eventlet import wsgi
 from eventlet.green import socket
@@ -38,7 +44,7 @@ for _mod in ('wsaccel.utf8validator', 'autobahn.utf8validator'):
 
 ACCEPTABLE_CLIENT_ERRORS = set((errno.ECONNRESET, errno.EPIPE))
 
-__all__ = ["WebSocketWSGI", "WebSocket"]
+__all__ = ["WebSocketWSGI", "WebSocket", "broadcast", "connect", "reconnecting"]
 PROTOCOL_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
 VALID_CLOSE_STATUS = set(
     list(range(1000, 1004)) +
@@ -50,6 +56,127 @@ VALID_CLOSE_STATUS = set(
     # be registered
     list(range(4000, 5000))
 )
+# frames that may wait for one connection in broadcast()
+DEFAULT_BROADCAST_BACKLOG = 64
+# bytes that may wait for one connection after set_send_queue()
+DEFAULT_SEND_HIGH_WATER = 1 << 20
+# longest handshake response accepted by connect()
+MAX_HANDSHAKE_SIZE = 16384
+# largest piece of a message read at once by RFC6455WebSocket.wait_stream()
+DEFAULT_STREAM_CHUNK_SIZE = 65536
+# frame payloads are read this much at first, then in pieces that grow
+# with what has arrived, however long the peer says they are
+PAYLOAD_READ_SIZE = 65536
+# payloads up to this size are unmasked with integer XOR, larger ones
+# byte-wise through translation tables
+MASK_BIGINT_MAX = 2048
+
+_xor_tables = {}
+
+
+def _xor_table(key):
+    table = _xor_tables.get(key)
+    if table is None:
+        table = _xor_tables[key] = bytes(bytearray(i ^ key for i in range(256)))
+    return table
+
+
+try:
+    zlib.compressobj(zdict=b'')
+except TypeError:
+    # Python 2 has no preset dictionaries
+    _zdict = False
+else:
+    _zdict = True
+
+_DEFLATE_OPTIONS = ('context_takeover', 'client_context_takeover', 'max_window_bits',
+                    'client_max_window_bits', 'mem_level', 'dictionary', 'idle_timeout')
+
+
+def _check_deflate_options(options):
+    for key in options:
+        if key not in _DEFLATE_OPTIONS:
+            raise ValueError('unknown permessage-deflate option %r' % (key, ))
+    for key in ('max_window_bits', 'client_max_window_bits'):
+        # zlib cannot make raw deflate streams with 256 byte windows
+        if options.get(key) is not None and not 9 <= options[key] <= 15:
+            raise ValueError('%s must be between 9 and 15' % key)
+    if options.get('mem_level') is not None and not 1 <= options['mem_level'] <= 9:
+        raise ValueError('mem_level must be between 1 and 9')
+    if options.get('dictionary') and not _zdict:
+        raise ValueError('preset dictionaries need Python 3.3 or newer')
+
+
+def _compressobj(wbits, mem_level=None, zdict=None):
+    if mem_level is None:
+        mem_level = 8
+    if zdict:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -wbits,
+                                mem_level, zlib.Z_DEFAULT_STRATEGY, zdict)
+    return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -wbits, mem_level)
+
+
+def _decompressobj(wbits, zdict=None):
+    if zdict:
+        return zlib.decompressobj(-wbits, zdict)
+    return zlib.decompressobj(-wbits)
+
+
+def _slide(window, data, size):
+    if len(data) >= size:
+        return data[-size:]
+    return (window + data)[-size:]
+
+
+class _Deflater(object):
+    """Compressor for permessage-deflate with context takeover whose zlib
+    state may be released between messages.  It keeps the last window of
+    data it compressed and rebuilds its state from that on next use; the
+    peer cannot tell the difference."""
+
+    def __init__(self, wbits, mem_level=None, dictionary=None):
+        self.wbits = wbits
+        self.mem_level = mem_level
+        self.window = dictionary or b''
+        self._obj = None
+
+    def compress(self, data):
+        if self._obj is None:
+            self._obj = _compressobj(self.wbits, self.mem_level, self.window)
+        self.window = _slide(self.window, data, 1 << self.wbits)
+        return self._obj.compress(data)
+
+    def flush(self, mode):
+        return self._obj.flush(mode)
+
+    def release(self):
+        self._obj = None
+
+
+class _Inflater(object):
+    """The decompressing counterpart of :class:`_Deflater`."""
+
+    def __init__(self, wbits, dictionary=None):
+        self.wbits = wbits
+        self.window = dictionary or b''
+        self.unconsumed_tail = b''
+        self._obj = None
+        self._between_blocks = True
+
+    def decompress(self, data, max_length=0):
+        if self._obj is None:
+            self._obj = _decompressobj(self.wbits, self.window)
+        out = self._obj.decompress(data, max_length)
+        self.unconsumed_tail = self._obj.unconsumed_tail
+        # after the empty block that ends every message, the state can be
+        # rebuilt from the window alone
+        self._between_blocks = data.endswith(b'\x00\x00\xff\xff') and not self.unconsumed_tail
+        self.window = _slide(self.window, out, 1 << self.wbits)
+        return out
+
+    def release(self):
+        if self._between_blocks:
+            self._obj = None
 
 
 class BadRequest(Exception):
@@ -82,17 +209,57 @@ class WebSocketWSGI(object):
         self.support_legacy_versions = True
         self.supported_protocols = []
         self.origin_checker = None
+        # keyword arguments for WebSocket.set_send_queue()
+        self.send_queue = None
+        self.max_message_size = None
+        # server side permessage-deflate settings, False to refuse it
+        self.permessage_deflate = None
 
     @classmethod
     def configured(cls,
                    handler=None,
                    supported_protocols=None,
                    origin_checker=None,
-                   support_legacy_versions=False):
+                   support_legacy_versions=False,
+                   send_queue=None,
+                   max_message_size=None,
+                   permessage_deflate=None):
+        """Return a :class:`WebSocketWSGI` for *handler* with settings other
+        than the defaults, or a decorator that makes one if *handler* is
+        omitted.
+
+        *permessage_deflate* is False to refuse compression, or a dict of
+        server side compression settings:
+
+        ``context_takeover``, ``client_context_takeover``
+            False to ask for a fresh compression context for every message
+            sent or received; costs compression ratio, saves the memory of
+            the context between messages
+        ``max_window_bits``, ``client_max_window_bits``
+            upper bounds, 9 to 15, for the window sizes of the server's and
+            the client's compressor
+        ``mem_level``
+            zlib memory level of the server's compressor, 1 to 9; the default
+            of 8 takes 128 KiB, every step down halves it
+        ``idle_timeout``
+            seconds after which the zlib state of a connection that has not
+            sent or received compressed messages is released, keeping only
+            the last window of data to rebuild it from (Python 3 only)
+        ``dictionary``
+            preset dictionary for both directions, typically samples of the
+            messages sent; only clients that use the same dictionary can
+            talk to the server (Python 3 only)
+        """
+        if permessage_deflate:
+            _check_deflate_options(permessage_deflate)
+
         def decorator(handler):
             inst = cls(handler)
             inst.support_legacy_versions = support_legacy_versions
             inst.origin_checker = origin_checker
+            inst.send_queue = send_queue
+            inst.max_message_size = max_message_size
+            inst.permessage_deflate = permessage_deflate
             if supported_protocols:
                 inst.supported_protocols = supported_protocols
             return inst
@@ -125,6 +292,10 @@ class WebSocketWSGI(object):
                            [('Connection', 'close'), ] + headers)
             return [body]
 
+        if self.send_queue is not None:
+            ws.set_send_queue(**self.send_queue)
+        if 'eventlet.set_idle' in environ:
+            environ['eventlet.set_idle']()
         try:
             self.handler(ws)
         except socket.error as e:
@@ -198,7 +369,8 @@ class WebSocketWSGI(object):
         sock.sendall(handshake_reply)
         return WebSocket(sock, environ, self.protocol_version)
 
-    def _parse_extension_header(self, header):
+    @staticmethod
+    def _parse_extension_header(header):
         if header is None:
             return None
         res = {}
@@ -218,8 +390,9 @@ class WebSocketWSGI(object):
         if not extensions:
             return None
         deflate = extensions.get("permessage-deflate")
-        if deflate is None:
+        if deflate is None or self.permessage_deflate is False:
             return None
+        local = self.permessage_deflate or {}
         for config in deflate:
             # We'll evaluate each config in the client's preferred order and pick
             # the first that we can support.
@@ -249,10 +422,24 @@ class WebSocketWSGI(object):
                         int(config.get("client_max_window_bits", max_wbits))
                     if not (8 <= want_config["client_max_window_bits"] <= 15):
                         continue
+            # the server may always restrict its own compressor, but the
+            # client's window only if the client offered to
+            if local.get("max_window_bits") is not None:
+                want_config["server_max_window_bits"] = min(
+                    want_config.get("server_max_window_bits", max_wbits), local["max_window_bits"])
+            if (local.get("client_max_window_bits") is not None and
+                    "client_max_window_bits" in want_config):
+                want_config["client_max_window_bits"] = min(
+                    want_config["client_max_window_bits"], local["client_max_window_bits"])
+            if local.get("context_takeover") is False:
+                want_config["server_no_context_takeover"] = True
+            if local.get("client_context_takeover") is False:
+                want_config["client_no_context_takeover"] = True
             return want_config
         return None
 
-    def _format_extension_header(self, parsed_extensions):
+    @staticmethod
+    def _format_extension_header(parsed_extensions):
         if not parsed_extensions:
             return None
         parts = []
@@ -322,7 +509,9 @@ class WebSocketWSGI(object):
         sock.sendall(b'\r\n'.join(handshake_reply) + b'\r\n\r\n')
         return RFC6455WebSocket(sock, environ, self.protocol_version,
                                 protocol=negotiated_protocol,
-                                extensions=parsed_extensions)
+                                extensions=parsed_extensions,
+                                max_message_size=self.max_message_size,
+                                deflate_options=self.permessage_deflate or None)
 
     def _extract_number(self, value):
         """
@@ -377,6 +566,19 @@ class WebSocket(object):
         self._buf = b""
         self._msgs = collections.deque()
         self._sendlock = semaphore.Semaphore()
+        # (frame, message, size, droppable) waiting for the writer
+        # greenthread, queued by broadcast() or by send() after
+        # set_send_queue()
+        self._outbox = collections.deque()
+        self._writing = False
+        self._idle = None
+        self._send_queue = None
+        self._send_error = None
+        self._buffered = 0
+        self._overflowed = False
+        # an SSL write that would block must be retried with the same
+        # data, so those are always left to the writer greenthread
+        self._ssl = hasattr(sock, 'do_handshake')
 
     def _pack_message(self, message):
         """Pack the message inside ``00`` and ``FF``
@@ -425,15 +627,209 @@ class WebSocket(object):
         *message* should be convertable to a string; unicode objects should be
         encodable as utf-8.  Raises socket.error with errno of 32
         (broken pipe) if the socket has already been closed by the client."""
-        packed = self._pack_message(message)
+        self._send_or_queue(self._pack_message(message))
+
+    def _send(self, frame):
         # if two greenthreads are trying to send at the same time
         # on the same socket, sendlock prevents interleaving and corruption
         self._sendlock.acquire()
         try:
-            self.socket.sendall(packed)
+            self.socket.sendall(frame)
         finally:
             self._sendlock.release()
 
+    def set_send_queue(self, high_water=DEFAULT_SEND_HIGH_WATER, low_water=None,
+                       overflow='disconnect'):
+        """Make :meth:`send` queue messages instead of waiting for the socket.
+
+        A writer greenthread of this connection sends the queue in order, so
+        greenthreads that send are never held up by a slow peer.  At most
+        *high_water* bytes are buffered; a message that does not fit is
+        handled according to *overflow*:
+
+        ``'drop_oldest'``
+            discard queued messages, oldest first, until no more than
+            *low_water* bytes remain, then queue the new one
+        ``'drop_newest'``
+            discard new messages until the queue has drained to *low_water*
+        ``'disconnect'``
+            shut the connection down; :meth:`send` raises socket.error
+
+        *low_water* defaults to half of *high_water*.  Control frames and
+        fragments of a message are never discarded.  Errors of the writer
+        are raised by the next :meth:`send`, and closing the websocket waits
+        until the queue has been sent.
+        """
+        if overflow not in ('drop_oldest', 'drop_newest', 'disconnect'):
+            raise ValueError('overflow must be "drop_oldest", "drop_newest" or "disconnect"')
+        if low_water is None:
+            low_water = high_water // 2
+        if not 0 <= low_water <= high_water:
+            raise ValueError('low_water must be between 0 and high_water')
+        self._send_queue = (high_water, low_water, overflow)
+
+    @property
+    def buffered_amount(self):
+        """Number of bytes queued by :meth:`send` or :func:`broadcast` that
+        have not been handed to the socket yet.  Messages that are
+        compressed with context takeover count with their size before
+        compression until their turn comes."""
+        return self._buffered
+
+    def _send_or_queue(self, frame, message=None, size=None, droppable=False):
+        """Send *frame* now, or queue it if :meth:`set_send_queue` was used.
+        A *frame* of None is made from *message* when the writer gets to
+        it."""
+        if self._send_queue is None:
+            if frame is None:
+                frame = self._frame(message)
+            self._send(frame)
+            return
+        if self._send_error is not None:
+            raise self._send_error
+        if size is None:
+            size = len(frame)
+        if not self._enqueue(frame, message, size, droppable):
+            raise self._send_error
+
+    def _flush(self):
+        """Wait until the writer greenthread has sent the queue."""
+        if self._writing:
+            self._idle.wait()
+        if self._send_error is not None:
+            raise self._send_error
+
+    def _frame_key(self):
+        """Return a key shared by all connections that frame a message into
+        the same bytes, or None if frames must be made per connection."""
+        return (self.version, )
+
+    def _frame(self, message):
+        return self._pack_message(message)
+
+    def _enqueue(self, frame, message, size, droppable=True, backlog=None, overflow=None):
+        """Queue *frame*, or *message* to be framed when its turn comes, and
+        make sure a writer greenthread is running.  The queue is bounded by
+        *backlog* frames, or by the watermarks of :meth:`set_send_queue` if
+        *backlog* is None.  Returns False if the connection was dropped
+        instead."""
+        outbox = self._outbox
+        if not self._writing and self._sendlock.acquire(blocking=False):
+            # Nothing is queued or being sent: try to get the frame out
+            # right away and start a writer only for what does not fit.
+            try:
+                if frame is None:
+                    frame = self._frame(message)
+                sent = self._send_nowait(frame)
+            except SocketError as e:
+                self._sendlock.release()
+                self._send_error = e
+                return True
+            if sent == len(frame):
+                self._sendlock.release()
+                return True
+            self._buffered += len(frame) - sent
+            self._start_writer(frame[sent:])
+            return True
+        if backlog is None:
+            high_water, low_water, overflow = self._send_queue
+            full = self._overflowed or self._buffered + size > high_water
+        else:
+            full = len(outbox) >= backlog
+            low_water = 0
+        if full:
+            if overflow == 'disconnect':
+                self._drop()
+                return False
+            if overflow == 'drop_newest':
+                if droppable:
+                    self._overflowed = True
+                    return True
+            else:
+                # drop_oldest and coalesce
+                self._trim(low_water - size)
+        outbox.append((frame, message, size, droppable))
+        self._buffered += size
+        if not self._writing:
+            self._start_writer()
+        return True
+
+    def _trim(self, target):
+        """Discard queued messages, oldest first, until at most *target*
+        bytes are buffered."""
+        outbox = self._outbox
+        kept = []
+        for item in outbox:
+            if self._buffered > target and item[3]:
+                self._buffered -= item[2]
+            else:
+                kept.append(item)
+        outbox.clear()
+        outbox.extend(kept)
+
+    def _send_nowait(self, frame):
+        """Send what the socket takes without waiting; returns its count."""
+        if self._ssl:
+            return 0
+        sock = self.socket
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return sock.send(frame)
+        except SocketError as e:
+            if get_errno(e) not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return 0
+        finally:
+            sock.settimeout(timeout)
+
+    def _start_writer(self, rest=None):
+        self._writing = True
+        self._idle = event.Event()
+        greenthread.spawn_n(self._write_queued, rest)
+
+    def _write_queued(self, rest=None):
+        """Writer greenthread: finish the frame partly sent by _enqueue,
+        whose lock it inherits, then send everything queued."""
+        try:
+            if rest is not None:
+                try:
+                    self.socket.sendall(rest)
+                finally:
+                    self._sendlock.release()
+                self._sent(len(rest))
+            while self._outbox:
+                # stays in buffered_amount until it has been sent
+                frame, message, size, _ = self._outbox.popleft()
+                if frame is None:
+                    frame = self._frame(message)
+                self._send(frame)
+                self._sent(size)
+        except (SocketError, IOError) as e:
+            # the reading side finds out as well
+            self._outbox.clear()
+            self._buffered = 0
+            self._send_error = e
+        finally:
+            self._writing = False
+            self._idle.send()
+
+    def _sent(self, size):
+        self._buffered -= size
+        if self._overflowed and self._buffered <= self._send_queue[1]:
+            self._overflowed = False
+
+    def _drop(self):
+        """Cut the connection without a closing handshake; never blocks."""
+        self._outbox.clear()
+        self._buffered = 0
+        self._send_error = SocketError(errno.EPIPE, 'websocket dropped for falling behind')
+        self.websocket_closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except SocketError:
+            pass
+
     def wait(self):
         """Waits for and deserializes messages.
 
@@ -458,7 +854,8 @@ class WebSocket(object):
         """Sends the closing frame to the client, if required."""
         if self.version == 76 and not self.websocket_closed:
             try:
-                self.socket.sendall(b"\xff\x00")
+                self._send_or_queue(b"\xff\x00")
+                self._flush()
             except SocketError:
                 # Sometimes, like when the remote side cuts off the connection,
                 # we don't care about this.
@@ -489,16 +886,55 @@ class ProtocolError(ValueError):
     pass
 
 
+class HandshakeError(ProtocolError):
+    """The server refused or botched the upgrade requested by :func:`connect`.
+    *status* and *headers* are those of its response, if it sent one."""
+
+    def __init__(self, message, status=None, headers=None):
+        super(HandshakeError, self).__init__(message)
+        self.status = status
+        self.headers = headers
+
+
 class RFC6455WebSocket(WebSocket):
-    def __init__(self, sock, environ, version=13, protocol=None, client=False, extensions=None):
+    def __init__(self, sock, environ, version=13, protocol=None, client=False, extensions=None,
+                 max_message_size=None, deflate_options=None, reader=None):
+        """
+        :param deflate_options: local permessage-deflate settings:
+            ``mem_level``, ``idle_timeout`` and ``dictionary`` as described
+            for :meth:`WebSocketWSGI.configured`
+        :param max_message_size: the largest message the peer may send, in
+            bytes both as received and after decompression; a larger one
+            fails the connection with status 1009 as soon as its size is
+            known, before it is read whole.  None means no limit.
+        :param reader: the :class:`~eventlet.greenio.GreenSocketReader` of
+            *sock* if one was used for the handshake
+        """
         super(RFC6455WebSocket, self).__init__(sock, environ, version)
         self.iterator = self._iter_frames()
         self.client = client
         self.protocol = protocol
         self.extensions = extensions or {}
+        self.max_message_size = max_message_size
+        # iterator returned by wait_stream() that may not be exhausted yet
+        self._stream = None
+        self._stream_closed = False
+        self._pongs = 0
 
+        self.deflate_options = deflate_options or {}
         self._deflate_enc = None
         self._deflate_dec = None
+        self._deflate_idle_timeout = self.deflate_options.get('idle_timeout') if _zdict else None
+        self._deflate_uses = 0
+        self._release_timer = None
+
+        # bytes the client sent right after its handshake may already sit
+        # in the buffer of the server's request reader
+        if reader is None:
+            reader = getattr(environ.get('eventlet.input'), 'rfile', None)
+        if not isinstance(reader, greenio.GreenSocketReader) or reader.sock is not sock:
+            reader = greenio.GreenSocketReader(sock)
+        self.reader = reader
 
     class UTF8Decoder(object):
         def __init__(self):
@@ -526,75 +962,134 @@ class RFC6455WebSocket(WebSocket):
         if options is None:
             return None
 
-        def _make():
-            return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
-                                    -options.get("client_max_window_bits" if self.client
-                                                 else "server_max_window_bits",
-                                                 zlib.MAX_WBITS))
+        wbits = options.get("client_max_window_bits" if self.client
+                            else "server_max_window_bits", zlib.MAX_WBITS)
+        local = self.deflate_options
 
         if options.get("client_no_context_takeover" if self.client
                        else "server_no_context_takeover"):
             # This option means we have to make a new one every time
-            return _make()
-        else:
-            if self._deflate_enc is None:
-                self._deflate_enc = _make()
-            return self._deflate_enc
+            return _compressobj(wbits, local.get('mem_level'), local.get('dictionary'))
+        if self._deflate_enc is None:
+            if self._deflate_idle_timeout is not None:
+                self._deflate_enc = _Deflater(wbits, local.get('mem_level'), local.get('dictionary'))
+            else:
+                self._deflate_enc = _compressobj(
+                    wbits, local.get('mem_level'), local.get('dictionary'))
+        if self._deflate_idle_timeout is not None:
+            self._deflate_used()
+        return self._deflate_enc
 
     def _get_permessage_deflate_dec(self, rsv1):
         options = self.extensions.get("permessage-deflate")
         if options is None or not rsv1:
             return None
 
-        def _make():
-            return zlib.decompressobj(-options.get("server_max_window_bits" if self.client
-                                                   else "client_max_window_bits",
-                                                   zlib.MAX_WBITS))
+        wbits = options.get("server_max_window_bits" if self.client
+                            else "client_max_window_bits", zlib.MAX_WBITS)
+        dictionary = self.deflate_options.get('dictionary')
 
         if options.get("server_no_context_takeover" if self.client
                        else "client_no_context_takeover"):
             # This option means we have to make a new one every time
-            return _make()
+            return _decompressobj(wbits, dictionary)
+        if self._deflate_dec is None:
+            if self._deflate_idle_timeout is not None:
+                self._deflate_dec = _Inflater(wbits, dictionary)
+            else:
+                self._deflate_dec = _decompressobj(wbits, dictionary)
+        if self._deflate_idle_timeout is not None:
+            self._deflate_used()
+        return self._deflate_dec
+
+    def _deflate_used(self):
+        self._deflate_uses += 1
+        if self._release_timer is None:
+            self._release_timer = hubs.get_hub().schedule_call_global(
+                self._deflate_idle_timeout, self._release_deflate, self._deflate_uses)
+
+    def _release_deflate(self, uses):
+        """Timer: release the zlib state if it has not been used since the
+        timer was set, so after one to two idle timeouts."""
+        self._release_timer = None
+        if self.websocket_closed:
+            self._deflate_enc = self._deflate_dec = None
+        elif uses != self._deflate_uses:
+            self._release_timer = hubs.get_hub().schedule_call_global(
+                self._deflate_idle_timeout, self._release_deflate, self._deflate_uses)
         else:
-            if self._deflate_dec is None:
-                self._deflate_dec = _make()
-            return self._deflate_dec
+            for state in (self._deflate_enc, self._deflate_dec):
+                if state is not None:
+                    state.release()
 
     def _get_bytes(self, numbytes):
-        data = b''
-        while len(data) < numbytes:
-            d = self.socket.recv(numbytes - len(data))
-            if not d:
-                raise ConnectionClosedError()
-            data = data + d
-        return data
+        try:
+            return self.reader.read_exactly(numbytes)
+        except EOFError:
+            raise ConnectionClosedError()
+
+    def _get_payload(self, length):
+        # the length is only what the peer claims: read the payload in
+        # pieces that grow with what has actually arrived
+        if length <= PAYLOAD_READ_SIZE:
+            return self._get_bytes(length)
+        chunks = []
+        got = 0
+        while got < length:
+            chunk = self._get_bytes(min(length - got, max(got, PAYLOAD_READ_SIZE)))
+            chunks.append(chunk)
+            got += len(chunk)
+        return b''.join(chunks)
 
     class Message(object):
-        def __init__(self, opcode, decoder=None, decompressor=None):
+        def __init__(self, opcode, decoder=None, decompressor=None, max_size=None):
             self.decoder = decoder
             self.data = []
+            self.size = 0
             self.finished = False
             self.opcode = opcode
             self.decompressor = decompressor
+            self.max_size = max_size
 
         def push(self, data, final=False):
             self.finished = final
+            self.size += len(data)
             self.data.append(data)
 
         def getvalue(self):
             data = b"".join(self.data)
             if not self.opcode & 8 and self.decompressor:
-                data = self.decompressor.decompress(data + b'\x00\x00\xff\xff')
+                if self.max_size is None:
+                    data = self.decompressor.decompress(data + b'\x00\x00\xff\xff')
+                else:
+                    data = self.decompressor.decompress(data + b'\x00\x00\xff\xff',
+                                                        self.max_size + 1)
+                    if len(data) > self.max_size:
+                        raise FailedConnectionError(1009, "Message too big")
             if self.decoder:
                 data = self.decoder.decode(data, self.finished)
             return data
 
     @staticmethod
     def _apply_mask(data, mask, length=None, offset=0):
-        if length is None:
-            length = len(data)
-        cnt = range(length)
-        return b''.join(six.int2byte(six.indexbytes(data, i) ^ mask[(offset + i) % 4]) for i in cnt)
+        if length is not None:
+            data = data[:length]
+        mask = bytearray(mask)
+        offset %= 4
+        if offset:
+            mask = mask[offset:] + mask[:offset]
+        length = len(data)
+        if six.PY3 and length <= MASK_BIGINT_MAX:
+            # one XOR of two big integers; its cost grows faster than
+            # linearly though, so large payloads go through translate()
+            key = (bytes(mask) * (length // 4 + 1))[:length]
+            return (int.from_bytes(data, 'little') ^
+                    int.from_bytes(key, 'little')).to_bytes(length, 'little')
+        data = bytes(data)
+        masked = bytearray(data)
+        for i in six.moves.range(4):
+            masked[i::4] = data[i::4].translate(_xor_table(mask[i]))
+        return bytes(masked)
 
     def _handle_control_frame(self, opcode, data):
         if opcode == 8:  # connection close
@@ -614,12 +1109,14 @@ class RFC6455WebSocket(WebSocket):
                         "Close message data should be valid UTF-8.")
             else:
                 status = 1002
-            self.close(close_data=(status, ''))
+            # the peer may not wait for the reply
+            self._send_closing_frame(True, close_data=(status, ''))
+            self._close_socket()
             raise ConnectionClosedError()
         elif opcode == 9:  # ping
             self.send(data, control_code=0xA)
         elif opcode == 0xA:  # pong
-            pass
+            self._pongs += 1
         else:
             raise FailedConnectionError(
                 1002, "Unknown control frame received.")
@@ -650,6 +1147,34 @@ class RFC6455WebSocket(WebSocket):
             raise
 
     def _recv_frame(self, message=None):
+        opcode, finished, rsv1, length, mask = self._recv_header(message is not None)
+        if not message or opcode & 8:
+            decoder = self.UTF8Decoder() if opcode == 1 else None
+            decompressor = self._get_permessage_deflate_dec(rsv1)
+            message = self.Message(opcode, decoder=decoder, decompressor=decompressor,
+                                   max_size=self.max_message_size)
+        if not opcode & 8:
+            self._check_size(message.size + length)
+        if not length:
+            message.push(b'', final=finished)
+        else:
+            data = self._get_payload(length)
+            if mask is not None:
+                data = self._apply_mask(data, mask)
+            try:
+                message.push(data, final=finished)
+            except (UnicodeDecodeError, ValueError):
+                raise FailedConnectionError(
+                    1007, "Text data must be valid utf-8")
+        return message
+
+    def _check_size(self, size):
+        if self.max_message_size is not None and size > self.max_message_size:
+            raise FailedConnectionError(1009, "Message too big")
+
+    def _recv_header(self, fragmented=False):
+        """Read a frame header; returns opcode, FIN and RSV1 bits, payload
+        length and mask, which is None for unmasked frames."""
         recv = self._get_bytes
 
         # Unpacking the frame described in Section 5.2 of RFC6455
@@ -683,12 +1208,12 @@ class RFC6455WebSocket(WebSocket):
                     1002,
                     "All control frames MUST have a payload length of 125"
                     " bytes or less")
-        elif opcode and message:
+        elif opcode and fragmented:
             raise FailedConnectionError(
                 1002,
                 "Received a non-continuation opcode within"
                 " fragmented message.")
-        elif not opcode and not message:
+        elif not opcode and not fragmented:
             raise FailedConnectionError(
                 1002,
                 "Received continuation opcode with no previous"
@@ -697,30 +1222,8 @@ class RFC6455WebSocket(WebSocket):
             length = struct.unpack('!H', recv(2))[0]
         elif length == 127:
             length = struct.unpack('!Q', recv(8))[0]
-        if masked:
-            mask = struct.unpack('!BBBB', recv(4))
-        received = 0
-        if not message or opcode & 8:
-            decoder = self.UTF8Decoder() if opcode == 1 else None
-            decompressor = self._get_permessage_deflate_dec(rsv1)
-            message = self.Message(opcode, decoder=decoder, decompressor=decompressor)
-        if not length:
-            message.push(b'', final=finished)
-        else:
-            while received < length:
-                d = self.socket.recv(length - received)
-                if not d:
-                    raise ConnectionClosedError()
-                dlen = len(d)
-                if masked:
-                    d = self._apply_mask(d, mask, length=dlen, offset=received)
-                received = received + dlen
-                try:
-                    message.push(d, final=finished)
-                except (UnicodeDecodeError, ValueError):
-                    raise FailedConnectionError(
-                        1007, "Text data must be valid utf-8")
-        return message
+        mask = recv(4) if masked else None
+        return opcode, finished, rsv1, length, mask
 
     def _pack_message(self, message, masked=False,
                       continuation=False, final=True, control_code=None):
@@ -730,18 +1233,18 @@ class RFC6455WebSocket(WebSocket):
             is_text = True
 
         compress_bit = 0
-        compressor = self._get_permessage_deflate_enc()
+        # control frames are never compressed
+        compressor = None if control_code else self._get_permessage_deflate_enc()
         if message and compressor:
             message = compressor.compress(message)
             message += compressor.flush(zlib.Z_SYNC_FLUSH)
             assert message[-4:] == b"\x00\x00\xff\xff"
-            message = message[:-4]
+            # only the end of the whole message drops the empty block
+            if final:
+                message = message[:-4]
             compress_bit = 1 << 6
 
         length = len(message)
-        if not length:
-            # no point masking empty data
-            masked = False
         if control_code:
             if control_code not in (8, 9, 0xA):
                 raise ProtocolError('Unknown control opcode.')
@@ -773,20 +1276,185 @@ class RFC6455WebSocket(WebSocket):
         return b''.join((header, lengthdata, maskdata, message))
 
     def wait(self):
+        if not self._finish_stream():
+            return None
         for i in self.iterator:
             return i
 
-    def _send(self, frame):
-        self._sendlock.acquire()
+    def wait_stream(self, chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        """Wait for the next message like :meth:`wait`, but return an
+        iterator over its data instead of the whole message, or None if the
+        connection has been closed.
+
+        The data is read, decompressed and decoded as the iterator is
+        advanced, at most *chunk_size* bytes at a time, so the message is
+        never held in memory as a whole.  Its chunks are text for text
+        messages and bytes for binary ones.  If the connection fails or is
+        closed before the end of the message, the iterator closes the
+        websocket as :meth:`wait` would and raises
+        :class:`ConnectionClosedError`.  Whatever the caller does not
+        consume is skipped by the next :meth:`wait` or :meth:`wait_stream`.
+        """
+        if not self._finish_stream():
+            return None
         try:
-            self.socket.sendall(frame)
-        finally:
-            self._sendlock.release()
+            while True:
+                header = self._recv_header()
+                if not header[0] & 8:
+                    break
+                self._recv_control(*header)
+        except FailedConnectionError as e:
+            self._stream_closed = True
+            self.close(close_data=(e.status, e.message))
+            return None
+        except ConnectionClosedError:
+            self._stream_closed = True
+            return None
+        except Exception:
+            self._stream_closed = True
+            self.close(close_data=(1011, 'Internal Server Error'))
+            raise
+        self._stream = self._iter_stream(header, chunk_size)
+        return self._stream
+
+    def _finish_stream(self):
+        """Skip the rest of the last streamed message; returns False if the
+        connection was closed meanwhile."""
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                for _ in stream:
+                    pass
+            except ConnectionClosedError:
+                pass
+        return not self._stream_closed
+
+    def _recv_control(self, opcode, finished, rsv1, length, mask):
+        data = self._get_bytes(length) if length else b''
+        if mask is not None:
+            data = self._apply_mask(data, mask)
+        self._handle_control_frame(opcode, data)
+
+    def _iter_stream(self, header, chunk_size):
+        try:
+            for chunk in self._iter_chunks(header, chunk_size):
+                yield chunk
+        except FailedConnectionError as e:
+            self._stream_closed = True
+            self.close(close_data=(e.status, e.message))
+            raise ConnectionClosedError()
+        except ConnectionClosedError:
+            self._stream_closed = True
+            raise
+        except Exception:
+            self._stream_closed = True
+            self.close(close_data=(1011, 'Internal Server Error'))
+            raise
+
+    def _iter_chunks(self, header, chunk_size):
+        opcode, finished, rsv1, length, mask = header
+        decoder = self.UTF8Decoder() if opcode == 1 else None
+        decompressor = self._get_permessage_deflate_dec(rsv1)
+        received = size = 0
+        while True:
+            received += length
+            self._check_size(received)
+            offset = 0
+            while offset < length or (finished and offset == length):
+                n = min(chunk_size, length - offset)
+                data = self._get_bytes(n) if n else b''
+                if mask is not None:
+                    data = self._apply_mask(data, mask, offset=offset)
+                offset += n
+                last = finished and offset == length
+                if decompressor is not None:
+                    if last:
+                        data += b'\x00\x00\xff\xff'
+                    chunks = self._inflate(decompressor, data, chunk_size)
+                else:
+                    chunks = (data, )
+                for chunk in chunks:
+                    if decompressor is not None:
+                        size += len(chunk)
+                        self._check_size(size)
+                    if decoder is not None:
+                        try:
+                            chunk = decoder.decode(chunk)
+                        except (UnicodeDecodeError, ValueError):
+                            raise FailedConnectionError(
+                                1007, "Text data must be valid utf-8")
+                    if chunk:
+                        yield chunk
+                if last:
+                    if decoder is not None:
+                        try:
+                            decoder.decode(b'', True)
+                        except (UnicodeDecodeError, ValueError):
+                            raise FailedConnectionError(
+                                1007, "Text data must be valid utf-8")
+                    return
+            # control frames may be sent between the fragments
+            while True:
+                opcode, finished, rsv1, length, mask = self._recv_header(True)
+                if not opcode & 8:
+                    break
+                self._recv_control(opcode, finished, rsv1, length, mask)
+
+    @staticmethod
+    def _inflate(decompressor, data, chunk_size):
+        while data:
+            chunk = decompressor.decompress(data, chunk_size)
+            data = decompressor.unconsumed_tail
+            yield chunk
+
+    def _frame_key(self):
+        if self.client:
+            # every frame gets a mask of its own
+            return None
+        options = self.extensions.get("permessage-deflate")
+        if options is None:
+            return (self.version, )
+        if options.get("server_no_context_takeover"):
+            # compressed from scratch every time, so the same for everyone
+            return (self.version, "permessage-deflate",
+                    options.get("server_max_window_bits", zlib.MAX_WBITS),
+                    self.deflate_options.get('mem_level'), self.deflate_options.get('dictionary'))
+        return None
+
+    def _frame(self, message):
+        return self._pack_message(message, masked=self.client)
+
+    def _compresses_with_context(self):
+        options = self.extensions.get("permessage-deflate")
+        return options is not None and not options.get(
+            "client_no_context_takeover" if self.client else "server_no_context_takeover")
+
+    def _frame_queued(self):
+        """Frame the messages queued to be framed by the writer, so that a
+        frame compressed now follows them through the compressor as it
+        follows them on the wire.  They can't be discarded afterwards."""
+        outbox = self._outbox
+        for i, (frame, message, size, droppable) in enumerate(outbox):
+            if frame is None:
+                outbox[i] = (self._frame(message), None, size, False)
 
     def send(self, message, **kw):
         kw['masked'] = self.client
-        payload = self._pack_message(message, **kw)
-        self._send(payload)
+        control = kw.get('control_code')
+        fragment = kw.get('continuation') or not kw.get('final', True)
+        if (self._outbox and not control and (fragment or self._send_queue is None) and
+                self._compresses_with_context()):
+            self._frame_queued()
+        if self._send_queue is None:
+            self._send(self._pack_message(message, **kw))
+        elif control or fragment:
+            self._send_or_queue(self._pack_message(message, **kw))
+        elif self._compresses_with_context():
+            # a frame compressed now could not be discarded anymore
+            # without breaking the frames compressed after it
+            self._send_or_queue(None, message, len(message), droppable=True)
+        else:
+            self._send_or_queue(self._pack_message(message, **kw), droppable=True)
 
     def _send_closing_frame(self, ignore_send_errors=False, close_data=None):
         if self.version in (8, 13) and not self.websocket_closed:
@@ -799,6 +1467,7 @@ class RFC6455WebSocket(WebSocket):
                 data = ''
             try:
                 self.send(data, control_code=8)
+                self._flush()
             except SocketError:
                 # Sometimes, like when the remote side cuts off the connection,
                 # we don't care about this.
@@ -810,5 +1479,259 @@ class RFC6455WebSocket(WebSocket):
         """Forcibly close the websocket; generally it is preferable to
         return from the handler method."""
         self._send_closing_frame(close_data=close_data)
-        self.socket.shutdown(socket.SHUT_WR)
+        self._close_socket()
+
+    def _close_socket(self):
+        try:
+            self.socket.shutdown(socket.SHUT_WR)
+        except SocketError:
+            # the peer was faster
+            pass
         self.socket.close()
+
+
+def broadcast(websockets, message, backlog=DEFAULT_BROADCAST_BACKLOG, overflow='disconnect'):
+    """Send *message* to every websocket in *websockets* without waiting for
+    any of them.
+
+    The message is encoded, compressed and framed once for all connections
+    that would turn it into the same bytes; only connections that compress
+    with context takeover need frames of their own.  Frames then wait in a
+    queue per connection, written out by a greenthread of that connection.
+
+    *backlog* bounds each queue.  When a connection falls that far behind,
+    *overflow* decides what happens: ``'disconnect'`` shuts the connection
+    down, while ``'coalesce'`` discards the messages still queued for it so
+    that it gets the newest one next, which suits feeds where only the
+    latest value matters.  Connections that have a send queue of their own
+    (see :meth:`WebSocket.set_send_queue`) follow its limits instead.
+
+    Returns the list of websockets disconnected by this call.
+    """
+    if overflow not in ('disconnect', 'coalesce'):
+        raise ValueError('overflow must be "disconnect" or "coalesce"')
+    frames = {}
+    dropped = []
+    for ws in websockets:
+        if ws.websocket_closed:
+            continue
+        key = ws._frame_key()
+        if key is None:
+            frame = None
+            size = len(message)
+        else:
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = ws._frame(message)
+            size = len(frame)
+        if ws._send_queue is None:
+            queued = ws._enqueue(frame, message, size, True, backlog, overflow)
+        else:
+            queued = ws._enqueue(frame, message, size)
+        if not queued:
+            dropped.append(ws)
+    return dropped
+
+
+def connect(url, protocols=None, origin=None, headers=None, timeout=None, ssl_context=None,
+            permessage_deflate=True, ping_interval=None, ping_timeout=None,
+            max_message_size=None):
+    """Open a websocket connection to *url*, ``ws://`` or ``wss://``, and
+    return it as an :class:`RFC6455WebSocket` in client mode.
+
+    *protocols* lists the subprotocols to offer; the one the server picked
+    becomes the ``protocol`` attribute of the result.  *origin* and the
+    ``(name, value)`` pairs of *headers* are added to the request.
+    *timeout* applies to connecting and to the handshake only.  ``wss://``
+    connections use *ssl_context*, by default the one made by
+    :func:`ssl.create_default_context`.
+
+    permessage-deflate is offered unless *permessage_deflate* is False.  A
+    dict of settings for this end of the connection may be given instead:
+    ``max_window_bits``, ``context_takeover``, ``mem_level``,
+    ``idle_timeout`` and ``dictionary``, as described for
+    :meth:`WebSocketWSGI.configured`.
+
+    With *ping_interval*, a greenthread pings the server that often and cuts
+    the connection if no pong comes back within *ping_timeout* seconds,
+    *ping_interval* by default.  Pongs are only noticed while a greenthread
+    waits for messages.
+
+    A server sending a message larger than *max_message_size* bytes fails
+    the connection; None means no limit.
+
+    Raises :class:`HandshakeError` if the server does not accept the
+    upgrade, socket.error if it cannot be reached.
+    """
+    parsed = six.moves.urllib.parse.urlparse(url)
+    scheme = parsed.scheme.lower()
+    if scheme not in ('ws', 'wss'):
+        raise ValueError('not a websocket URL: %r' % (url, ))
+    host = parsed.hostname
+    port = parsed.port or (443 if scheme == 'wss' else 80)
+    resource = parsed.path or '/'
+    if parsed.query:
+        resource += '?' + parsed.query
+    deflate = {} if permessage_deflate is True else permessage_deflate
+    if deflate:
+        for key in ('client_context_takeover', 'client_max_window_bits'):
+            if key in deflate:
+                raise ValueError('%s only applies to servers' % key)
+        _check_deflate_options(deflate)
+
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        if scheme == 'wss':
+            from eventlet.green import ssl
+            if ssl_context is None:
+                ssl_context = ssl.create_default_context()
+            sock = ssl_context.wrap_socket(sock, server_hostname=host)
+        key = base64.b64encode(os.urandom(16))
+        request = [
+            'GET %s HTTP/1.1' % resource,
+            'Host: %s' % (parsed.netloc.rpartition('@')[2], ),
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Key: %s' % key.decode('ascii'),
+            'Sec-WebSocket-Version: 13',
+        ]
+        if origin is not None:
+            request.append('Origin: %s' % origin)
+        if protocols:
+            request.append('Sec-WebSocket-Protocol: %s' % ', '.join(protocols))
+        if deflate is not False:
+            offer = {'client_max_window_bits': deflate.get('max_window_bits') or True}
+            if deflate.get('context_takeover') is False:
+                offer['client_no_context_takeover'] = True
+            request.append('Sec-WebSocket-Extensions: %s' % WebSocketWSGI._format_extension_header(
+                {'permessage-deflate': offer}).decode('ascii'))
+        for name, value in headers or ():
+            request.append('%s: %s' % (name, value))
+        sock.sendall(('\r\n'.join(request) + '\r\n\r\n').encode('latin-1'))
+
+        reader = greenio.GreenSocketReader(sock)
+        protocol, extensions = _check_handshake(
+            reader.readuntil(b'\r\n\r\n', MAX_HANDSHAKE_SIZE), key, protocols, deflate)
+        sock.settimeout(None)
+    except BaseException:
+        sock.close()
+        raise
+
+    ws = RFC6455WebSocket(sock, {}, protocol=protocol, client=True, extensions=extensions,
+                          max_message_size=max_message_size,
+                          deflate_options=deflate or None, reader=reader)
+    if ping_interval:
+        greenthread.spawn_n(_keepalive, ws, ping_interval, ping_timeout or ping_interval)
+    return ws
+
+
+def _check_handshake(response, key, protocols, deflate):
+    """Validate the server's answer to :func:`connect`'s request; returns the
+    negotiated protocol and extensions."""
+    if not response.endswith(b'\r\n\r\n'):
+        raise HandshakeError('incomplete handshake response')
+    lines = response.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+        raise HandshakeError('malformed status line %r' % (lines[0], ))
+    status = int(parts[1])
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = headers[name] + ', ' + value if name in headers else value
+    if status != 101:
+        raise HandshakeError('server answered %s' % lines[0], status, headers)
+    connection = [token.strip() for token in headers.get('connection', '').lower().split(',')]
+    if headers.get('upgrade', '').lower() != 'websocket' or 'upgrade' not in connection:
+        raise HandshakeError('server did not upgrade to websocket', status, headers)
+    accept = base64.b64encode(sha1(key + PROTOCOL_GUID).digest()).decode('ascii')
+    if headers.get('sec-websocket-accept') != accept:
+        raise HandshakeError('wrong Sec-WebSocket-Accept', status, headers)
+    protocol = headers.get('sec-websocket-protocol')
+    if protocol is not None and protocol not in (protocols or ()):
+        raise HandshakeError('server picked a protocol that was not offered', status, headers)
+
+    extensions = {}
+    accepted = WebSocketWSGI._parse_extension_header(headers.get('sec-websocket-extensions'))
+    for name, configs in (accepted or {}).items():
+        if name != 'permessage-deflate' or deflate is False or len(configs) != 1:
+            raise HandshakeError('server accepted an extension that was not offered',
+                                 status, headers)
+        config = {}
+        for param, value in configs[0].items():
+            if param in ('server_no_context_takeover', 'client_no_context_takeover'):
+                config[param] = True
+            elif param in ('server_max_window_bits', 'client_max_window_bits'):
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = None
+                if value is None or not 8 <= value <= 15:
+                    raise HandshakeError('bad permessage-deflate parameter %s' % param,
+                                         status, headers)
+                config[param] = value
+            else:
+                raise HandshakeError('unknown permessage-deflate parameter %s' % param,
+                                     status, headers)
+        # a smaller window or no context takeover on our side never
+        # bothers the server
+        if deflate.get('max_window_bits'):
+            config['client_max_window_bits'] = min(
+                config.get('client_max_window_bits', 15), deflate['max_window_bits'])
+        if deflate.get('context_takeover') is False:
+            config['client_no_context_takeover'] = True
+        extensions[name] = config
+    return protocol, extensions
+
+
+def _keepalive(ws, interval, timeout):
+    try:
+        while not ws.websocket_closed:
+            greenthread.sleep(interval)
+            if ws.websocket_closed:
+                break
+            pongs = ws._pongs
+            ws.send(b'', control_code=9)
+            greenthread.sleep(timeout)
+            if ws._pongs == pongs and not ws.websocket_closed:
+                ws._drop()
+    except (SocketError, IOError):
+        pass
+
+
+def reconnecting(url, min_delay=0.5, max_delay=30.0, **kwargs):
+    """Generate connections to *url*, made by :func:`connect` with
+    *kwargs*: every time the caller asks for the next one, the previous
+    connection is closed and a new one opened.  Failed attempts are retried
+    with exponential backoff from *min_delay* up to *max_delay* seconds,
+    randomized so that many clients do not come back all at once::
+
+        for ws in websocket.reconnecting('wss://example.com/feed', ping_interval=30):
+            while True:
+                message = ws.wait()
+                if message is None:
+                    break
+                handle(message)
+    """
+    delay = min_delay
+    ws = None
+    while True:
+        if ws is not None:
+            try:
+                ws.socket.close()
+            except SocketError:
+                pass
+            greenthread.sleep(min_delay)
+        try:
+            ws = connect(url, **kwargs)
+        except (SocketError, IOError, ProtocolError):
+            ws = None
+            greenthread.sleep(delay / 2 + random.uniform(0, delay / 2))
+            delay = min(delay * 2, max_delay)
+            continue
+        delay = min_delay
+        yield ws
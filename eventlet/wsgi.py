@@ -1,17 +1,28 @@
+import collections
 import errno
+import heapq
+import json
+import math
+import operator
 import os
+import random
+import re
+import signal
+import stat
 import sys
 import time
 import traceback
 import types
 import warnings
+import zlib
 
 import eventlet
 from eventlet import greenio
+from eventlet import hubs
 from eventlet import support
 from eventlet.green import BaseHTTPServer
 from eventlet.green import socket
-from eventlet.support import six
+from eventlet.support import greenlets as greenlet, six
 from eventlet.support.six.moves import urllib
 
 
@@ -21,19 +32,41 @@ MAX_REQUEST_LINE = 8192
 MAX_HEADER_LINE = 8192
 MAX_TOTAL_HEADER_SIZE = 65536
 MINIMUM_CHUNK_SIZE = 4096
+DEFAULT_PIPELINE_DEPTH = 16
+# largest response held back to go out with the next pipelined one
+PIPELINE_HOLD_MAX = 16384
+DEFAULT_ACCESS_LOG_BUFFER = 4096
+DEFAULT_COMPRESSION = {
+    # smaller bodies are sent as they are
+    'min_size': 1024,
+    'level': 6,
+    # content types worth compressing, matched as prefixes
+    'types': ('text/', 'application/json', 'application/javascript', 'application/xml',
+              'application/xhtml+xml', 'application/rss+xml', 'application/atom+xml',
+              'application/ld+json', 'image/svg+xml'),
+    # bodies and chunks this large are compressed in a native thread
+    'tpool_size': 65536,
+}
 # %(client_port)s is also available
 DEFAULT_LOG_FORMAT = ('%(client_ip)s - - [%(date_time)s] "%(request_line)s"'
                       ' %(status_code)s %(body_length)s %(wall_seconds).6f')
 RESPONSE_414 = b'''HTTP/1.0 414 Request URI Too Long\r\n\
 Connection: close\r\n\
 Content-Length: 0\r\n\r\n'''
+RESPONSE_503 = ('HTTP/1.1 503 Service Unavailable\r\n'
+                'Connection: close\r\n'
+                'Content-Length: 0\r\n'
+                'Retry-After: {0}\r\n\r\n')
+# how often the event loop lag is sampled for admission control
+QUEUE_LATENCY_INTERVAL = 0.1
 is_accepting = True
 
 STATE_IDLE = 'idle'
 STATE_REQUEST = 'request'
 STATE_CLOSE = 'close'
 
-__all__ = ['server', 'format_date_time']
+__all__ = ['server', 'serve_forked', 'format_date_time', 'FileWrapper', 'AccessLog',
+           'ServerMetrics', 'Histogram', 'format_prometheus']
 
 # Weekday and month names for HTTP date/time formatting; always English!
 _weekdayname = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
@@ -50,6 +83,122 @@ def format_date_time(timestamp):
     )
 
 
+# second the cached Date header line was formatted for, and the line
+_date_header = [None, '']
+
+
+def _date_header_line():
+    """The Date header line for the current second."""
+    now = int(time.time())
+    if now != _date_header[0]:
+        _date_header[:] = [now, 'Date: %s\r\n' % format_date_time(now)]
+    return _date_header[1]
+
+
+# second the cached access log time was formatted for, and the string
+_log_date_time_cache = [None, '']
+
+
+def _log_date_time(timestamp):
+    """Formats a unix timestamp the way BaseHTTPRequestHandler logs it,
+    in local time."""
+    second = int(timestamp)
+    if second != _log_date_time_cache[0]:
+        year, month, day, hh, mm, ss, _wd, _y, _z = time.localtime(second)
+        _log_date_time_cache[:] = [second, '%02d/%3s/%04d %02d:%02d:%02d' % (
+            day, _monthname[month], year, hh, mm, ss)]
+    return _log_date_time_cache[1]
+
+
+class _HeaderNames(dict):
+    """Memo of capitalized response header names:
+    ``_header_names['content-TYPE'] == 'Content-Type'``."""
+
+    # responses normally use a handful of names; don't let an application
+    # inventing new ones grow the memo without bound
+    max_size = 1024
+
+    def __missing__(self, name):
+        value = '-'.join([x.capitalize() for x in name.split('-')])
+        if len(self) < self.max_size:
+            self[name] = value
+        return value
+
+
+_header_names = _HeaderNames()
+
+
+def _compression_options(compression):
+    """Checks *compression* as passed to :func:`server` and returns the
+    options with the defaults filled in, or None to not compress."""
+    if not compression:
+        return None
+    options = dict(DEFAULT_COMPRESSION)
+    if compression is not True:
+        unknown = set(compression) - set(options)
+        if unknown:
+            raise ValueError('unknown compression options: {0}'.format(', '.join(sorted(unknown))))
+        options.update(compression)
+    if not 0 <= options['level'] <= 9:
+        raise ValueError('compression level must be from 0 to 9')
+    options['types'] = tuple(t.lower() for t in options['types'])
+    return options
+
+
+def _accepted_coding(accept_encoding):
+    """The content coding to compress a response with given the request's
+    Accept-Encoding: 'gzip', 'deflate' or None."""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        params = item.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[params[0].strip().lower()] = q
+    default = qualities.get('*', 0.0)
+    gzip = qualities.get('gzip', qualities.get('x-gzip', default))
+    deflate = qualities.get('deflate', default)
+    if gzip > 0 and gzip >= deflate:
+        return 'gzip'
+    if deflate > 0:
+        return 'deflate'
+    return None
+
+
+def _compressor(coding, level):
+    if coding == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zlib.compressobj(level)
+
+
+def _compress(compressor, data, mode, tpool_size):
+    """Compress and flush *data*, in a native thread if it is big."""
+    def run():
+        return compressor.compress(data) + compressor.flush(mode)
+    if len(data) >= tpool_size:
+        from eventlet import tpool
+        return tpool.execute(run)
+    return run()
+
+
+def _client_host_port(addr, forwarded_for=None):
+    """The client's (host, port) for logging, the host prefixed with the
+    X-Forwarded-For value if there is one."""
+    host, port = addr_to_host_port(addr)
+    if forwarded_for:
+        forward = forwarded_for.replace(' ', '')
+        if forward:
+            host = forward + ',' + host
+    return (host, port)
+
+
 def addr_to_host_port(addr):
     host = 'unix'
     port = ''
@@ -84,6 +233,27 @@ class _AlreadyHandled(object):
 ALREADY_HANDLED = _AlreadyHandled()
 
 
+class FileWrapper(object):
+    """``wsgi.file_wrapper``: wraps a file-like object returned as a response
+    body.  Real files are sent with ``sendfile``, other objects are read in
+    *blksize* pieces.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.blksize), b'')
+
+
+# discarded request bodies are all received into this one buffer: nobody
+# ever reads it, so green threads may as well share it
+_discard_buffer = memoryview(bytearray(64 << 10))
+
+
 class Input(object):
 
     def __init__(self,
@@ -111,6 +281,9 @@ class Input(object):
         # calling set_hundred_continue_respose_headers() on env['wsgi.input']
         self.hundred_continue_headers = None
         self.is_hundred_continue_response_sent = False
+        # sends the responses held back for pipelining, which must reach
+        # the client before anything written to the socket directly
+        self._flush_held = None
 
     def send_hundred_continue_response(self):
         towrite = []
@@ -133,11 +306,22 @@ class Input(object):
         # Reinitialize chunk_length (expect more data)
         self.chunk_length = -1
 
-    def _do_read(self, reader, length=None):
+    def _hundred_continue(self):
         if self.wfile is not None and not self.is_hundred_continue_response_sent:
             # 100 Continue response
             self.send_hundred_continue_response()
             self.is_hundred_continue_response_sent = True
+
+    def _rfile_readinto(self, view):
+        readinto = getattr(self.rfile, 'readinto', None)
+        if readinto is not None:
+            return readinto(view)
+        data = self.rfile.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def _do_read(self, reader, length=None):
+        self._hundred_continue()
         if (self.content_length is not None) and (
                 length is None or length > self.content_length - self.position):
             length = self.content_length - self.position
@@ -150,11 +334,51 @@ class Input(object):
         self.position += len(read)
         return read
 
+    def _do_readinto(self, view):
+        self._hundred_continue()
+        length = len(view)
+        if self.content_length is not None:
+            length = min(length, self.content_length - self.position)
+        if length <= 0:
+            return 0
+        try:
+            read = self._rfile_readinto(view[:length])
+        except greenio.SSL.ZeroReturnError:
+            read = 0
+        self.position += read
+        return read
+
+    def _chunked_readinto(self, view):
+        self._hundred_continue()
+        rfile = self.rfile
+        want = len(view)
+        got = 0
+        try:
+            while self.chunk_length != 0 and got < want:
+                maxreadlen = min(self.chunk_length - self.position, want - got)
+                if maxreadlen > 0:
+                    read = self._rfile_readinto(view[got:got + maxreadlen])
+                    if not read:
+                        self.chunk_length = 0
+                        raise IOError("unexpected end of file while parsing chunked data")
+                    got += read
+                    self.position += read
+                    if self.chunk_length == self.position:
+                        rfile.readline()
+                else:
+                    try:
+                        self.chunk_length = int(rfile.readline().split(b";", 1)[0], 16)
+                    except ValueError as err:
+                        raise ChunkReadError(err)
+                    self.position = 0
+                    if self.chunk_length == 0:
+                        rfile.readline()
+        except greenio.SSL.ZeroReturnError:
+            pass
+        return got
+
     def _chunked_read(self, rfile, length=None, use_readline=False):
-        if self.wfile is not None and not self.is_hundred_continue_response_sent:
-            # 100 Continue response
-            self.send_hundred_continue_response()
-            self.is_hundred_continue_response_sent = True
+        self._hundred_continue()
         try:
             if length == 0:
                 return ""
@@ -218,10 +442,32 @@ class Input(object):
     def readlines(self, hint=None):
         return self._do_read(self.rfile.readlines, hint)
 
+    def readinto(self, b):
+        """Read up to ``len(b)`` bytes of the body into the writable buffer
+        *b* without making a bytes object of them.  Fewer are read only at
+        the end of the body.  Returns the number of bytes read."""
+        view = memoryview(b)
+        if self.chunked_input:
+            return self._chunked_readinto(view)
+        return self._do_readinto(view)
+
+    def iter_chunks(self, chunk_size=64 << 10):
+        """Iterate over the body in memoryviews of up to *chunk_size* bytes.
+        They all look into the same buffer: a chunk is only valid until the
+        next one is asked for, copy it to keep it."""
+        view = memoryview(bytearray(chunk_size))
+        while True:
+            read = self.readinto(view)
+            if not read:
+                return
+            yield view[:read]
+
     def __iter__(self):
         return iter(self.read, b'')
 
     def get_socket(self):
+        if self._flush_held is not None:
+            self._flush_held()
         return self._sock
 
     def set_hundred_continue_response_headers(self, headers,
@@ -231,13 +477,17 @@ class Input(object):
         # Per HTTP RFC standard, header name is case-insensitive.
         # Please, fix your client to ignore header case if possible.
         if capitalize_response_headers:
-            headers = [
-                ('-'.join([x.capitalize() for x in key.split('-')]), value)
-                for key, value in headers]
+            headers = [(_header_names[key], value) for key, value in headers]
         self.hundred_continue_headers = headers
 
-    def discard(self, buffer_size=16 << 10):
-        while self.read(buffer_size):
+    def discard(self, buffer_size=None):
+        """Read and drop the rest of the body.  It is received into a
+        scratch buffer, *buffer_size* bytes at a time, so nothing is
+        allocated."""
+        view = _discard_buffer
+        if buffer_size is not None and buffer_size != len(view):
+            view = memoryview(bytearray(buffer_size))
+        while self.readinto(view):
             pass
 
 
@@ -296,6 +546,272 @@ class LoggerFileWrapper(LoggerNull):
         self.log.write(msg)
 
 
+class AccessLog(object):
+    """Access log that writes in batches, off the request path.
+
+    Requests only append a tuple to a ring buffer; a green thread formats
+    the records and writes them every *flush_interval* seconds.  Pass an
+    instance to :func:`server` as *access_log*::
+
+        wsgi.server(sock, app, access_log=wsgi.AccessLog(open('access.log', 'a'), json=True))
+
+    :param log: File-like object or logging.Logger instance the lines are written to.
+                Default is sys.stderr.
+    :param log_format: A python format string for the lines, taking the same values as
+                :func:`server`'s *log_format*.
+    :param json: Write every record as a JSON object on a line of its own instead.
+    :param sample: Fraction of the requests that are logged.  Default 1.0 logs them all.
+    :param buffer_size: Number of records held between writes.  When the writer falls
+                behind, the oldest records are dropped and counted in :attr:`dropped`.
+    :param flush_interval: Seconds between writes.
+    :param use_tpool: Write through :mod:`eventlet.tpool`, so that a slow disk or a full
+                pipe holds up a native thread rather than every green thread.
+    """
+
+    def __init__(self, log=None, log_format=DEFAULT_LOG_FORMAT, json=False, sample=1.0,
+                 buffer_size=DEFAULT_ACCESS_LOG_BUFFER, flush_interval=0.1, use_tpool=False):
+        if not 0 < sample <= 1:
+            raise ValueError('sample must be more than 0 and at most 1')
+        self.log = log or sys.stderr
+        self.log_format = log_format
+        self.json = json
+        self.sample = sample
+        self.flush_interval = flush_interval
+        self.use_tpool = use_tpool
+        #: Number of records lost because the buffer was full.
+        self.dropped = 0
+        self._records = collections.deque(maxlen=buffer_size)
+        self._writer = None
+
+    def record(self, client_address, forwarded_for, request_line, status_code,
+               body_length, finish, wall_seconds):
+        """Buffer one request; formatting is left to the writer."""
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+        records = self._records
+        if len(records) == records.maxlen:
+            self.dropped += 1
+        records.append((client_address, forwarded_for, request_line, status_code,
+                        body_length, finish, wall_seconds))
+        if self._writer is None:
+            self._writer = eventlet.spawn_after(self.flush_interval, self._write_later)
+
+    def flush(self):
+        """Format and write the buffered records now."""
+        records = self._records
+        if not records:
+            return
+        batch = list(records)
+        records.clear()
+        format_record = self._format_json if self.json else self._format
+        lines = [format_record(record) for record in batch]
+        if self.use_tpool:
+            from eventlet import tpool
+            tpool.execute(self._write, lines)
+        else:
+            self._write(lines)
+
+    def _write_later(self):
+        try:
+            self.flush()
+        finally:
+            # records that came in while writing wait for the next round
+            self._writer = None
+            if self._records:
+                self._writer = eventlet.spawn_after(self.flush_interval, self._write_later)
+
+    def _fields(self, record):
+        (client_address, forwarded_for, request_line, status_code,
+         body_length, finish, wall_seconds) = record
+        client_ip, client_port = _client_host_port(client_address, forwarded_for)
+        return {
+            'client_ip': client_ip,
+            'client_port': client_port,
+            'date_time': _log_date_time(finish),
+            'request_line': request_line,
+            'status_code': status_code,
+            'body_length': body_length,
+            'wall_seconds': wall_seconds,
+        }
+
+    def _format(self, record):
+        return self.log_format % self._fields(record)
+
+    def _format_json(self, record):
+        return json.dumps(self._fields(record), sort_keys=True)
+
+    def _write(self, lines):
+        log = self.log
+        if callable(getattr(log, 'info', None)):
+            for line in lines:
+                log.info(line)
+        else:
+            log.write(''.join([line + '\n' for line in lines]))
+
+
+class Histogram(object):
+    """Histogram of durations in the manner of HdrHistogram: values are
+    counted in buckets an eighth of a power of two microseconds wide, so
+    recording is a few arithmetic operations and quantiles are within 12.5%
+    of the real values, from microseconds up to about an hour."""
+
+    # buckets 0-15 hold 0-15us one by one; above that every power of two
+    # gets 8 buckets, up to 2**32us
+    _buckets = 240
+
+    def __init__(self):
+        self.counts = [0] * self._buckets
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Count a duration of *seconds*."""
+        us = int(seconds * 1000000)
+        if us < 16:
+            index = us if us > 0 else 0
+        else:
+            shift = math.frexp(us)[1] - 4
+            index = min((shift << 3) + (us >> shift), self._buckets - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def _upper_bound(index):
+        # in seconds, the first value not counted in bucket *index*
+        if index < 16:
+            return (index + 1) / 1000000.0
+        shift = (index >> 3) - 1
+        return (((index & 7) | 8) + 1 << shift) / 1000000.0
+
+    def quantile(self, q):
+        """The duration *q* (0 to 1) of the recorded ones are shorter than,
+        0.0 if nothing was recorded."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'quantiles': dict((q, self.quantile(q)) for q in (0.5, 0.9, 0.99, 0.999)),
+        }
+
+
+class ServerMetrics(object):
+    """Counters and latency histograms of a :func:`server`, passed to it as
+    *metrics*.  Collecting them costs a few microseconds per request.
+
+    :meth:`snapshot` returns the current values as a dict, and :meth:`app`
+    is a WSGI application serving them in the format made by *exporter*,
+    a function taking a snapshot and returning text, by default
+    :func:`format_prometheus`.  The histograms are:
+
+    - ``queue_wait``: from accepting a connection until a green thread
+      starts handling it
+    - ``app_time``: calling the application, until it returns the response
+      iterable
+    - ``total_time``: from having read the request head to having sent
+      the response
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter or format_prometheus
+        self.queue_wait = Histogram()
+        self.app_time = Histogram()
+        self.total_time = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.accepted = 0
+        self.errors = collections.defaultdict(int)
+        self.server = None
+        self.connections = {}
+
+    def error(self, kind):
+        self.errors[kind] += 1
+
+    def snapshot(self):
+        """The current values, as plain dicts and numbers."""
+        active = idle = 0
+        for cs in list(six.itervalues(self.connections)):
+            if cs[2] == STATE_IDLE and cs[3] is not None:
+                idle += 1
+            elif cs[2] != STATE_CLOSE:
+                active += 1
+        server = self.server
+        return {
+            'requests': self.total_time.count,
+            'outstanding_requests': server.outstanding_requests if server else 0,
+            'queue_latency': server.queue_latency if server else 0.0,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'connections': {
+                'active': active,
+                'idle': idle,
+                'total': active + idle,
+                'accepted': self.accepted,
+            },
+            'errors': dict(self.errors),
+            'queue_wait': self.queue_wait.snapshot(),
+            'app_time': self.app_time.snapshot(),
+            'total_time': self.total_time.snapshot(),
+        }
+
+    def app(self, environ, start_response):
+        """WSGI application exporting :meth:`snapshot`."""
+        body = self.exporter(self.snapshot())
+        if isinstance(body, six.text_type):
+            body = body.encode('utf-8')
+        start_response('200 OK', [('Content-Type', self.content_type),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def format_prometheus(snapshot, prefix='eventlet_wsgi'):
+    """Render a :meth:`ServerMetrics.snapshot` in the Prometheus text
+    exposition format; histograms become summaries."""
+    lines = []
+
+    def metric(name, kind, samples):
+        name = prefix + '_' + name
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            lines.append('%s%s %r' % (name, labels, value))
+
+    metric('requests_total', 'counter', [('', snapshot['requests'])])
+    metric('outstanding_requests', 'gauge', [('', snapshot['outstanding_requests'])])
+    metric('queue_latency_seconds', 'gauge', [('', snapshot['queue_latency'])])
+    metric('received_bytes_total', 'counter', [('', snapshot['bytes_in'])])
+    metric('sent_bytes_total', 'counter', [('', snapshot['bytes_out'])])
+    connections = snapshot['connections']
+    metric('connections', 'gauge', [
+        ('{state="%s"}' % state, connections[state]) for state in ('active', 'idle')])
+    metric('connections_accepted_total', 'counter', [('', connections['accepted'])])
+    metric('errors_total', 'counter', [
+        ('{type="%s"}' % kind, count) for kind, count in sorted(snapshot['errors'].items())])
+    for key in ('queue_wait', 'app_time', 'total_time'):
+        hist = snapshot[key]
+        samples = [('{quantile="%s"}' % q, value)
+                   for q, value in sorted(hist['quantiles'].items())]
+        metric(key + '_seconds', 'summary', samples)
+        lines.append('%s_%s_seconds_sum %r' % (prefix, key, hist['sum']))
+        lines.append('%s_%s_seconds_count %r' % (prefix, key, hist['count']))
+    return '\n'.join(lines) + '\n'
+
+
 class FileObjectForHeaders(object):
 
     def __init__(self, fp):
@@ -315,19 +831,66 @@ class FileObjectForHeaders(object):
         return rv
 
 
+# header continuation lines (obsolete line folding)
+_HEADER_FOLD = re.compile(r'\r?\n[ \t]+')
+
+
+def parse_headers(head):
+    """Split the header block of a request, without the request line, into a
+    tuple of ``(name, value)`` pairs and a dict of the WSGI environ keys for
+    them, in a single pass.  *head* is a native string.
+
+    Repeated headers are joined with commas, except Content-Type and
+    Content-Length, of which the first one counts.  Lines that are not
+    headers are ignored.
+    """
+    if '\n ' in head or '\n\t' in head:
+        head = _HEADER_FOLD.sub(' ', head)
+    headers = []
+    fields = {}
+    for line in head.split('\n'):
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        value = value.strip()
+        headers.append((name, value))
+        key = name.replace('-', '_').upper()
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            # These do not get the HTTP_ prefix
+            if key not in fields:
+                fields[key] = value
+            continue
+        key = 'HTTP_' + key
+        if key in fields:
+            fields[key] += ',' + value
+        else:
+            fields[key] = value
+    return tuple(headers), fields
+
+
 class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
     minimum_chunk_size = MINIMUM_CHUNK_SIZE
     capitalize_response_headers = True
+    headers_raw = ()
+    header_fields = {}
+    _headers = None
+    # responses waiting in the write buffer for the ones pipelined behind them
+    pipelined = 0
 
     # https://github.com/eventlet/eventlet/issues/295
     # Stdlib default is 0 (unbuffered), but then `wfile.writelines()` looses data
     # so before going back to unbuffered, remove any usage of `writelines`.
     wbufsize = 16 << 10
+    # bytes in the current request's head after the request line
+    head_size = 0
 
     def __init__(self, conn_state, server):
         self.request = conn_state[1]
         self.client_address = conn_state[0]
+        if len(conn_state) < 4:
+            # [addr, socket, state] without the idle timestamp
+            conn_state.append(None)
         self.conn_state = conn_state
         self.server = server
         self.setup()
@@ -349,7 +912,10 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
                 pass
 
         try:
-            self.rfile = conn.makefile('rb', self.rbufsize)
+            if isinstance(conn, greenio.GreenSocket) and not hasattr(conn, 'do_handshake'):
+                self.rfile = greenio.GreenSocketReader(conn)
+            else:
+                self.rfile = conn.makefile('rb', self.rbufsize)
             self.wfile = conn.makefile('wb', self.wbufsize)
         except (AttributeError, NotImplementedError):
             if hasattr(conn, 'send') and hasattr(conn, 'recv'):
@@ -368,6 +934,9 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
             self.handle_one_request()
             if self.conn_state[2] == STATE_CLOSE:
                 self.close_connection = 1
+            else:
+                self.conn_state[2] = STATE_IDLE
+                self.conn_state[3] = self.server.last_idle = time.time()
             if self.close_connection:
                 break
 
@@ -385,40 +954,65 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
                 raise
         return ''
 
+    def _read_next_request_line(self):
+        # waiting for the next request on a kept-alive connection is bounded
+        # by keepalive_timeout rather than socket_timeout
+        self.connection.settimeout(self.server.keepalive_timeout)
+        try:
+            return self._read_request_line()
+        except socket.timeout:
+            self.server.log.debug('({0}) keepalive timed out {1!r}'.format(
+                self.server.pid, self.client_address))
+            if self.server.metrics is not None:
+                self.server.metrics.error('keepalive_timeout')
+            return ''
+        finally:
+            self.connection.settimeout(self.server.socket_timeout)
+
     def handle_one_request(self):
         if self.server.max_http_version:
             self.protocol_version = self.server.max_http_version
 
-        self.raw_requestline = self._read_request_line()
+        if self.conn_state[2] == STATE_IDLE and self.server.keepalive_timeout is not None:
+            self.raw_requestline = self._read_next_request_line()
+        else:
+            self.raw_requestline = self._read_request_line()
+        if self.conn_state[2] == STATE_IDLE:
+            self.conn_state[2] = STATE_REQUEST
+            self.conn_state[3] = None
         if not self.raw_requestline:
             self.close_connection = 1
             return
         if len(self.raw_requestline) >= self.server.url_length_limit:
             self.wfile.write(RESPONSE_414)
             self.close_connection = 1
+            if self.server.metrics is not None:
+                self.server.metrics.error('bad_request')
             return
 
-        orig_rfile = self.rfile
         try:
-            self.rfile = FileObjectForHeaders(self.rfile)
             if not self.parse_request():
+                if self.server.metrics is not None and self.command is None:
+                    self.server.metrics.error('bad_request')
                 return
         except HeaderLineTooLong:
             self.wfile.write(
                 b"HTTP/1.0 400 Header Line Too Long\r\n"
                 b"Connection: close\r\nContent-length: 0\r\n\r\n")
             self.close_connection = 1
+            if self.server.metrics is not None:
+                self.server.metrics.error('bad_request')
             return
         except HeadersTooLarge:
             self.wfile.write(
                 b"HTTP/1.0 400 Headers Too Large\r\n"
                 b"Connection: close\r\nContent-length: 0\r\n\r\n")
             self.close_connection = 1
+            if self.server.metrics is not None:
+                self.server.metrics.error('bad_request')
             return
-        finally:
-            self.rfile = orig_rfile
 
-        content_length = self.headers.get('content-length')
+        content_length = self.header_fields.get('CONTENT_LENGTH')
         if content_length is not None:
             try:
                 int(content_length)
@@ -439,37 +1033,165 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
                 # Broken pipe, connection reset by peer
                 if support.get_errno(e) not in BROKEN_SOCK:
                     raise
+                if self.server.metrics is not None:
+                    self.server.metrics.error('disconnect')
         finally:
             self.server.outstanding_requests -= 1
 
+    def parse_request(self):
+        """Parse the request line and the headers.  Returns False if the
+        request can't be served, having sent an error response if needed.
+
+        Unlike the stdlib's version this does not build a message object:
+        the headers end up in :attr:`headers_raw` and :attr:`header_fields`,
+        the latter holding the WSGI environ keys for them.
+        """
+        self.command = None
+        self.request_version = version = self.default_request_version
+        self.close_connection = 1
+        self._headers = None
+        requestline = self.raw_requestline
+        if six.PY3:
+            requestline = requestline.decode('iso-8859-1')
+        self.requestline = requestline = requestline.rstrip('\r\n')
+        words = requestline.split()
+        if len(words) == 3:
+            command, path, version = words
+            try:
+                if version[:5] != 'HTTP/':
+                    raise ValueError
+                base_version_number = version.split('/', 1)[1]
+                major, minor = base_version_number.split('.')
+                version_number = int(major), int(minor)
+            except ValueError:
+                self.send_error(400, "Bad request version (%r)" % version)
+                return False
+            if version_number >= (1, 1) and self.protocol_version >= "HTTP/1.1":
+                self.close_connection = 0
+            if version_number >= (2, 0):
+                self.send_error(505, "Invalid HTTP Version (%s)" % base_version_number)
+                return False
+        elif len(words) == 2:
+            command, path = words
+            if command != 'GET':
+                self.send_error(400, "Bad HTTP/0.9 request type (%r)" % command)
+                return False
+        elif not words:
+            return False
+        else:
+            self.send_error(400, "Bad request syntax (%r)" % requestline)
+            return False
+        self.command, self.path, self.request_version = command, path, version
+
+        self.headers_raw, self.header_fields = parse_headers(self._read_head())
+
+        conntype = self.header_fields.get('HTTP_CONNECTION', '').lower()
+        if conntype == 'close':
+            self.close_connection = 1
+        elif conntype == 'keep-alive' and self.protocol_version >= "HTTP/1.1":
+            self.close_connection = 0
+        return True
+
+    def _read_head(self):
+        # Usually the whole header block arrived with the request line and
+        # sits in the read buffer: take it in one go.
+        peek = getattr(self.rfile, 'peek', None)
+        if peek is not None:
+            buf = peek(MAX_TOTAL_HEADER_SIZE)
+            if buf[:2] == b'\r\n':
+                end = 2
+            else:
+                end = buf.find(b'\r\n\r\n')
+                end = end + 4 if end >= 0 else 0
+            if end and end <= MAX_TOTAL_HEADER_SIZE and (
+                    end < MAX_HEADER_LINE or
+                    max(len(line) for line in buf[:end].split(b'\n')) < MAX_HEADER_LINE - 1):
+                head = self.rfile.read(end)
+                self.head_size = end
+                return head.decode('iso-8859-1') if six.PY3 else head
+
+        # Otherwise read it line by line.
+        rfile = FileObjectForHeaders(self.rfile)
+        lines = []
+        while True:
+            line = rfile.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            lines.append(line)
+        head = b''.join(lines)
+        self.head_size = len(head) + len(line)
+        if six.PY3:
+            head = head.decode('iso-8859-1')
+        return head
+
+    @property
+    def headers(self):
+        """The request headers as the stdlib's message object.  It is made
+        on first use, for code written against BaseHTTPRequestHandler."""
+        if self._headers is None:
+            if six.PY3:
+                self._headers = self.MessageClass()
+                for name, value in self.headers_raw:
+                    self._headers[name] = value
+            else:
+                text = ''.join('%s: %s\r\n' % header for header in self.headers_raw)
+                self._headers = self.MessageClass(six.StringIO(text + '\r\n'), 0)
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
     def handle_one_response(self):
         start = time.time()
         headers_set = []
         headers_sent = []
 
         wfile = self.wfile
+        sendall_vectored = getattr(self.connection, 'sendall_vectored', None)
         result = None
+        hold = [False]
         use_chunked = [False]
         length = [0]
         status_code = [200]
+        compression = self.server.compression
+        # whether compressing the response is still to be decided, and the
+        # compressor while a compressed body is being sent
+        negotiate = [compression is not None]
+        encoder = [None]
+
+        def start_compression(size):
+            negotiate[0] = False
+            coding = self._response_coding(headers_set[0], headers_set[1], size)
+            if coding is not None:
+                encoder[0] = _compressor(coding, compression['level'])
+            return encoder[0]
 
         def write(data):
             towrite = []
             if not headers_set:
                 raise AssertionError("write() before start_response()")
             elif not headers_sent:
+                if negotiate[0]:
+                    start_compression(None)
                 status, response_headers = headers_set
                 headers_sent.append(1)
-                header_list = [header[0].lower() for header in response_headers]
-                towrite.append(six.b('%s %s\r\n' % (self.protocol_version, status)))
+                # the head is built as one native string and encoded once
+                head = ['%s %s\r\n' % (self.protocol_version, status)]
+                has_date = has_length = False
                 for header in response_headers:
-                    towrite.append(six.b('%s: %s\r\n' % header))
+                    head.append('%s: %s\r\n' % header)
+                    name = header[0].lower()
+                    if name == 'date':
+                        has_date = True
+                    elif name == 'content-length':
+                        has_length = True
 
                 # send Date header?
-                if 'date' not in header_list:
-                    towrite.append(six.b('Date: %s\r\n' % (format_date_time(time.time()),)))
+                if not has_date:
+                    head.append(_date_header_line())
 
-                client_conn = self.headers.get('Connection', '').lower()
+                client_conn = self.header_fields.get('HTTP_CONNECTION', '').lower()
                 send_keep_alive = False
                 if self.close_connection == 0 and \
                    self.server.keepalive and (client_conn == 'keep-alive' or
@@ -482,28 +1204,41 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
                 else:
                     self.close_connection = 1
 
-                if 'content-length' not in header_list:
+                if not has_length:
                     if self.request_version == 'HTTP/1.1':
                         use_chunked[0] = True
-                        towrite.append(b'Transfer-Encoding: chunked\r\n')
-                    elif 'content-length' not in header_list:
+                        head.append('Transfer-Encoding: chunked\r\n')
+                    else:
                         # client is 1.0 and therefore must read to EOF
                         self.close_connection = 1
 
                 if self.close_connection:
-                    towrite.append(b'Connection: close\r\n')
+                    head.append('Connection: close\r\n\r\n')
                 elif send_keep_alive:
-                    towrite.append(b'Connection: keep-alive\r\n')
-                towrite.append(b'\r\n')
+                    head.append('Connection: keep-alive\r\n\r\n')
+                else:
+                    head.append('\r\n')
                 # end of header writing
+                towrite.append(six.b(''.join(head)))
 
+            if encoder[0] is not None:
+                # every write goes out as soon as it is made, compressed or not
+                data = _compress(encoder[0], data, zlib.Z_SYNC_FLUSH, compression['tpool_size'])
             if use_chunked[0]:
                 # Write the chunked encoding
-                towrite.append(six.b("%x" % (len(data),)) + b"\r\n" + data + b"\r\n")
+                towrite.append(six.b("%x\r\n" % (len(data),)))
+                towrite.append(data)
+                towrite.append(b"\r\n")
             else:
                 towrite.append(data)
-            wfile.writelines(towrite)
-            wfile.flush()
+            if hold[0] or self.pipelined or sendall_vectored is None:
+                wfile.writelines(towrite)
+                if not hold[0]:
+                    wfile.flush()
+                    self.pipelined = 0
+            else:
+                # nothing is buffered: hand the pieces to the socket as they are
+                sendall_vectored(towrite)
             length[0] = length[0] + sum(map(len, towrite))
 
         def start_response(status, response_headers, exc_info=None):
@@ -523,31 +1258,51 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
             # Please, fix your client to ignore header case if possible.
             if self.capitalize_response_headers:
                 response_headers = [
-                    ('-'.join([x.capitalize() for x in key.split('-')]), value)
+                    (_header_names[key], value)
                     for key, value in response_headers]
 
             headers_set[:] = [status, response_headers]
             return write
 
+        returned = None
         try:
             try:
                 result = self.application(self.environ, start_response)
+                returned = time.time()
                 if (isinstance(result, _AlreadyHandled)
                         or isinstance(getattr(result, '_obj', None), _AlreadyHandled)):
                     self.close_connection = 1
                     return
 
-                # Set content-length if possible
-                if not headers_sent and hasattr(result, '__len__') and \
-                        'Content-Length' not in [h for h, _v in headers_set[1]]:
-                    headers_set[1].append(('Content-Length', str(sum(map(len, result)))))
+                if isinstance(result, FileWrapper) and not headers_sent:
+                    if not (negotiate[0] and start_compression(None)):
+                        sent = self._sendfile(result.filelike, headers_set, write)
+                        if sent is not None:
+                            length[0] += sent
+                            return
+
+                body = result
+                if not headers_sent and hasattr(result, '__len__'):
+                    # the whole body is here: compress it in one go and
+                    # keep the response's length known
+                    if negotiate[0] and headers_set:
+                        body = [data.encode('ascii') if isinstance(data, six.text_type) else data
+                                for data in result]
+                        if start_compression(sum(map(len, body))) is not None:
+                            body = [_compress(encoder[0], b''.join(body), zlib.Z_FINISH,
+                                              compression['tpool_size'])]
+                            encoder[0] = None
+
+                    # Set content-length if possible
+                    if 'Content-Length' not in [h for h, _v in headers_set[1]]:
+                        headers_set[1].append(('Content-Length', str(sum(map(len, body)))))
 
                 towrite = []
                 towrite_size = 0
                 just_written_size = 0
                 minimum_write_chunk_size = int(self.environ.get(
                     'eventlet.minimum_write_chunk_size', self.minimum_chunk_size))
-                for data in result:
+                for data in body:
                     if len(data) == 0:
                         continue
                     if isinstance(data, six.text_type):
@@ -560,16 +1315,30 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
                         towrite = []
                         just_written_size = towrite_size
                         towrite_size = 0
+                # when the next request is already here, the end of this
+                # response goes out together with the next one
+                hold[0] = self._hold_response(length[0] + towrite_size)
                 if towrite:
                     just_written_size = towrite_size
                     write(b''.join(towrite))
+                if not headers_sent and negotiate[0] and headers_set:
+                    start_compression(0)
+                if encoder[0] is not None:
+                    # end of the compressed stream
+                    tail = encoder[0].flush()
+                    encoder[0] = None
+                    just_written_size = len(tail)
+                    write(tail)
                 if not headers_sent or (use_chunked[0] and just_written_size):
                     write(b'')
             except Exception:
                 self.close_connection = 1
+                if self.server.metrics is not None:
+                    self.server.metrics.error('app')
                 tb = traceback.format_exc()
                 self.server.log.info(tb)
                 if not headers_sent:
+                    negotiate[0] = False
                     err_body = six.b(tb) if self.server.debug else b''
                     start_response("500 Internal Server Error",
                                    [('Content-type', 'text/plain'),
@@ -597,27 +1366,131 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
             for hook, args, kwargs in self.environ['eventlet.posthooks']:
                 hook(self.environ, *args, **kwargs)
 
-            if self.server.log_output:
+            metrics = self.server.metrics
+            if metrics is not None:
+                metrics.app_time.record((returned or finish) - start)
+                metrics.total_time.record(finish - start)
+                metrics.bytes_in += (len(self.raw_requestline) + self.head_size +
+                                     request_input.position)
+                metrics.bytes_out += length[0]
+
+            access_log = self.server.access_log
+            if access_log is not None:
+                forward = None
+                if self.server.log_x_forwarded_for:
+                    forward = self.header_fields.get('HTTP_X_FORWARDED_FOR')
+                access_log.record(self.client_address, forward, self.requestline,
+                                  status_code[0], length[0], finish, finish - start)
+            elif self.server.log_output:
                 client_host, client_port = self.get_client_address()
 
                 self.server.log.info(self.server.log_format % {
                     'client_ip': client_host,
                     'client_port': client_port,
-                    'date_time': self.log_date_time_string(),
+                    'date_time': _log_date_time(finish),
                     'request_line': self.requestline,
                     'status_code': status_code[0],
                     'body_length': length[0],
                     'wall_seconds': finish - start,
                 })
 
-    def get_client_address(self):
-        host, port = addr_to_host_port(self.client_address)
+    def _response_coding(self, status, response_headers, size):
+        """Decide whether to compress the response, of *size* bytes if that is
+        known, and adjust *response_headers* accordingly.  Returns the content
+        coding to use or None."""
+        if self.command == 'HEAD' or status[:1] == '1' or status[:3] in ('204', '304'):
+            return None
+        options = self.server.compression
+        content_type = vary = None
+        for index, (name, value) in enumerate(response_headers):
+            name = name.lower()
+            if name == 'content-encoding':
+                return None
+            elif name == 'content-type':
+                content_type = value.lower()
+            elif name == 'content-length' and size is None:
+                try:
+                    size = int(value)
+                except ValueError:
+                    pass
+            elif name == 'vary':
+                vary = index
+        if content_type is None or not content_type.startswith(options['types']):
+            return None
+
+        # caches must tell compressed and plain responses apart
+        if vary is None:
+            response_headers.append(('Vary', 'Accept-Encoding'))
+        else:
+            name, value = response_headers[vary]
+            if value.strip() != '*' and 'accept-encoding' not in value.lower():
+                response_headers[vary] = (name, value + ', Accept-Encoding')
+
+        if size is not None and size < options['min_size']:
+            return None
+        coding = _accepted_coding(self.header_fields.get('HTTP_ACCEPT_ENCODING'))
+        if coding is not None:
+            response_headers[:] = [
+                header for header in response_headers if header[0].lower() != 'content-length']
+            response_headers.append(('Content-Encoding', coding))
+        return coding
+
+    def _sendfile(self, f, headers_set, write):
+        """Send the headers and the rest of the regular file *f* with the
+        socket's sendfile().  Returns the number of body bytes sent, or None
+        without having sent anything if *f* or the connection don't allow
+        it."""
+        sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is None or hasattr(self.connection, 'do_handshake'):
+            return None
+        try:
+            st = os.fstat(f.fileno())
+            offset = f.tell()
+        except (AttributeError, ValueError, EnvironmentError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        count = max(st.st_size - offset, 0)
+        response_headers = headers_set[1]
+        for name, value in response_headers:
+            if name.lower() == 'content-length':
+                count = min(count, int(value))
+                break
+        else:
+            response_headers.append(('Content-Length', str(count)))
+        write(b'')
+        sent = sendfile(f, offset, count)
+        if sent < count:
+            # the file got shorter; the response can't be completed
+            self.close_connection = 1
+        return sent
+
+    def _flush_held(self):
+        if self.pipelined:
+            self.wfile.flush()
+            self.pipelined = 0
+
+    def _hold_response(self, size):
+        # a held response waits for the whole of the next request, so only
+        # small ones on connections that stay open are held
+        if (self.close_connection or self.request_version == 'HTTP/1.0' or
+                size > PIPELINE_HOLD_MAX or
+                self.pipelined + 1 >= self.server.pipeline_depth):
+            return False
+        request_input = self.environ['eventlet.input']
+        if (request_input.chunked_input or
+                request_input.position < (request_input.content_length or 0)):
+            return False
+        if not _request_buffered(self.rfile, self.connection):
+            return False
+        self.pipelined += 1
+        return True
 
+    def get_client_address(self):
+        forward = None
         if self.server.log_x_forwarded_for:
-            forward = self.headers.get('X-Forwarded-For', '').replace(' ', '')
-            if forward:
-                host = forward + ',' + host
-        return (host, port)
+            forward = self.header_fields.get('HTTP_X_FORWARDED_FOR')
+        return _client_host_port(self.client_address, forward)
 
     def get_environ(self):
         env = self.server.get_environ()
@@ -630,17 +1503,11 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
         if len(pq) > 1:
             env['QUERY_STRING'] = pq[1]
 
-        ct = self.headers.get('content-type')
-        if ct is None:
-            try:
-                ct = self.headers.type
-            except AttributeError:
-                ct = self.headers.get_content_type()
-        env['CONTENT_TYPE'] = ct
-
-        length = self.headers.get('content-length')
-        if length:
-            env['CONTENT_LENGTH'] = length
+        env['headers_raw'] = self.headers_raw
+        env.update(self.header_fields)
+        if 'CONTENT_TYPE' not in self.header_fields:
+            env['CONTENT_TYPE'] = 'text/plain'
+        length = env.get('CONTENT_LENGTH')
         env['SERVER_PROTOCOL'] = 'HTTP/1.0'
 
         sockname = self.request.getsockname()
@@ -652,25 +1519,6 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
         env['REMOTE_PORT'] = str(client_addr[1])
         env['GATEWAY_INTERFACE'] = 'CGI/1.1'
 
-        try:
-            headers = self.headers.headers
-        except AttributeError:
-            headers = self.headers._headers
-        else:
-            headers = [h.split(':', 1) for h in headers]
-
-        env['headers_raw'] = headers_raw = tuple((k, v.strip()) for k, v in headers)
-        for k, v in headers_raw:
-            k = k.replace('-', '_').upper()
-            if k in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
-                # These do not get the HTTP_ prefix and were handled above
-                continue
-            envk = 'HTTP_' + k
-            if envk in env:
-                env[envk] += ',' + v
-            else:
-                env[envk] = v
-
         if env.get('HTTP_EXPECT') == '100-continue':
             wfile = self.wfile
             wfile_line = b'HTTP/1.1 100 Continue\r\n'
@@ -681,10 +1529,20 @@ class HttpProtocol(BaseHTTPServer.BaseHTTPRequestHandler):
         env['wsgi.input'] = env['eventlet.input'] = Input(
             self.rfile, length, self.connection, wfile=wfile, wfile_line=wfile_line,
             chunked_input=chunked)
+        env['eventlet.input']._flush_held = self._flush_held
         env['eventlet.posthooks'] = []
+        env['wsgi.file_wrapper'] = FileWrapper
+
+        # WebSocket connection is long-lived, it is idle as far as the
+        # server's graceful shutdown is concerned
+        env['eventlet.set_idle'] = self.set_idle
 
         return env
 
+    def set_idle(self):
+        if self.conn_state[2] == STATE_REQUEST:
+            self.conn_state[2] = STATE_IDLE
+
     def finish(self):
         try:
             BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
@@ -717,9 +1575,19 @@ class Server(BaseHTTPServer.HTTPServer):
                  url_length_limit=MAX_REQUEST_LINE,
                  debug=True,
                  socket_timeout=None,
-                 capitalize_response_headers=True):
+                 capitalize_response_headers=True,
+                 pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+                 keepalive_timeout=None,
+                 access_log=None,
+                 metrics=None,
+                 compression=None):
 
         self.outstanding_requests = 0
+        # smoothed delay of the event loop in seconds, measured by server()
+        # when admission control is on
+        self.queue_latency = 0.0
+        # when a connection last started waiting for its next request
+        self.last_idle = 0.0
         self.socket = socket
         self.address = address
         self.log = LoggerNull()
@@ -739,6 +1607,13 @@ class Server(BaseHTTPServer.HTTPServer):
         self.debug = debug
         self.socket_timeout = socket_timeout
         self.capitalize_response_headers = capitalize_response_headers
+        self.pipeline_depth = pipeline_depth
+        self.keepalive_timeout = keepalive_timeout
+        self.access_log = access_log if log_output else None
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.server = self
+        self.compression = _compression_options(compression)
 
         if not self.capitalize_response_headers:
             warnings.warn("""capitalize_response_headers is disabled.
@@ -777,6 +1652,8 @@ class Server(BaseHTTPServer.HTTPServer):
         except socket.timeout:
             # Expected exceptions are not exceptional
             conn_state[1].close()
+            if self.metrics is not None:
+                self.metrics.error('timeout')
             # similar to logging "accepted" in server()
             self.log.debug('({0}) timed out {1!r}'.format(self.pid, conn_state[0]))
 
@@ -820,6 +1697,75 @@ def socket_repr(sock):
     return scheme + ':' + hier_part
 
 
+def _request_pending(sock):
+    """True if the client sent data on an idle connection that was not read
+    yet, i.e. a request is on its way."""
+    if hasattr(sock, 'do_handshake'):
+        return False
+    try:
+        return bool(sock.fd.recv(1, socket.MSG_PEEK))
+    except (AttributeError, socket.error):
+        return False
+
+
+def _request_buffered(rfile, sock):
+    """True if a complete request head is already in *rfile*'s buffer.
+    Never receives."""
+    if not getattr(rfile, 'buffered', 0) or hasattr(sock, 'do_handshake'):
+        return False
+    buf = rfile.peek()
+    return b'\r\n\r\n' in buf or b'\n\n' in buf
+
+
+def _process_request_timed(serv, conn_state, accepted):
+    serv.metrics.queue_wait.record(time.time() - accepted)
+    serv.process_request(conn_state)
+
+
+def _reap_idle(connections, count):
+    """Close up to *count* keep-alive connections waiting for their next
+    request, longest idle first.  Returns the connections closed."""
+    idle = [cs for cs in six.itervalues(connections)
+            if cs[2] == STATE_IDLE and cs[3] is not None]
+    reaped = []
+    for cs in heapq.nsmallest(count, idle, key=operator.itemgetter(3)):
+        if _request_pending(cs[1]):
+            continue
+        cs[2] = STATE_CLOSE
+        greenio.shutdown_safe(cs[1])
+        reaped.append(cs)
+    return reaped
+
+
+def _measure_queue_latency(serv, interval):
+    """Sample how late the hub runs a green thread that asked to be woken
+    up after *interval*; that is how long any ready green thread, e.g. one
+    whose request just arrived, waits for its turn."""
+    clock = hubs.get_hub().clock
+    while True:
+        start = clock()
+        eventlet.sleep(interval)
+        lag = max(0.0, clock() - start - interval)
+        serv.queue_latency += (lag - serv.queue_latency) * 0.5
+
+
+def _shed(client_socket, response):
+    """Answer *client_socket* with *response* and close it without
+    handing it to a green thread.  Never blocks."""
+    fd = getattr(client_socket, 'fd', client_socket)
+    try:
+        fd.setblocking(False)
+        if response is not None:
+            fd.send(response)
+            fd.shutdown(socket.SHUT_WR)
+            # reading what the client sent so far keeps close() from
+            # resetting the connection before the response is received
+            fd.recv(65536)
+    except socket.error:
+        pass
+    client_socket.close()
+
+
 def server(sock, site,
            log=None,
            environ=None,
@@ -836,7 +1782,16 @@ def server(sock, site,
            url_length_limit=MAX_REQUEST_LINE,
            debug=True,
            socket_timeout=None,
-           capitalize_response_headers=True):
+           capitalize_response_headers=True,
+           pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+           keepalive_timeout=None,
+           idle_reserve=0,
+           max_outstanding=None,
+           max_queue_latency=None,
+           retry_after=1,
+           access_log=None,
+           metrics=None,
+           compression=None):
     """Start up a WSGI server handling requests from the supplied server
     socket.  This function loops forever.  The *sock* object will be
     closed after server exits, but the underlying file descriptor will
@@ -891,6 +1846,40 @@ def server(sock, site,
                 wait forever.
     :param capitalize_response_headers: Normalize response headers' names to Foo-Bar.
                 Default is True.
+    :param pipeline_depth: Maximum number of responses to pipelined requests sent in one
+                write.  While the next request on a connection is already received, the
+                response to the current one is held back and sent together with the
+                following ones.  Only responses of HTTP/1.1 keep-alive requests up to
+                PIPELINE_HOLD_MAX (16KB) are held, since a held response also waits
+                for the application to answer the next request.  1 sends every
+                response as soon as it is complete.  Default is 16.
+    :param keepalive_timeout: Timeout for waiting on the next request of a kept-alive
+                connection; the connection is closed when it expires.  Default None means
+                socket_timeout applies between requests too.
+    :param idle_reserve: Number of connection slots kept free for new clients.  When fewer
+                slots are free, the keep-alive connections that have been idle the longest
+                are closed to make room.  Default 0 disables this.
+    :param max_outstanding: Admission control: when this many requests are being handled,
+                new connections are answered with 503 Service Unavailable right from the
+                accept loop instead of waiting for a free green thread.
+    :param max_queue_latency: Admission control: new connections are answered with 503 while
+                the event loop runs ready green threads more than this many seconds late,
+                i.e. before requests already accepted start missing their deadlines.  With
+                either admission control parameter set, new connections are also refused
+                when the pool is full rather than left waiting.  Default None disables both.
+    :param retry_after: Seconds sent in the Retry-After header of 503 responses.  Default is 1.
+    :param access_log: An :class:`AccessLog` requests are logged to instead of *log*, in
+                batches written by a green thread rather than one line per request as it
+                completes.  *log_format* does not apply to it.
+    :param metrics: A :class:`ServerMetrics` collecting request latencies and server
+                counters.  Default None collects nothing.
+    :param compression: True to gzip or deflate responses for clients that accept it, or a
+                dict overriding some of the defaults in :data:`DEFAULT_COMPRESSION`:
+                ``min_size`` (bytes), ``level`` (zlib's, 0 to 9), ``types`` (content type
+                prefixes worth compressing) and ``tpool_size`` (bodies and streamed chunks
+                at least this large are compressed in :mod:`eventlet.tpool`).  Responses
+                streamed from an iterator are compressed as they go.  Default None compresses
+                nothing.
     """
     serv = Server(
         sock, sock.getsockname(),
@@ -907,6 +1896,11 @@ def server(sock, site,
         debug=debug,
         socket_timeout=socket_timeout,
         capitalize_response_headers=capitalize_response_headers,
+        pipeline_depth=pipeline_depth,
+        keepalive_timeout=keepalive_timeout,
+        access_log=access_log,
+        metrics=metrics,
+        compression=compression,
     )
     if server_event is not None:
         warnings.warn(
@@ -925,11 +1919,33 @@ def server(sock, site,
 eventlet.wsgi.Server pool must provide methods: `spawn`, `waitall`.
 If unsure, use eventlet.GreenPool.''')
 
-    # [addr, socket, state]
+    free = getattr(pool, 'free', None)
+    if free is None:
+        idle_reserve = 0
+    # when a look for connections to reap last found none
+    reap_scanned = None
+
+    # [addr, socket, state, idle since]
     connections = {}
+    if metrics is not None:
+        metrics.connections = connections
+    # reaped connections whose green threads have not exited yet
+    reaping = set()
+
+    admission = max_outstanding is not None or max_queue_latency is not None
+    latency_probe = None
+    if admission:
+        response_503 = None
+        if not hasattr(sock, 'do_handshake'):
+            response_503 = RESPONSE_503.format(retry_after).encode('ascii')
+        if max_queue_latency is not None:
+            latency_probe = eventlet.spawn(
+                _measure_queue_latency, serv,
+                min(QUEUE_LATENCY_INTERVAL, max_queue_latency))
 
     def _clean_connection(_, conn):
         connections.pop(conn[0], None)
+        reaping.discard(conn[0])
         conn[2] = STATE_CLOSE
         greenio.shutdown_safe(conn[1])
         conn[1].close()
@@ -939,24 +1955,59 @@ If unsure, use eventlet.GreenPool.''')
         while is_accepting:
             try:
                 client_socket, client_addr = sock.accept()
+                accepted = time.time()
                 client_socket.settimeout(serv.socket_timeout)
                 serv.log.debug('({0}) accepted {1!r}'.format(serv.pid, client_addr))
-                connections[client_addr] = connection = [client_addr, client_socket, STATE_IDLE]
-                (pool.spawn(serv.process_request, connection)
-                    .link(_clean_connection, connection))
+                if idle_reserve:
+                    short = idle_reserve - free() - len(reaping)
+                    # no use looking again before a connection goes idle
+                    if short > 0 and (reap_scanned is None or serv.last_idle >= reap_scanned):
+                        reap_scanned = time.time()
+                        reaped = _reap_idle(connections, short)
+                        if reaped:
+                            reap_scanned = None
+                        for cs in reaped:
+                            reaping.add(cs[0])
+                if admission and (
+                        (max_outstanding is not None and
+                         serv.outstanding_requests >= max_outstanding) or
+                        (max_queue_latency is not None and
+                         serv.queue_latency > max_queue_latency) or
+                        (free is not None and free() <= 0 and not reaping)):
+                    _shed(client_socket, response_503)
+                    serv.log.debug('({0}) shed {1!r}'.format(serv.pid, client_addr))
+                    if metrics is not None:
+                        metrics.error('shed')
+                    continue
+                # a fresh connection counts as busy: its first request is on
+                # its way and must not be cut off by a graceful shutdown
+                connections[client_addr] = connection = [
+                    client_addr, client_socket, STATE_REQUEST, None]
+                if metrics is None:
+                    gt = pool.spawn(serv.process_request, connection)
+                else:
+                    metrics.accepted += 1
+                    gt = pool.spawn(_process_request_timed, serv, connection, accepted)
+                gt.link(_clean_connection, connection)
             except ACCEPT_EXCEPTIONS as e:
                 if support.get_errno(e) not in ACCEPT_ERRNO:
                     raise
+                if metrics is not None:
+                    metrics.error('accept')
             except (KeyboardInterrupt, SystemExit):
                 serv.log.info('wsgi exiting')
                 break
     finally:
+        if latency_probe is not None:
+            latency_probe.kill()
         for cs in six.itervalues(connections):
             prev_state = cs[2]
             cs[2] = STATE_CLOSE
-            if prev_state == STATE_IDLE:
+            if prev_state == STATE_IDLE and not _request_pending(cs[1]):
                 greenio.shutdown_safe(cs[1])
         pool.waitall()
+        if serv.access_log is not None:
+            serv.access_log.flush()
         serv.log.info('({0}) wsgi exited, is_accepting={1}'.format(serv.pid, is_accepting))
         try:
             # NOTE: It's not clear whether we want this to leave the
@@ -968,3 +2019,242 @@ If unsure, use eventlet.GreenPool.''')
         except socket.error as e:
             if support.get_errno(e) not in BROKEN_SOCK:
                 traceback.print_exc()
+
+
+def serve_forked(site, addr=None, workers=None, sock=None, reuse_port=False,
+                 graceful_timeout=30, ready_timeout=10, worker_init=None, **kwargs):
+    """Serve *site* from *workers* forked processes, each running
+    :func:`server`, and supervise them.  This function returns in the
+    supervising process once it has been asked to stop; it never returns in
+    the workers.
+
+    The supervisor restarts workers that die.  On ``SIGHUP`` it replaces the
+    workers one by one: a new worker is started and, once it serves, an old
+    one is asked to finish its requests and exit, so there is always a full
+    set of workers accepting connections.  ``SIGTERM`` and ``SIGINT`` stop
+    all workers gracefully and make :func:`serve_forked` return.  A worker
+    that gets ``SIGTERM`` stops accepting and exits once its connections are
+    done.
+
+    Workers are forked from the supervisor, so they run the code it has
+    imported.  When *site* is an application object, ``SIGHUP`` therefore
+    only recycles the workers.  To load new application code or
+    configuration on ``SIGHUP``, pass *site* as a ``'package.module:name'``
+    string: every new worker imports it afresh, as long as the supervisor
+    itself never imports that module.
+
+    :param site: WSGI application function, or the import path of one.
+    :param addr: Address to listen on, used when *sock* is not given.
+    :param workers: Number of worker processes.  Defaults to the number of CPUs.
+    :param sock: Listening socket shared by all workers.
+    :param reuse_port: If True, *sock* is not given and the platform supports
+                SO_REUSEPORT, every worker binds its own socket to *addr* and the
+                kernel spreads connections over them.  Connections still queued on
+                a stopping worker's socket are reset when it exits, which is why
+                sharing one socket is the default.
+    :param graceful_timeout: Seconds a stopping worker gets before it is killed.
+    :param ready_timeout: Seconds a new worker gets to start serving during a
+                rolling restart before the old worker is stopped anyway.
+    :param worker_init: Called without arguments in every worker before it starts
+                serving, e.g. to reopen log files or database connections.
+
+    Other keyword arguments are passed to :func:`server`.
+    """
+    if sock is None and addr is None:
+        raise TypeError('serve_forked() needs either addr or sock')
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    per_worker = sock is None and reuse_port and hasattr(socket, 'SO_REUSEPORT')
+    own_sock = sock is None and not per_worker
+    if own_sock:
+        sock = eventlet.listen(addr)
+    try:
+        return _Supervisor(site, addr, sock, workers, graceful_timeout, ready_timeout,
+                           worker_init, kwargs).run()
+    finally:
+        if own_sock:
+            sock.close()
+
+
+def _import_app(path):
+    """Return the object named by a ``'package.module:name'`` path."""
+    modulename, _, name = path.strip().partition(':')
+    if not name:
+        raise ValueError('application path must be "package.module:name": %r' % (path, ))
+    module = __import__(modulename, globals(), locals(), [name])
+    return getattr(module, name)
+
+
+def _drain(sock):
+    while sock.recv(64):
+        pass
+
+
+class _Supervisor(object):
+    poll_interval = 0.1
+    # a worker dying sooner than this after its start is restarted with a delay
+    min_lifetime = 1.0
+
+    def __init__(self, site, addr, sock, workers, graceful_timeout, ready_timeout,
+                 worker_init, server_kwargs):
+        self.site = site
+        self.addr = addr
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.worker_init = worker_init
+        self.server_kwargs = server_kwargs
+        # pid -> start time of every worker that should be serving
+        self.children = {}
+        # pid -> kill deadline of every worker asked to stop
+        self.stopping = {}
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def run(self):
+        previous = {}
+        for signum, handler in ((signal.SIGHUP, self._on_reload),
+                                (signal.SIGTERM, self._on_stop),
+                                (signal.SIGINT, self._on_stop)):
+            previous[signum] = signal.signal(signum, handler)
+        try:
+            for _ in six.moves.range(self.workers):
+                self.spawn_worker()
+            while not self.stop_requested:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.rolling_restart()
+                self.reap()
+                for _ in six.moves.range(self.workers - len(self.children)):
+                    self.spawn_worker()
+                eventlet.sleep(self.poll_interval)
+        finally:
+            for signum, handler in six.iteritems(previous):
+                signal.signal(signum, handler)
+            for pid in list(self.children):
+                self.stop_worker(pid)
+            while self.stopping:
+                self.reap()
+                eventlet.sleep(self.poll_interval)
+
+    def _on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _on_stop(self, signum, frame):
+        self.stop_requested = True
+
+    def spawn_worker(self, wait=False):
+        """Fork a worker and return its pid.  If *wait* is True, return only
+        once it serves, died or took longer than ready_timeout to start;
+        None if it died."""
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            status = 1
+            try:
+                self._worker(wfd)
+                status = 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        os.close(wfd)
+        self.children[pid] = time.time()
+        try:
+            if wait:
+                try:
+                    hubs.trampoline(rfd, read=True, timeout=self.ready_timeout)
+                except eventlet.Timeout:
+                    pass
+                else:
+                    if not os.read(rfd, 1):
+                        return None
+        finally:
+            os.close(rfd)
+        return pid
+
+    def _worker(self, ready_fd):
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # the parent's hub and its registrations belong to the parent
+        hubs.use_hub()
+        hub = hubs.get_hub()
+        main = greenlet.getcurrent()
+
+        def stop(signum, frame):
+            hub.schedule_call_global(0, main.throw, SystemExit)
+
+        # Python retries the hub's poll after running a signal handler, so
+        # the timer scheduled by stop() needs the signal to wake the hub up
+        wakeup, wakeup_w = socket.socketpair()
+        signal.set_wakeup_fd(wakeup_w.fileno())
+        eventlet.spawn_n(_drain, wakeup)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        sock = self.sock
+        if sock is None:
+            sock = eventlet.listen(self.addr, reuse_port=True)
+        if self.worker_init is not None:
+            self.worker_init()
+        site = self.site
+        if isinstance(site, six.string_types):
+            site = _import_app(site)
+        try:
+            os.write(ready_fd, b'1')
+        except OSError:
+            # nobody is waiting for us
+            pass
+        os.close(ready_fd)
+        server(sock, site, **self.server_kwargs)
+
+    def stop_worker(self, pid):
+        self.children.pop(pid, None)
+        if pid not in self.stopping:
+            self.stopping[pid] = time.time() + self.graceful_timeout
+            self._kill(pid, signal.SIGTERM)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if support.get_errno(e) != errno.ESRCH:
+                raise
+
+    def reap(self):
+        """Collect exited workers and kill those that overstay their
+        graceful timeout."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if support.get_errno(e) == errno.ECHILD:
+                    break
+                raise
+            if not pid:
+                break
+            started = self.children.pop(pid, None)
+            self.stopping.pop(pid, None)
+            if started is not None and time.time() - started < self.min_lifetime:
+                # crashing on startup; don't fork in a tight loop
+                eventlet.sleep(self.min_lifetime)
+        now = time.time()
+        for pid, deadline in list(self.stopping.items()):
+            if now > deadline:
+                self._kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self):
+        for old in list(self.children):
+            if self.stop_requested:
+                return
+            if self.spawn_worker(wait=True) is None:
+                # e.g. new application code that fails to import: keep
+                # the workers that still run the old one
+                return
+            self.stop_worker(old)
+            self.reap()
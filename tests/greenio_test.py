@@ -469,6 +469,135 @@ class TestGreenSocket(tests.LimitedTestCase):
         for how_many in (1000, 10000, 100000, 1000000):
             test_sendall_impl(how_many)
 
+    def test_sendfile(self):
+        data = b''.join(six.b('%05d' % i) for i in range(100000))
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+
+            def check(offset, count, expected, use_send=False):
+                f.seek(0)
+                listener = eventlet.listen(('127.0.0.1', 0))
+
+                def sender():
+                    sock, addr = listener.accept()
+                    sock = bufsized(sock, size=4096)
+                    if use_send:
+                        sent = sock._sendfile_use_send(f, offset, count)
+                    else:
+                        sent = sock.sendfile(f, offset, count)
+                    sock.close()
+                    return sent
+
+                sender_thread = eventlet.spawn(sender)
+                client = eventlet.connect(listener.getsockname())
+                received = []
+                while True:
+                    chunk = client.recv(65536)
+                    if not chunk:
+                        break
+                    received.append(chunk)
+                client.close()
+                listener.close()
+                assert sender_thread.wait() == len(expected)
+                assert b''.join(received) == expected
+                assert f.tell() == offset + len(expected)
+
+            for use_send in (False, True):
+                check(0, None, data, use_send)
+                check(1000, None, data[1000:], use_send)
+                check(1000, 300000, data[1000:301000], use_send)
+
+    def test_sendall_vectored(self):
+        # more buffers than one sendmsg() takes, partial sends that end in
+        # the middle of a buffer, empty buffers
+        buffers = [six.b(str(i)) * (i % 7) for i in range(3000)]
+        buffers.append(b'z' * 200000)
+        expected = b''.join(buffers)
+
+        listener = eventlet.listen(('127.0.0.1', 0))
+
+        def sender():
+            sock, addr = listener.accept()
+            sock = bufsized(sock, size=4096)
+            sock.sendall_vectored(buffers)
+            sock.close()
+
+        sender_thread = eventlet.spawn(sender)
+        client = eventlet.connect(listener.getsockname())
+        received = []
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            received.append(data)
+        sender_thread.wait()
+        client.close()
+        listener.close()
+        assert b''.join(received) == expected
+
+    def test_socket_reader(self):
+        listener = eventlet.listen(('127.0.0.1', 0))
+        long_line = b'x' * 20000 + b'\n'
+
+        def sender():
+            sock, addr = listener.accept()
+            sock.sendall(b'first\nsecond\r\n\r\nbody')
+            eventlet.sleep(0.01)
+            sock.sendall(b'123' + long_line + b'a' * 100000 + b'tail')
+            sock.close()
+
+        sender_thread = eventlet.spawn(sender)
+        client = eventlet.connect(listener.getsockname())
+        reader = greenio.GreenSocketReader(client, bufsize=16)
+        assert reader.peek(100).startswith(b'first')
+        assert reader.readline() == b'first\n'
+        assert reader.readline(3) == b'sec'
+        assert reader.readuntil(b'\r\n\r\n') == b'ond\r\n\r\n'
+        assert reader.read1() == b'body'
+        assert reader.read_exactly(3) == b'123'
+        # longer than the buffer: it grows
+        assert reader.readline() == long_line
+        buf = bytearray(20000)
+        assert reader.readinto(buf) == 20000
+        assert buf == b'a' * 20000
+        # larger than the buffer: received without it
+        assert reader.read(80000) == b'a' * 80000
+        self.assertRaises(EOFError, reader.read_exactly, 5)
+        assert reader.read() == b''
+        assert reader.readline() == b''
+        sender_thread.wait()
+        reader.close()
+        assert reader.closed
+        self.assertRaises(ValueError, reader.read, 1)
+        client.close()
+        listener.close()
+
+    def test_socket_reader_huge_read(self):
+        # the size asked for is not set aside before the data arrives
+        class Stream(object):
+            def __init__(self, data):
+                self.data = data
+                self.offered = []
+
+            def recv(self, n):
+                self.offered.append(n)
+                chunk, self.data = self.data[:n], self.data[n:]
+                return chunk
+
+            def recv_into(self, buf):
+                self.offered.append(len(buf))
+                n = min(len(buf), len(self.data))
+                buf[:n] = self.data[:n]
+                self.data = self.data[n:]
+                return n
+
+        data = b'x' * 100000
+        stream = Stream(data)
+        reader = greenio.GreenSocketReader(stream, bufsize=16)
+        assert reader.read(1 << 40) == data
+        assert max(stream.offered) < 1 << 20, max(stream.offered)
+
     def test_wrap_socket(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -674,6 +803,66 @@ class TestGreenSocket(tests.LimitedTestCase):
         eq_(receiver.recvfrom(1024), (b'first', sender_address))
         eq_(receiver.recvfrom(1024), (b'second', sender_address))
 
+    @tests.skip_unless(lambda _f: get_hub().listener_reuse)
+    def test_repeated_waits_reuse_listener(self):
+        hub = get_hub()
+        s1, s2 = socket.socketpair()
+        # edge-triggered hubs keep the fd registered in hub.edge instead
+        edge_triggered = hasattr(hub, 'edge')
+        kept = getattr(hub, 'edge', getattr(hub, 'kept', None))
+        listeners = []
+
+        def reader():
+            for i in six.moves.range(3):
+                eq_(s1.recv(1), b'x')
+                listeners.append(hub.listeners[hub.READ].get(s1.fileno()))
+                listeners.append(s1._waiter.listeners[hub.READ])
+                if kept is not None:
+                    assert s1.fileno() in kept
+
+        gt = eventlet.spawn(reader)
+        for i in six.moves.range(3):
+            eventlet.sleep(0.01)
+            s2.sendall(b'x')
+        gt.wait()
+        assert listeners[0] is None
+        assert len(set(listeners[1::2])) == 1
+
+        # data arriving while nobody waits narrows the registration down,
+        # or is remembered by an edge-triggered hub
+        other = eventlet.spawn(s2.recv, 1)
+        s2.sendall(b'y')
+        eventlet.sleep(0.01)
+        if edge_triggered:
+            assert s1.fileno() in kept
+        elif kept is not None:
+            assert s1.fileno() not in kept
+        eq_(s1.recv(1), b'y')
+        s1.sendall(b'z')
+        eq_(other.wait(), b'z')
+
+        filenos = s1.fileno(), s2.fileno()
+        s1.close()
+        s2.close()
+        if kept is not None:
+            assert filenos[0] not in kept and filenos[1] not in kept
+
+    def test_waiter_timeout_reused(self):
+        s1, s2 = socket.socketpair()
+        s1.settimeout(0.01)
+        hub = get_hub()
+        hub.set_timer_wheel(True)
+        try:
+            for i in six.moves.range(3):
+                expect_socket_timeout(s1.recv, 1)
+            s2.sendall(b'x')
+            eq_(s1.recv(1), b'x')
+            eventlet.sleep(0.02)
+        finally:
+            hub.set_timer_wheel(False)
+        s1.close()
+        s2.close()
+
 
 def test_get_fileno_of_a_socket_works():
     class DummySocket(object):
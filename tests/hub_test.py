@@ -7,6 +7,7 @@ from tests import skip_with_pyevent, skip_if_no_itimer, skip_unless
 from tests.patcher_test import ProcessBase
 import eventlet
 from eventlet import hubs
+from eventlet.hubs import timerwheel
 from eventlet.support import greenlets, six
 
 
@@ -109,6 +110,103 @@ class TestScheduleCall(tests.LimitedTestCase):
         self.assertEqual(lst, [1, 2, 3])
 
 
+class TestTimerWheel(tests.LimitedTestCase):
+
+    def test_expire_in_order(self):
+        wheel = timerwheel.TimerWheel(100.0)
+        delays = {'a': 5.0, 'b': 0.0005, 'c': 300.0, 'd': 0.07, 'e': 0.0005, 'f': 70000.0}
+        for name in 'abcdef':
+            wheel.add(name, 100.0 + delays[name])
+        self.assertEqual(len(wheel), 6)
+        self.assertEqual(wheel.next_deadline(), 100.0005)
+        fired = wheel.expire(100.0001)
+        self.assertEqual(fired, [])
+        fired.extend(wheel.expire(100.01))
+        fired.extend(wheel.expire(110.0))
+        self.assertEqual(fired, ['b', 'e', 'd', 'a'])
+        self.assertEqual(wheel.expire(399.0), [])
+        self.assertEqual(wheel.expire(400.0), ['c'])
+        self.assertEqual(wheel.expire(100000.0), ['f'])
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(wheel.next_deadline(), None)
+
+    def test_next_deadline_is_lower_bound(self):
+        wheel = timerwheel.TimerWheel(0.0)
+        wheel.add('a', 12.3456)
+        deadline = wheel.next_deadline()
+        while deadline < 12.3456:
+            self.assertEqual(wheel.expire(deadline), [])
+            deadline = wheel.next_deadline()
+        self.assertEqual(deadline, 12.3456)
+        self.assertEqual(wheel.expire(deadline), ['a'])
+
+    def test_remove(self):
+        wheel = timerwheel.TimerWheel(0.0)
+        for i in six.moves.range(1000):
+            wheel.add(i, i * 0.5)
+        for i in six.moves.range(0, 1000, 2):
+            wheel.remove(i)
+        wheel.remove(0)
+        self.assertEqual(len(wheel), 500)
+        self.assertEqual(wheel.expire(1000.0), list(six.moves.range(1, 1000, 2)))
+
+    def test_readd_moves(self):
+        wheel = timerwheel.TimerWheel(0.0)
+        wheel.add('a', 10.0)
+        wheel.add('a', 1.0)
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.expire(1.0), ['a'])
+        self.assertEqual(wheel.expire(20.0), [])
+
+
+class TestHubTimerWheel(tests.LimitedTestCase):
+
+    def setUp(self):
+        super(TestHubTimerWheel, self).setUp()
+        hubs.get_hub().set_timer_wheel(True)
+
+    def tearDown(self):
+        hubs.get_hub().set_timer_wheel(False)
+        super(TestHubTimerWheel, self).tearDown()
+
+    @skip_with_pyevent
+    def test_cancel_removes(self):
+        hub = hubs.get_hub()
+        stimers = hub.get_timers_count()
+        for i in six.moves.range(2000):
+            t = hub.schedule_call_global(60, noop)
+            t.cancel()
+        self.assertEqual(hub.get_timers_count(), stimers)
+
+    @skip_with_pyevent
+    def test_ordering(self):
+        lst = []
+        hubs.get_hub().schedule_call_global(DELAY * 2, lst.append, 3)
+        hubs.get_hub().schedule_call_global(DELAY, lst.append, 1)
+        hubs.get_hub().schedule_call_global(DELAY, lst.append, 2)
+        while len(lst) < 3:
+            eventlet.sleep(DELAY)
+        self.assertEqual(lst, [1, 2, 3])
+
+    @skip_with_pyevent
+    def test_sleep_and_timeout(self):
+        start = time.time()
+        eventlet.sleep(0.05)
+        self.assert_less_than_equal(0.05, time.time() - start)
+        with eventlet.Timeout(0.01, False):
+            eventlet.sleep(1)
+            assert False, 'Timeout did not fire'
+
+    @skip_with_pyevent
+    def test_switch_back_to_heap(self):
+        hub = hubs.get_hub()
+        lst = []
+        hub.schedule_call_global(DELAY, lst.append, 1)
+        hub.set_timer_wheel(False)
+        eventlet.sleep(DELAY * 2)
+        self.assertEqual(lst, [1])
+
+
 class TestDebug(tests.LimitedTestCase):
 
     def test_debug_listeners(self):
@@ -215,6 +313,53 @@ class TestHubSelection(tests.LimitedTestCase):
             hubs._threadlocal.hub = oldhub
 
 
+class TestPollDispatch(tests.LimitedTestCase):
+
+    def setUp(self):
+        super(TestPollDispatch, self).setUp()
+        self.hub = hubs.get_hub()
+        self.pairs = []
+        self.listeners = []
+        self.called = []
+
+    def tearDown(self):
+        for listener in self.listeners:
+            self.hub.remove(listener)
+        for a, b in self.pairs:
+            a.close()
+            b.close()
+        self.hub.maxevents = None
+        super(TestPollDispatch, self).tearDown()
+
+    def ready_pairs(self, count, write=False):
+        from eventlet.green import socket
+        for i in six.moves.range(count):
+            a, b = socket.socketpair()
+            self.pairs.append((a, b))
+            b.send(b'x')
+            self.listeners.append(self.hub.add(
+                self.hub.READ, a.fileno(), self.called.append, noop, None))
+            if write:
+                self.listeners.append(self.hub.add(
+                    self.hub.WRITE, a.fileno(), self.called.append, noop, None))
+
+    @skip_unless(lambda _f: hasattr(hubs.get_hub(), 'maxevents'))
+    def test_each_listener_called_once(self):
+        self.ready_pairs(3, write=True)
+        self.hub.wait(0)
+        filenos = [a.fileno() for a, b in self.pairs]
+        self.assertEqual(sorted(self.called), sorted(filenos * 2))
+
+    @skip_unless(lambda _f: 'epolls' in type(hubs.get_hub()).__module__)
+    def test_maxevents(self):
+        self.ready_pairs(4)
+        self.hub.maxevents = 2
+        self.hub.wait(0)
+        self.assertEqual(len(self.called), 2)
+        self.hub.wait(0)
+        self.assertEqual(sorted(self.called), sorted(a.fileno() for a, b in self.pairs))
+
+
 class TestHubBlockingDetector(tests.LimitedTestCase):
     TEST_TIMEOUT = 10
 
@@ -304,6 +449,14 @@ def test_fork_simple():
     tests.run_isolated('hub_fork_simple.py')
 
 
+def test_epolls_et():
+    tests.run_isolated('hub_epolls_et.py')
+
+
+def test_uring():
+    tests.run_isolated('hub_uring.py')
+
+
 class TestDeadRunLoop(tests.LimitedTestCase):
     TEST_TIMEOUT = 2
 
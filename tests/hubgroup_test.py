@@ -0,0 +1,91 @@
+import eventlet
+from eventlet import hubgroup, hubs, patcher
+from eventlet.support import six
+import tests
+
+threading = patcher.original('threading')
+
+
+def current_hub():
+    return hubs.get_hub()
+
+
+class TestHubGroup(tests.LimitedTestCase):
+    TEST_TIMEOUT = 5
+
+    def setUp(self):
+        super(TestHubGroup, self).setUp()
+        self.group = hubgroup.HubGroup(2)
+        self.group.start()
+
+    def tearDown(self):
+        self.group.stop()
+        hubgroup.get_mailbox().close()
+        super(TestHubGroup, self).tearDown()
+
+    def test_spawn_round_robin(self):
+        results = [self.group.spawn(current_hub) for _ in six.moves.range(4)]
+        found = [result.wait() for result in results]
+        assert found[0] is found[2]
+        assert found[1] is found[3]
+        assert found[0] is not found[1]
+        assert hubs.get_hub() not in found
+
+    def test_spawn_exception(self):
+        def fail():
+            raise ValueError('boom')
+        result = self.group.spawn(fail)
+        self.assertRaises(ValueError, result.wait)
+        # a second wait gets the same exception
+        self.assertRaises(ValueError, result.wait)
+
+    def test_spawn_green_work(self):
+        def nap(seconds):
+            eventlet.sleep(seconds)
+            return seconds
+        results = [self.group.spawn(nap, 0.01) for _ in six.moves.range(10)]
+        self.assertEqual([r.wait() for r in results], [0.01] * 10)
+
+    def test_event_from_thread(self):
+        evt = hubgroup.Event()
+        waiter = eventlet.spawn(evt.wait)
+        eventlet.sleep(0)
+        threading.Thread(target=evt.send, args=('hi',)).start()
+        self.assertEqual(waiter.wait(), 'hi')
+        assert evt.ready()
+
+    def test_event_wait_timeout(self):
+        evt = hubgroup.Event()
+        with eventlet.Timeout(0.01, False):
+            evt.wait()
+        assert not evt._waiters
+        evt.send(1)
+        self.assertEqual(evt.wait(), 1)
+
+    def test_serve(self):
+        server = eventlet.listen(('127.0.0.1', 0))
+        served = []
+
+        def handle(sock, addr):
+            served.append(hubs.get_hub())
+            sock.sendall(b'ok')
+
+        self.group.serve(server, handle)
+        for _ in six.moves.range(4):
+            client = eventlet.connect(server.getsockname())
+            self.assertEqual(client.recv(2), b'ok')
+            client.close()
+        self.assertEqual(len(served), 4)
+        assert hubs.get_hub() not in served
+        server.close()
+
+
+def test_mailbox_call():
+    mailbox = hubgroup.get_mailbox()
+    assert hubgroup.get_mailbox() is mailbox
+    done = eventlet.Event()
+    threading.Thread(target=mailbox.call, args=(done.send, 'called')).start()
+    assert done.wait() == 'called'
+    mailbox.close()
+    assert hubgroup.get_mailbox() is not mailbox
+    hubgroup.get_mailbox().close()
@@ -0,0 +1,55 @@
+__test__ = False
+
+if __name__ == '__main__':
+    import eventlet
+    from eventlet import hubs
+    from eventlet.green import socket
+    try:
+        hubs.use_hub('epolls_et')
+    except ImportError:
+        print('skip:epoll not available')
+        raise SystemExit
+    hub = hubs.get_hub()
+    eventlet.Timeout(5)
+
+    def echo(sock):
+        while True:
+            data = sock.recv(16)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.close()
+
+    server = eventlet.listen(('127.0.0.1', 0))
+    eventlet.spawn(lambda: [eventlet.spawn(echo, server.accept()[0]) for _ in range(2)])
+
+    for _ in range(2):
+        client = eventlet.connect(server.getsockname())
+        for i in range(100):
+            data = ('x%d' % i).encode()
+            client.sendall(data)
+            assert client.recv(16) == data
+        assert client.fileno() in hub.edge
+        fileno = client.fileno()
+        # a plain trampoline on the same fd falls back to level-triggered
+        client.sendall(b'y')
+        hubs.trampoline(fileno, read=True, timeout=1)
+        assert fileno not in hub.edge
+        assert client.recv(16) == b'y'
+        client.sendall(b'z')
+        assert client.recv(16) == b'z'
+        assert fileno in hub.edge
+        # timeouts still work while the fd stays registered
+        client.settimeout(0.05)
+        try:
+            client.recv(16)
+        except socket.timeout:
+            pass
+        else:
+            assert False, 'expected a timeout'
+        client.close()
+        # the fd number is likely reused by the next connection
+        assert fileno not in hub.edge
+        assert fileno not in hub.ready
+
+    print('pass')
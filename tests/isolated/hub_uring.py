@@ -0,0 +1,52 @@
+__test__ = False
+
+if __name__ == '__main__':
+    import warnings
+    warnings.simplefilter('ignore')
+    import eventlet
+    from eventlet import hubs
+    from eventlet.green import socket
+    hubs.use_hub('uring')
+    hub = hubs.get_hub()
+    if type(hub).__module__ != 'eventlet.hubs.uring':
+        print('skip:io_uring not available')
+        raise SystemExit
+    eventlet.Timeout(5)
+
+    def echo(sock):
+        while True:
+            data = sock.recv(16)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.close()
+
+    server = eventlet.listen(('127.0.0.1', 0))
+    eventlet.spawn(lambda: echo(server.accept()[0]))
+    client = eventlet.connect(server.getsockname())
+    for i in range(100):
+        data = ('x%d' % i).encode()
+        client.sendall(data)
+        assert client.recv(16) == data
+
+    # a timed out wait leaves no poll request holding the socket open
+    client.settimeout(0.05)
+    try:
+        client.recv(16)
+    except socket.timeout:
+        pass
+    else:
+        assert False, 'expected a timeout'
+    a, b = socket.socketpair()
+    try:
+        hubs.trampoline(a.fileno(), read=True, timeout=0.05)
+    except eventlet.Timeout:
+        pass
+    a.close()
+    b.settimeout(1)
+    assert b.recv(1) == b''
+
+    fileno = client.fileno()
+    client.close()
+    assert fileno not in hub.armed, hub.armed
+    print('pass')
@@ -21,6 +21,7 @@ server / client accept() conn - ExplodingConnectionWrap
     |  |  |   (1 - many)
     V  V  V
 connection makefile() file objects - ExplodingSocketFile <-- these raise
+and connection recv_into(), which the request reader uses <-- this raises
 """
 import socket
 
@@ -82,18 +83,31 @@ class ExplodingConnectionWrap(object):
         self.conn = conn
         self.conn._really_makefile = self.conn.makefile
         self.conn.makefile = self
+        self.conn._really_recv_into = self.conn.recv_into
+        self.conn.recv_into = self.recv_into
         self.armed = False
         self.file_reg = []
 
     def unwrap(self):
         self.conn.makefile = self.conn._really_makefile
         del self.conn._really_makefile
+        self.conn.recv_into = self.conn._really_recv_into
+        del self.conn._really_recv_into
 
     def arm(self):
         output_buffer.append("tick")
+        self.armed = True
         for i in self.file_reg:
             i.arm()
 
+    def recv_into(self, *args, **kwargs):
+        # the server is usually waiting in here already when armed
+        result = self.conn._really_recv_into(*args, **kwargs)
+        if self.armed:
+            output_buffer.append(TAG_BOOM)
+            raise socket.timeout("timed out")
+        return result
+
     def __call__(self, mode='r', bufsize=-1):
         output_buffer.append(self.__class__.__name__ + ".__call__")
         # file_obj = self.conn._really_makefile(*args, **kwargs)
@@ -180,8 +194,8 @@ def main():
 
     assert "timed out" in output_debug[-1], repr(output_debug)
     # if the BOOM check fails, it's because our timeout didn't happen
-    # (if eventlet stops using file.readline() to read HTTP headers,
-    # for instance)
+    # (if eventlet stops using file.readline() or socket.recv_into() to
+    # read HTTP headers, for instance)
     assert TAG_BOOM == output_debug[-2], repr(output_debug)
     assert TAG_BOOM == output_normal[-1], repr(output_normal)
     assert "Traceback" not in output_debug, repr(output_debug)
@@ -0,0 +1,130 @@
+__test__ = False
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+def get(addr):
+    sock = eventlet.connect(addr)
+    sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+    data = b''
+    while True:
+        chunk = sock.recv(1024)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    assert data.startswith(b'HTTP/1.1 200'), data
+    return data.split(b'\r\n\r\n', 1)[1]
+
+
+def get_pid(addr):
+    return int(get(addr))
+
+
+def wait_for(predicate):
+    with eventlet.Timeout(10):
+        while not predicate():
+            eventlet.sleep(0.05)
+
+
+def check(supervisor, addr):
+    seen = set()
+    wait_for(lambda: seen.add(get_pid(addr)) or len(seen) == 2)
+    assert supervisor not in seen
+
+    # a dead worker is replaced
+    victim = seen.pop()
+    os.kill(victim, signal.SIGKILL)
+    seen = set()
+    wait_for(lambda: seen.add(get_pid(addr)) or (len(seen) == 2 and victim not in seen))
+
+    # rolling restart: requests keep succeeding while workers are replaced
+    before = set(seen)
+    os.kill(supervisor, signal.SIGHUP)
+    seen = set()
+    wait_for(lambda: seen.add(get_pid(addr)) or len(seen - before) == 2)
+
+    os.kill(supervisor, signal.SIGTERM)
+    pid, status = os.waitpid(supervisor, 0)
+    assert status == 0, status
+
+
+APP = '''
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [%r]
+'''
+
+
+def check_reload(supervisor, addr, path):
+    wait_for(lambda: get(addr) == b'v1')
+    # new code is loaded by the workers started on SIGHUP
+    with open(path, 'w') as f:
+        f.write(APP % b'version 2')
+    os.kill(supervisor, signal.SIGHUP)
+    wait_for(lambda: get(addr) == b'version 2')
+    # code that does not import leaves the running workers alone
+    with open(path, 'w') as f:
+        f.write('raise ImportError')
+    os.kill(supervisor, signal.SIGHUP)
+    eventlet.sleep(1)
+    for _ in range(10):
+        assert get(addr) == b'version 2'
+
+    os.kill(supervisor, signal.SIGTERM)
+    pid, status = os.waitpid(supervisor, 0)
+    assert status == 0, status
+
+
+def serve(site, sock, quiet=False):
+    supervisor = os.fork()
+    if supervisor == 0:
+        if quiet:
+            # workers print why they failed to start
+            os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+        try:
+            wsgi.serve_forked(site, workers=2, sock=sock, log_output=False)
+        finally:
+            os._exit(0)
+    return supervisor
+
+
+if __name__ == '__main__':
+    import os
+    import signal
+    import eventlet
+    from eventlet import wsgi
+
+    import shutil
+    import sys
+    import tempfile
+
+    sock = eventlet.listen(('127.0.0.1', 0))
+    addr = sock.getsockname()
+    supervisor = serve(app, sock)
+    try:
+        check(supervisor, addr)
+    except BaseException:
+        os.kill(supervisor, signal.SIGKILL)
+        raise
+
+    # the workers import the application; the supervisor never does
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'forked_app.py')
+        with open(path, 'w') as f:
+            f.write(APP % b'v1')
+        sys.path.insert(0, tmp)
+        sys.dont_write_bytecode = True
+        supervisor = serve('forked_app:app', sock, quiet=True)
+        try:
+            check_reload(supervisor, addr, path)
+        except BaseException:
+            os.kill(supervisor, signal.SIGKILL)
+            raise
+    finally:
+        shutil.rmtree(tmp)
+    print('pass')
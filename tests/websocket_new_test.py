@@ -1,13 +1,15 @@
 import errno
+import os
 import struct
 import re
+import time
 
 import eventlet
 from eventlet import event
 from eventlet import websocket
 from eventlet.green import httplib
 from eventlet.green import socket
-from eventlet.support import six
+from eventlet.support import get_errno, six
 
 import tests.wsgi_test
 
@@ -133,6 +135,78 @@ class TestWebSocket(tests.wsgi_test._TestBase):
         ws.close()
         eventlet.sleep(0.01)
 
+    def test_send_recv_large_13(self):
+        connect = [
+            "GET /echo HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Origin: http://%s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+        ]
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(six.b('\r\n'.join(connect) + '\r\n\r\n'))
+        sock.recv(1024)
+        ws = websocket.RFC6455WebSocket(sock, {}, client=True)
+        binary = bytes(bytearray(range(256))) * 400 + b'xyz'
+        text = u'\u0444\u044b\u0432' * 1000
+        ws.send(binary)
+        ws.send(text)
+        assert ws.wait() == binary
+        assert ws.wait() == text
+        ws.close()
+        eventlet.sleep(0.01)
+
+    def test_frame_sent_with_handshake_13(self):
+        # the frame is read along with the request by the server's reader
+        connect = [
+            "GET /echo HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Origin: http://%s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+        ]
+        sock = eventlet.connect(self.server_addr)
+        client = websocket.RFC6455WebSocket(sock, {}, client=True)
+        sock.sendall(six.b('\r\n'.join(connect) + '\r\n\r\n') +
+                     client._pack_message(b'hello', masked=True))
+        assert client.reader.readuntil(b'\r\n\r\n').startswith(b'HTTP/1.1 101')
+        assert client.wait() == b'hello'
+        client.close()
+        eventlet.sleep(0.01)
+
+    def test_upgrade_pipelined_after_request_13(self):
+        # the response held back for pipelining goes out before the
+        # handshake, which is written to the socket directly
+        def site(env, start_response):
+            if env['PATH_INFO'] == '/plain':
+                return tests.wsgi_test.hello_world(env, start_response)
+            return wsapp(env, start_response)
+
+        self.spawn_server(site=site)
+        connect = [
+            "GET /echo HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+        ]
+        sock = eventlet.connect(self.server_addr)
+        client = websocket.RFC6455WebSocket(sock, {}, client=True)
+        sock.sendall(b'GET /plain HTTP/1.1\r\nHost: localhost\r\n\r\n' +
+                     six.b('\r\n'.join(connect) + '\r\n\r\n'))
+        response = client.reader.readuntil(b'hello world')
+        assert response.startswith(b'HTTP/1.1 200 OK'), response
+        assert client.reader.readuntil(b'\r\n\r\n').startswith(b'HTTP/1.1 101')
+        client.send(b'hello')
+        assert client.wait() == b'hello'
+        client.close()
+        eventlet.sleep(0.01)
+
     def test_breaking_the_connection_13(self):
         error_detected = [False]
         done_with_request = event.Event()
@@ -534,3 +608,606 @@ class TestWebSocketWithCompression(tests.wsgi_test._TestBase):
 
         ws.close()
         eventlet.sleep(0.01)
+
+
+def test_apply_mask():
+    data = bytes(bytearray(range(256))) * 20
+    mask = [0x12, 0x34, 0x56, 0x78]
+    for size in (0, 1, 5, 100, len(data)):
+        for offset in range(4):
+            expected = bytes(bytearray(
+                b ^ mask[(offset + i) % 4] for i, b in enumerate(bytearray(data[:size]))))
+            masked = websocket.RFC6455WebSocket._apply_mask(data[:size], mask, offset=offset)
+            assert masked == expected
+
+
+class TestBroadcast(tests.wsgi_test._TestBase):
+    TEST_TIMEOUT = 10
+
+    def set_site(self):
+        self.subscribers = []
+
+        def subscribe(ws):
+            self.subscribers.append(ws)
+            while ws.wait() is not None:
+                pass
+
+        self.site = websocket.WebSocketWSGI(subscribe)
+
+    def connect(self, extensions=None):
+        headers = [
+            "GET / HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+        ]
+        if extensions:
+            headers.append("Sec-WebSocket-Extensions: " + extensions)
+        count = len(self.subscribers)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(six.b('\r\n'.join(headers) + '\r\n\r\n'))
+        ws = websocket.RFC6455WebSocket(sock, {}, client=True, extensions={
+            'permessage-deflate': {'server_no_context_takeover': 'server_no' in extensions}
+        } if extensions else None)
+        assert ws.reader.readuntil(b'\r\n\r\n').startswith(b'HTTP/1.1 101')
+        while len(self.subscribers) == count:
+            eventlet.sleep(0.01)
+        return ws
+
+    def test_broadcast(self):
+        clients = [
+            self.connect(),
+            self.connect(),
+            self.connect('permessage-deflate; server_no_context_takeover'),
+            self.connect('permessage-deflate; server_no_context_takeover'),
+            self.connect('permessage-deflate'),
+        ]
+        packed = []
+        pack_message = websocket.RFC6455WebSocket._pack_message
+
+        def counting_pack_message(ws, *args, **kwargs):
+            packed.append(ws)
+            return pack_message(ws, *args, **kwargs)
+
+        websocket.RFC6455WebSocket._pack_message = counting_pack_message
+        try:
+            for message in (u'price 1', b'x' * 1000, u'price 2'):
+                assert websocket.broadcast(self.subscribers, message) == []
+                for client in clients:
+                    assert client.wait() == message
+        finally:
+            websocket.RFC6455WebSocket._pack_message = pack_message
+        # uncompressed, compressed without context and one for the
+        # connection that compresses with context takeover
+        self.assertEqual(len(packed), 3 * 3)
+        for client in clients:
+            client.close()
+
+    def test_broadcast_disconnects_slow_consumer(self):
+        slow = self.connect()
+        fast = self.connect()
+        message = b'x' * 65536
+        for i in range(1000):
+            dropped = websocket.broadcast(self.subscribers, message, backlog=4)
+            assert fast.wait() == message
+            if dropped:
+                break
+        self.assertEqual(dropped, [self.subscribers[0]])
+        # nothing is sent to it any more
+        assert websocket.broadcast(self.subscribers, message, backlog=4) == []
+        assert fast.wait() == message
+        slow.socket.close()
+        fast.close()
+
+    def test_broadcast_coalesces(self):
+        slow = self.connect()
+        for i in range(200):
+            assert websocket.broadcast(self.subscribers, b'x' * 65536, backlog=4,
+                                       overflow='coalesce') == []
+            eventlet.sleep(0)
+        websocket.broadcast(self.subscribers, b'last', overflow='coalesce')
+        received = 0
+        while slow.wait() != b'last':
+            received += 1
+        assert received < 200
+        slow.close()
+
+    def fill_send_queue(self, ws, count):
+        high_water = ws._send_queue[0]
+        for i in range(count):
+            # never waits for the client, which reads nothing meanwhile
+            with eventlet.Timeout(1):
+                ws.send(six.b('%d ' % i) + b'x' * 65536)
+            assert ws.buffered_amount <= high_water
+            eventlet.sleep(0)
+
+    def received(self, client, ws):
+        reader = eventlet.spawn(self._received, client)
+        while ws.buffered_amount:
+            eventlet.sleep(0.01)
+        ws.send(b'last')
+        return reader.wait()
+
+    def _received(self, client):
+        numbers = []
+        while True:
+            message = client.wait()
+            if message == b'last':
+                return numbers
+            numbers.append(int(message.split()[0]))
+
+    def test_send_queue_drop_oldest(self):
+        client = self.connect()
+        ws = self.subscribers[0]
+        ws.set_send_queue(high_water=256 * 1024, overflow='drop_oldest')
+        self.fill_send_queue(ws, 400)
+        numbers = self.received(client, ws)
+        assert numbers == sorted(numbers)
+        assert 399 in numbers
+        assert len(numbers) < 400
+        self.assertEqual(ws.buffered_amount, 0)
+        client.close()
+
+    def test_send_queue_drop_newest(self):
+        client = self.connect()
+        ws = self.subscribers[0]
+        ws.set_send_queue(high_water=256 * 1024, overflow='drop_newest')
+        self.fill_send_queue(ws, 400)
+        numbers = self.received(client, ws)
+        assert numbers == sorted(numbers)
+        assert numbers[:10] == list(range(10))
+        assert len(numbers) < 400
+        client.close()
+
+    def test_send_queue_disconnects(self):
+        client = self.connect()
+        ws = self.subscribers[0]
+        ws.set_send_queue(high_water=256 * 1024)
+        with eventlet.Timeout(1):
+            try:
+                for i in range(400):
+                    ws.send(b'x' * 65536)
+                    eventlet.sleep(0)
+            except socket.error as e:
+                self.assertEqual(get_errno(e), errno.EPIPE)
+            else:
+                assert False, 'the slow client was not disconnected'
+        assert ws.websocket_closed
+        self.assertEqual(ws.buffered_amount, 0)
+        client.socket.close()
+
+    def test_send_queue_flushed_on_close(self):
+        def produce(ws):
+            self.subscribers.append(ws)
+            for i in range(100):
+                ws.send(b'x' * 65536)
+
+        self.spawn_server(site=websocket.WebSocketWSGI.configured(
+            produce, send_queue={'high_water': 16 << 20}))
+        client = self.connect()
+        for i in range(100):
+            assert client.wait() == b'x' * 65536
+        assert client.wait() is None
+        self.assertEqual(self.subscribers[0].buffered_amount, 0)
+        client.socket.close()
+
+    def test_send_queue_fragments_after_queued_deflate(self):
+        client = self.connect('permessage-deflate')
+        ws = self.subscribers[0]
+        ws.set_send_queue(high_water=16 << 20)
+        messages = []
+        # incompressible, until the socket is full and the writer runs
+        while not ws.buffered_amount:
+            messages.append(os.urandom(65536))
+            ws.send(messages[-1])
+        # left to the writer to compress, ahead of the fragments
+        messages.append(b'queued ' * 100)
+        ws.send(messages[-1])
+        ws.send(b'queued fragment, ', final=False)
+        ws.send(b'queued continuation', continuation=True)
+        messages.append(b'queued fragment, queued continuation')
+        for message in messages:
+            assert client.wait() == message
+        client.close()
+
+    def test_send_queue_options(self):
+        ws = websocket.WebSocket(None, {})
+        self.assertRaises(ValueError, ws.set_send_queue, overflow='coalesce')
+        self.assertRaises(ValueError, ws.set_send_queue, high_water=10, low_water=20)
+
+
+class TestStreamingReceive(tests.wsgi_test._TestBase):
+    TEST_TIMEOUT = 10
+
+    def set_site(self):
+        self.received = []
+        self.closed = []
+
+        def echo(ws):
+            try:
+                while True:
+                    if ws.path == '/wait':
+                        message = ws.wait()
+                        if message is None:
+                            break
+                    else:
+                        stream = ws.wait_stream(chunk_size=1000)
+                        if stream is None:
+                            break
+                        chunks = list(stream)
+                        self.received.append(chunks)
+                        message = b''.join(chunks) if not chunks or isinstance(
+                            chunks[0], bytes) else u''.join(chunks)
+                    ws.send(message)
+            except websocket.ConnectionClosedError:
+                pass
+            self.closed.append(ws)
+
+        self.site = websocket.WebSocketWSGI.configured(echo, max_message_size=100000)
+
+    def connect(self, path='/', extensions=None):
+        headers = [
+            "GET %s HTTP/1.1" % path,
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+        ]
+        if extensions:
+            headers.append("Sec-WebSocket-Extensions: " + extensions)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(six.b('\r\n'.join(headers) + '\r\n\r\n'))
+        ws = websocket.RFC6455WebSocket(sock, {}, client=True, extensions={
+            'permessage-deflate': {}} if extensions else None)
+        assert ws.reader.readuntil(b'\r\n\r\n').startswith(b'HTTP/1.1 101')
+        return ws
+
+    def test_stream(self):
+        ws = self.connect()
+        binary = bytes(bytearray(range(256))) * 200
+        text = u'\u0444\u044b\u0432' * 1000
+        ws.send(binary)
+        assert ws.wait() == binary
+        ws.send(text)
+        assert ws.wait() == text
+        # fragments, with a ping in between
+        ws.send(binary[:3000], final=False)
+        ws.send(b'ping', control_code=9)
+        ws.send(binary[3000:], continuation=True)
+        assert ws.wait() == binary
+        ws.close()
+        binary_chunks, text_chunks, fragmented = self.received
+        self.assertEqual([len(c) for c in binary_chunks], [1000] * 51 + [200])
+        assert max(len(c.encode('utf-8')) for c in text_chunks) <= 1000
+        self.assertEqual(len(fragmented), 52)
+
+    def test_stream_compressed(self):
+        ws = self.connect(extensions='permessage-deflate')
+        message = b'x' * 50000
+        ws.send(message)
+        assert ws.wait() == message
+        ws.close()
+        chunks = self.received[0]
+        assert len(chunks) == 50
+        assert max(len(c) for c in chunks) == 1000
+
+    def test_stream_abandoned(self):
+        def first_chunk_only(ws):
+            while True:
+                stream = ws.wait_stream(chunk_size=1000)
+                if stream is None:
+                    break
+                ws.send(next(stream))
+
+        self.spawn_server(site=websocket.WebSocketWSGI(first_chunk_only))
+        ws = self.connect()
+        ws.send(b'a' * 5000)
+        ws.send(b'b' * 5000)
+        assert ws.wait() == b'a' * 1000
+        assert ws.wait() == b'b' * 1000
+        ws.close()
+
+    def check_too_big(self, ws, message=None):
+        if message is not None:
+            ws.send(message)
+        frame = ws._recv_frame()
+        self.assertEqual(frame.opcode, 8)
+        self.assertEqual(struct.unpack('!H', frame.getvalue()[:2])[0], 1009)
+        while not self.closed:
+            eventlet.sleep(0.01)
+        assert self.closed[0].websocket_closed
+        ws.socket.close()
+
+    def test_max_message_size_stream(self):
+        ws = self.connect()
+        ws.send(b'x' * 100000)
+        assert ws.wait() == b'x' * 100000
+        self.check_too_big(ws, b'x' * 100001)
+
+    def test_max_message_size_fragments(self):
+        ws = self.connect('/wait')
+        ws.send(b'x' * 60000, final=False)
+        ws.send(b'x' * 60000, continuation=True)
+        self.check_too_big(ws)
+
+    def test_max_message_size_decompressed(self):
+        for path in ('/', '/wait'):
+            del self.closed[:]
+            # compresses to a few hundred bytes
+            self.check_too_big(self.connect(path, 'permessage-deflate'), b'x' * 200000)
+
+    def test_max_message_size_declared(self):
+        ws = self.connect('/wait')
+        # only the header of a 2 GiB frame
+        ws.socket.sendall(struct.pack('!BBQ', 0x82, 0xff, 1 << 31) + b'\0\0\0\0')
+        self.check_too_big(ws)
+
+    def test_declared_length_unlimited(self):
+        a, b = socket.socketpair()
+        ws = websocket.RFC6455WebSocket(b, {}, client=True, max_message_size=None)
+        # the claimed length is not allocated before the payload arrives
+        a.sendall(struct.pack('!BBQ', 0x82, 127, 1 << 40) + b'x' * 100000)
+        a.close()
+        assert ws.wait() is None
+        b.close()
+
+
+class TestDeflateSettings(tests.wsgi_test._TestBase):
+    TEST_TIMEOUT = 5
+
+    def set_site(self):
+        self.serve()
+
+    def serve(self, **options):
+        self.sockets = []
+
+        def echo(ws):
+            self.sockets.append(ws)
+            while True:
+                m = ws.wait()
+                if m is None:
+                    break
+                ws.send(m)
+
+        self.site = websocket.WebSocketWSGI.configured(echo, permessage_deflate=options)
+        if self.killer is not None:
+            self.spawn_server()
+
+    def handshake(self, offer):
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(six.b('\r\n'.join([
+            "GET / HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Host: %s:%s" % self.server_addr,
+            "Sec-WebSocket-Version: 13",
+            "Sec-WebSocket-Key: d9MXuOzlVQ0h+qRllvSCIg==",
+            "Sec-WebSocket-Extensions: " + offer,
+        ]) + '\r\n\r\n'))
+        reader = eventlet.greenio.GreenSocketReader(sock)
+        headers = reader.readuntil(b'\r\n\r\n')
+        match = re.search(b'Sec-WebSocket-Extensions: (.+)\r\n', headers)
+        return sock, match and match.group(1).decode()
+
+    def connect(self, deflate_options=None):
+        sock, accepted = self.handshake('permessage-deflate')
+        assert accepted == 'permessage-deflate'
+        return websocket.RFC6455WebSocket(sock, {}, client=True, deflate_options=deflate_options,
+                                          extensions={'permessage-deflate': {}})
+
+    def test_negotiation(self):
+        self.serve(max_window_bits=10, client_max_window_bits=11,
+                   context_takeover=False, client_context_takeover=False)
+        sock, accepted = self.handshake('permessage-deflate; client_max_window_bits')
+        self.assertEqual(sorted(accepted.split('; ')), [
+            'client_max_window_bits=11', 'client_no_context_takeover', 'permessage-deflate',
+            'server_max_window_bits=10', 'server_no_context_takeover'])
+        sock.close()
+        # the client's window is left alone unless it offers to limit it
+        sock, accepted = self.handshake('permessage-deflate; server_max_window_bits=12')
+        assert 'client_max_window_bits' not in accepted
+        assert 'server_max_window_bits=10' in accepted
+        sock.close()
+
+    def test_refused(self):
+        self.site = websocket.WebSocketWSGI.configured(lambda ws: None, permessage_deflate=False)
+        self.spawn_server()
+        sock, accepted = self.handshake('permessage-deflate')
+        assert accepted is None
+        sock.close()
+
+    def test_bad_options(self):
+        for options in ({'max_window_bits': 8}, {'mem_level': 10}, {'level': 9}):
+            self.assertRaises(ValueError, websocket.WebSocketWSGI.configured,
+                              lambda ws: None, permessage_deflate=options)
+
+    def test_mem_level(self):
+        self.serve(mem_level=1)
+        ws = self.connect()
+        message = b'abc' * 10000
+        ws.send(message)
+        assert ws.wait() == message
+        ws.close()
+
+    @tests.skip_unless(websocket._zdict)
+    def test_idle_release(self):
+        self.serve(idle_timeout=0.05)
+        ws = self.connect()
+        sent = b''
+        for i in range(5):
+            message = six.b('message %d ' % i) * 1000
+            sent += message
+            ws.send(message)
+            assert ws.wait() == message
+            server = self.sockets[0]
+            assert server._deflate_enc._obj is not None
+            assert server._deflate_dec._obj is not None
+            eventlet.sleep(0.15)
+            # the client, whose state is still there, keeps understanding
+            # the server after it has rebuilt its compressor and vice versa
+            assert server._deflate_enc._obj is None
+            assert server._deflate_dec._obj is None
+            assert server._deflate_enc.window == sent[-32768:]
+        ws.close()
+
+    @tests.skip_unless(websocket._zdict)
+    def test_dictionary(self):
+        dictionary = b'{"type": "quote", "symbol": "", "bid": , "ask": }'
+        self.serve(dictionary=dictionary)
+        ws = self.connect({'dictionary': dictionary})
+        message = b'{"type": "quote", "symbol": "ABC", "bid": 1, "ask": 2}'
+        ws.send(message)
+        frame = ws._recv_frame()
+        # little more than the values themselves
+        assert len(frame.data[0]) < 25
+        self.assertEqual(frame.getvalue(), message)
+        ws.close()
+
+
+class TestClient(tests.wsgi_test._TestBase):
+    TEST_TIMEOUT = 5
+
+    def set_site(self):
+        self.connections = []
+
+        def handler(ws):
+            self.connections.append(ws)
+            if ws.path == '/silent':
+                eventlet.sleep(10)
+            elif ws.path == '/once':
+                ws.send(u'hello %d' % len(self.connections))
+                return
+            while True:
+                m = ws.wait()
+                if m is None:
+                    break
+                ws.send(m)
+
+        app = websocket.WebSocketWSGI.configured(handler, supported_protocols=['chat'])
+
+        def site(environ, start_response):
+            if environ['PATH_INFO'] == '/missing':
+                start_response('404 Not Found', [('Content-Length', '0')])
+                return []
+            return app(environ, start_response)
+
+        self.site = site
+
+    def url(self, path='/'):
+        return 'ws://%s:%s%s' % (self.server_addr[0], self.server_addr[1], path)
+
+    def test_connect(self):
+        ws = websocket.connect(self.url('/echo?x=1'), protocols=['other', 'chat'],
+                               origin='http://example.com')
+        self.assertEqual(ws.protocol, 'chat')
+        assert ws.client
+        server = self.connections[0]
+        self.assertEqual(server.path, '/echo')
+        self.assertEqual(server.environ['QUERY_STRING'], 'x=1')
+        self.assertEqual(server.origin, 'http://example.com')
+        for message in (u'text', b'binary', b'', b'x' * 100000):
+            ws.send(message)
+            assert ws.wait() == message
+        ws.close()
+
+    def test_connect_deflate(self):
+        ws = websocket.connect(self.url(), permessage_deflate={'max_window_bits': 10})
+        self.assertEqual(ws.extensions, {'permessage-deflate': {'client_max_window_bits': 10}})
+        assert 'permessage-deflate' in self.connections[0].extensions
+        message = b'abc' * 10000
+        ws.send(message)
+        assert ws.wait() == message
+        ws.close()
+
+        ws = websocket.connect(self.url(), permessage_deflate=False)
+        self.assertEqual(ws.extensions, {})
+        ws.close()
+
+    def test_connect_refused(self):
+        try:
+            websocket.connect(self.url('/missing'))
+        except websocket.HandshakeError as e:
+            self.assertEqual(e.status, 404)
+        else:
+            assert False, 'no HandshakeError'
+        self.assertRaises(ValueError, websocket.connect, 'http://localhost/')
+
+    def test_check_handshake(self):
+        key = b'dGhlIHNhbXBsZSBub25jZQ=='
+        response = [
+            b'HTTP/1.1 101 Switching Protocols',
+            b'Upgrade: websocket',
+            b'Connection: Upgrade',
+            b'Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=',
+        ]
+
+        def check(*extra):
+            return websocket._check_handshake(b'\r\n'.join(response + list(extra)) + b'\r\n\r\n',
+                                              key, ['chat'], {})
+
+        self.assertEqual(check(), (None, {}))
+        self.assertEqual(check(b'Sec-WebSocket-Protocol: chat')[0], 'chat')
+        self.assertEqual(
+            check(b'Sec-WebSocket-Extensions: permessage-deflate; server_max_window_bits=9')[1],
+            {'permessage-deflate': {'server_max_window_bits': 9}})
+        for bad in (b'Sec-WebSocket-Protocol: other',
+                    b'Sec-WebSocket-Extensions: x-webkit-deflate-frame',
+                    b'Sec-WebSocket-Extensions: permessage-deflate; server_max_window_bits=20',
+                    b'Sec-WebSocket-Extensions: permessage-deflate; unknown'):
+            self.assertRaises(websocket.HandshakeError, check, bad)
+        response[3] = b'Sec-WebSocket-Accept: d3Jvbmc='
+        self.assertRaises(websocket.HandshakeError, check)
+
+    def test_keepalive(self):
+        ws = websocket.connect(self.url(), ping_interval=0.02)
+        reader = eventlet.spawn(ws.wait)
+        eventlet.sleep(0.2)
+        assert ws._pongs >= 2
+        assert not ws.websocket_closed
+        reader.kill()
+        ws.close()
+
+    def test_keepalive_timeout(self):
+        ws = websocket.connect(self.url('/silent'), ping_interval=0.02, ping_timeout=0.05)
+        with eventlet.Timeout(1):
+            assert ws.wait() is None
+        assert ws.websocket_closed
+
+    def test_reconnecting(self):
+        messages = []
+        for ws in websocket.reconnecting(self.url('/once'), min_delay=0.01):
+            messages.append(ws.wait())
+            assert ws.wait() is None
+            if len(messages) == 3:
+                break
+        self.assertEqual(messages, [u'hello 1', u'hello 2', u'hello 3'])
+
+    def test_reconnecting_backoff(self):
+        sock = eventlet.listen(('localhost', 0))
+        addr = sock.getsockname()
+        sock.close()
+        attempts = []
+        connect = websocket.connect
+
+        def counting_connect(*args, **kwargs):
+            attempts.append(time.time())
+            return connect(*args, **kwargs)
+
+        def serve_later():
+            eventlet.sleep(0.3)
+            self.spawn_server(sock=eventlet.listen(addr))
+
+        eventlet.spawn(serve_later)
+        websocket.connect = counting_connect
+        try:
+            url = 'ws://%s:%s/once' % addr
+            ws = next(websocket.reconnecting(url, min_delay=0.02, max_delay=0.1))
+        finally:
+            websocket.connect = connect
+        assert ws.wait().startswith(u'hello')
+        # 0.01-0.02, 0.02-0.04, 0.04-0.08, then at most 0.1 apart
+        assert 4 <= len(attempts) <= 12, attempts
+        assert ws.wait() is None
@@ -1,13 +1,16 @@
 import cgi
 import collections
 import errno
+import json
 import os
 import shutil
 import signal
 import socket
 import sys
 import tempfile
+import time
 import traceback
+import zlib
 
 import eventlet
 from eventlet import debug
@@ -603,6 +606,128 @@ class TestHttpd(_TestBase):
         self.assertEqual('keep-alive', result2.headers_lower['connection'])
         sock.close()
 
+    def _pipelined_flushes(self, requests, **kwargs):
+        flushes = []
+
+        class CountingFile(object):
+            def __init__(self, f):
+                self.f = f
+
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+            def flush(self):
+                flushes.append(1)
+                self.f.flush()
+
+        class Protocol(wsgi.HttpProtocol):
+            def setup(self):
+                wsgi.HttpProtocol.setup(self)
+                self.wfile = CountingFile(self.wfile)
+
+            def finish(self):
+                # only count the flushes of responses
+                self.wfile = self.wfile.f
+                wsgi.HttpProtocol.finish(self)
+
+        self.spawn_server(protocol=Protocol, **kwargs)
+        sock = eventlet.connect(self.server_addr)
+        # the last request closes the connection
+        sock.sendall(b''.join(requests))
+        result = recvall(sock)
+        sock.close()
+        responses = result.split(b'HTTP/1.1 ')[1:]
+        assert len(responses) == len(requests), result
+        return responses, len(flushes)
+
+    def test_018b_pipelining(self):
+        request = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        last = b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+        responses, flushes = self._pipelined_flushes([request] * 2 + [last])
+        assert all(r.endswith(b'\r\n\r\nhello world') for r in responses), responses
+        # one write for all three responses
+        self.assertEqual(flushes, 1)
+
+        responses, flushes = self._pipelined_flushes([request] * 4 + [last], pipeline_depth=2)
+        assert all(r.endswith(b'\r\n\r\nhello world') for r in responses), responses
+        # the last response has nothing buffered to go out with and is
+        # sent straight to the socket
+        self.assertEqual(flushes, 2)
+
+    def test_018b_pipelining_not_held(self):
+        request = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        last = b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+
+        # large responses go out at once
+        def large(env, start_response):
+            start_response('200 OK', [])
+            return [b'x' * (wsgi.PIPELINE_HOLD_MAX + 1)]
+
+        self.site.application = large
+        responses, flushes = self._pipelined_flushes([request] * 2 + [last])
+        self.assertEqual(flushes, 0)
+        # and so do responses to HTTP/1.0 requests
+        self.site.application = hello_world
+        request = b'GET / HTTP/1.0\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n'
+        responses, flushes = self._pipelined_flushes([request] * 2 + [last])
+        self.assertEqual(flushes, 0)
+
+        # with nothing buffered the socket is left alone
+        class Reader(object):
+            buffered = 0
+
+        class Sock(object):
+            def __getattr__(self, name):
+                raise AssertionError(name)
+
+        assert not wsgi._request_buffered(Reader(), Sock())
+
+    def test_018c_pipelining_with_body(self):
+        self.site.application = chunked_post
+        requests = [
+            b'POST /a HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nhello',
+            b'POST /a HTTP/1.1\r\nHost: localhost\r\nContent-Length: 3\r\n\r\nfoo',
+            b'GET /a HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n',
+        ]
+        responses, flushes = self._pipelined_flushes(requests)
+        assert responses[0].endswith(b'\r\n\r\nhello'), responses
+        assert responses[1].endswith(b'\r\n\r\nfoo'), responses
+        self.assertEqual(flushes, 1)
+
+    def test_018d_file_wrapper(self):
+        data = b''.join(six.b('%05d' % i) for i in range(100000))
+        fileno, path = tempfile.mkstemp()
+        self.addCleanup(os.unlink, path)
+        os.write(fileno, data)
+        os.close(fileno)
+
+        def app(environ, start_response):
+            headers = [('Content-Type', 'application/octet-stream')]
+            if environ['PATH_INFO'] == '/short':
+                headers.append(('Content-Length', '100'))
+            if environ['PATH_INFO'] == '/bytesio':
+                filelike = six.BytesIO(data)
+            else:
+                filelike = open(path, 'rb')
+                filelike.seek(int(environ.get('QUERY_STRING') or 0))
+            start_response('200 OK', headers)
+            return environ['wsgi.file_wrapper'](filelike)
+
+        self.spawn_server(site=app)
+        sock = eventlet.connect(self.server_addr)
+        for url, expected in (('/', data), ('/?7', data[7:]), ('/short?7', data[7:107])):
+            sock.sendall(six.b('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % url))
+            result = read_http(sock)
+            assert result.status == 'HTTP/1.1 200 OK', result.status
+            assert result.headers_lower['content-length'] == str(len(expected))
+            assert result.body == expected, url
+
+        # anything but a real file is iterated over
+        sock.sendall(b'GET /bytesio HTTP/1.0\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.body == data
+        sock.close()
+
     def test_019_fieldstorage_compat(self):
         def use_fieldstorage(environ, start_response):
             cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
@@ -1484,6 +1609,10 @@ class TestHttpd(_TestBase):
         # Runs tests.wsgi_test_conntimeout in a separate process.
         tests.run_isolated('wsgi_connection_timeout.py')
 
+    def test_serve_forked(self):
+        self.reset_timeout(30)
+        tests.run_isolated('wsgi_serve_forked.py', timeout=30)
+
     def test_server_socket_timeout(self):
         self.spawn_server(socket_timeout=0.1)
         sock = eventlet.connect(self.server_addr)
@@ -1495,6 +1624,158 @@ class TestHttpd(_TestBase):
         except ConnectionClosed:
             pass
 
+    def test_keepalive_timeout(self):
+        self.spawn_server(keepalive_timeout=0.1)
+        sock = eventlet.connect(self.server_addr)
+        # neither the first request nor a request in progress is bounded
+        eventlet.sleep(0.2)
+        sock.sendall(b'GET / HTTP/1.1\r\n')
+        eventlet.sleep(0.2)
+        sock.sendall(b'Host: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 200 OK'
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 200 OK'
+        # idling between requests is
+        eventlet.sleep(0.3)
+        assert sock.recv(1) == b''
+        assert 'keepalive timed out' in self.logfile.getvalue()
+
+    def test_reap_idle_connections(self):
+        pool = eventlet.GreenPool(2)
+        self.spawn_server(custom_pool=pool, idle_reserve=1)
+        socks = []
+        for _ in range(2):
+            sock = eventlet.connect(self.server_addr)
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            read_http(sock)
+            socks.append(sock)
+            eventlet.sleep(0.01)
+        # the pool is full: a new client takes the slot of the connection
+        # that has been idle the longest
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 200 OK'
+        assert socks[0].recv(1) == b''
+        # the more recently idle connection is not touched
+        socks[1].sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(socks[1])
+        assert result.status == 'HTTP/1.1 200 OK'
+
+    def test_reap_idle_disabled(self):
+        # off by default
+        pool = eventlet.GreenPool(1)
+        self.spawn_server(custom_pool=pool)
+        first = eventlet.connect(self.server_addr)
+        first.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        read_http(first)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        eventlet.sleep(0.1)
+        first.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(first)
+        assert result.status == 'HTTP/1.1 200 OK'
+
+    def test_reap_idle_not_repeated(self):
+        scans = []
+        reap_idle = wsgi._reap_idle
+
+        def counting_reap_idle(connections, count):
+            scans.append(count)
+            return reap_idle(connections, count)
+
+        wsgi._reap_idle = counting_reap_idle
+        self.addCleanup(setattr, wsgi, '_reap_idle', reap_idle)
+        release = eventlet.Event()
+
+        def wsgi_app(environ, start_response):
+            release.wait()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        self.spawn_server(site=wsgi_app, custom_pool=eventlet.GreenPool(2), idle_reserve=2)
+        socks = []
+        for _ in range(3):
+            sock = eventlet.connect(self.server_addr)
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            socks.append(sock)
+            eventlet.sleep(0.01)
+        # every connection is busy: after one look finds nothing to reap,
+        # the next accept does not look again
+        self.assertEqual(len(scans), 1)
+        release.send()
+        for sock in socks:
+            assert read_http(sock).status == 'HTTP/1.1 200 OK'
+            sock.close()
+
+    def test_shed_max_outstanding(self):
+        release = eventlet.Event()
+
+        def wsgi_app(environ, start_response):
+            release.wait()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        self.spawn_server(site=wsgi_app, max_outstanding=1, retry_after=3)
+        busy = eventlet.connect(self.server_addr)
+        busy.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        eventlet.sleep(0.01)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 503 Service Unavailable'
+        assert result.headers_lower['retry-after'] == '3'
+        assert result.headers_lower['connection'] == 'close'
+        release.send()
+        result = read_http(busy)
+        assert result.status == 'HTTP/1.1 200 OK'
+        # admitted again once the load is gone
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 200 OK'
+
+    def test_shed_pool_full(self):
+        release = eventlet.Event()
+
+        def wsgi_app(environ, start_response):
+            release.wait()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        self.spawn_server(site=wsgi_app, custom_pool=eventlet.GreenPool(1),
+                          max_outstanding=10)
+        busy = eventlet.connect(self.server_addr)
+        busy.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        eventlet.sleep(0.01)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 503 Service Unavailable'
+        assert result.headers_lower['retry-after'] == '1'
+        release.send()
+        result = read_http(busy)
+        assert result.status == 'HTTP/1.1 200 OK'
+
+    def test_shed_queue_latency(self):
+        self.reset_timeout(3)
+        self.spawn_server(max_queue_latency=0.05)
+        eventlet.sleep(0.15)
+        # keep the event loop from running anything for a while
+        time.sleep(0.3)
+        eventlet.sleep(0.01)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 503 Service Unavailable'
+        eventlet.sleep(0.6)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.status == 'HTTP/1.1 200 OK'
+
     def test_disable_header_name_capitalization(self):
         # Disable HTTP header name capitalization
         #
@@ -1515,6 +1796,32 @@ class TestHttpd(_TestBase):
         self.assertEqual(result.headers_lower[random_case_header[0].lower()], random_case_header[1])
         self.assertEqual(result.headers_original[random_case_header[0]], random_case_header[1])
 
+    def test_header_name_capitalization_memo(self):
+        names = wsgi._HeaderNames()
+        names.max_size = 2
+        assert names['content-TYPE'] == 'Content-Type'
+        assert names['x-a'] == 'X-A'
+        assert names['x-b'] == 'X-B'
+        assert sorted(names) == ['content-TYPE', 'x-a']
+
+    def test_date_header(self):
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Length', '0')])
+            return [b'']
+
+        self.spawn_server(site=wsgi_app)
+        sock = eventlet.connect(self.server_addr)
+        dates = []
+        for _ in range(2):
+            before = time.time()
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            result = read_http(sock)
+            dates.append(result.headers_original['Date'])
+            assert dates[-1] in (wsgi.format_date_time(before),
+                                 wsgi.format_date_time(time.time()))
+        assert wsgi._date_header_line() == 'Date: %s\r\n' % dates[-1] or \
+            wsgi._date_header_line() == 'Date: %s\r\n' % wsgi.format_date_time(time.time())
+
     def test_log_unix_address(self):
         def app(environ, start_response):
             start_response('200 OK', [])
@@ -1573,6 +1880,169 @@ class TestHttpd(_TestBase):
         assert result.body == (b'HTTP_HOST: localhost\nHTTP_HTTP_X_ANY_K: two\n'
                                b'HTTP_PATH_INFO: foo\nHTTP_X_ANY_K: one\n')
 
+    def test_env_headers_folded_and_split(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return ['{0}: {1}\n'.format(*kv).encode() for kv in sorted(environ.items())
+                    if kv[0].startswith('HTTP_') or kv[0].startswith('CONTENT_')]
+
+        self.spawn_server(site=app)
+        sock = eventlet.connect(self.server_addr)
+        # bare LF line endings, a continuation line and a header block that
+        # arrives in pieces
+        sock.sendall(b'GET / HTTP/1.1\nHost: localhost\nX-Folded: one\n')
+        eventlet.sleep(0.01)
+        sock.sendall(b'\ttwo\nContent-Type: text/html\ncontent-type: text/xml\n\n')
+        result = read_http(sock)
+        sock.close()
+        assert result.status == 'HTTP/1.1 200 OK', 'Received status {0!r}'.format(result.status)
+        assert result.body == (b'CONTENT_TYPE: text/html\nHTTP_HOST: localhost\n'
+                               b'HTTP_X_FOLDED: one two\n')
+
+    def test_parse_headers(self):
+        headers, fields = wsgi.parse_headers(
+            'Host: localhost\r\nX-Forwarded-For: 1.2.3.4\r\nbogus\r\n'
+            'x-forwarded-for:5.6.7.8 \r\nContent-Length: 0\r\n')
+        assert headers == (('Host', 'localhost'), ('X-Forwarded-For', '1.2.3.4'),
+                           ('x-forwarded-for', '5.6.7.8'), ('Content-Length', '0'))
+        assert fields == {'HTTP_HOST': 'localhost', 'HTTP_X_FORWARDED_FOR': '1.2.3.4,5.6.7.8',
+                          'CONTENT_LENGTH': '0'}
+
+    def test_access_log(self):
+        out = six.StringIO()
+        self.spawn_server(access_log=wsgi.AccessLog(out, flush_interval=0.05))
+        sock = eventlet.connect(self.server_addr)
+        for _ in range(2):
+            sock.sendall(b'GET /a HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            read_http(sock)
+        # written later, in one go
+        assert out.getvalue() == ''
+        eventlet.sleep(0.1)
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 2, lines
+        assert '"GET /a HTTP/1.1" 200 ' in lines[0], lines[0]
+        assert lines[0].startswith('127.0.0.1 - - ['), lines[0]
+        assert self.logfile.getvalue().count('GET /a') == 0
+
+    def test_access_log_json(self):
+        out = six.StringIO()
+        self.spawn_server(access_log=wsgi.AccessLog(out, json=True))
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET /a HTTP/1.1\r\nHost: localhost\r\n'
+                     b'X-Forwarded-For: 10.0.0.1, 10.0.0.2\r\n\r\n')
+        read_http(sock)
+        self.killer.kill(KeyboardInterrupt)
+        self.killer.wait()
+        # the rest is written when the server exits
+        record = json.loads(out.getvalue())
+        assert record['client_ip'] == '10.0.0.1,10.0.0.2,127.0.0.1'
+        assert record['request_line'] == 'GET /a HTTP/1.1'
+        assert record['status_code'] == '200'
+        assert record['body_length'] > 0
+        assert set(record) == set(['client_ip', 'client_port', 'date_time', 'request_line',
+                                   'status_code', 'body_length', 'wall_seconds'])
+
+    def test_access_log_sample(self):
+        out = six.StringIO()
+        access_log = wsgi.AccessLog(out, sample=0.25)
+        for _ in range(1000):
+            access_log.record(('127.0.0.1', 1), None, 'GET / HTTP/1.1', '200', 0, 0, 0)
+        access_log.flush()
+        assert 150 < len(out.getvalue().splitlines()) < 350
+        self.assertRaises(ValueError, wsgi.AccessLog, sample=0)
+
+    def test_access_log_full(self):
+        out = six.StringIO()
+        access_log = wsgi.AccessLog(out, buffer_size=2)
+        for path in '/a', '/b', '/c':
+            access_log.record(('127.0.0.1', 1), None, 'GET %s HTTP/1.1' % path, '200', 0, 0, 0)
+        assert access_log.dropped == 1
+        access_log.flush()
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 2
+        assert 'GET /b' in lines[0] and 'GET /c' in lines[1]
+
+    def test_histogram(self):
+        hist = wsgi.Histogram()
+        assert hist.quantile(0.5) == 0.0
+        for us in range(1, 10001):
+            hist.record(us / 1000000.0)
+        assert hist.count == 10000
+        assert hist.max == 0.01
+        for q in 0.5, 0.9, 0.99:
+            expected = q * 0.01
+            assert expected <= hist.quantile(q) <= expected * 1.125, (q, hist.quantile(q))
+        assert hist.quantile(1) == 0.01
+        hist.record(-1)
+        hist.record(10 ** 6)
+        assert hist.counts[0] == 1 and hist.counts[-1] == 1
+
+    def test_metrics(self):
+        metrics = wsgi.ServerMetrics()
+
+        def wsgi_app(environ, start_response):
+            if environ['PATH_INFO'] == '/metrics':
+                return metrics.app(environ, start_response)
+            if environ['PATH_INFO'] == '/error':
+                raise RuntimeError('oops')
+            environ['wsgi.input'].read()
+            start_response('200 OK', [('Content-Length', '5')])
+            return [b'hello']
+
+        self.spawn_server(site=wsgi_app, metrics=metrics, debug=False)
+        sock = eventlet.connect(self.server_addr)
+        for _ in range(3):
+            sock.sendall(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 4\r\n\r\nbody')
+            read_http(sock)
+        snapshot = metrics.snapshot()
+        assert snapshot['requests'] == 3
+        assert snapshot['bytes_in'] == 3 * len(
+            b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 4\r\n\r\nbody')
+        assert snapshot['bytes_out'] > 3 * 5
+        assert snapshot['connections'] == {'active': 0, 'idle': 1, 'total': 1, 'accepted': 1}
+        assert snapshot['queue_wait']['count'] == 1
+        assert snapshot['app_time']['count'] == 3
+        assert snapshot['total_time']['max'] >= snapshot['app_time']['max'] > 0
+        assert snapshot['errors'] == {}
+
+        sock.sendall(b'GET /error HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        read_http(sock)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        result = read_http(sock)
+        assert result.headers_lower['content-type'].startswith('text/plain; version=0.0.4')
+        text = result.body.decode('utf-8')
+        assert 'eventlet_wsgi_requests_total 4\n' in text
+        assert 'eventlet_wsgi_errors_total{type="app"} 1\n' in text
+        assert 'eventlet_wsgi_connections{state="active"} 1\n' in text
+        assert 'eventlet_wsgi_connections_accepted_total 2\n' in text
+        assert '# TYPE eventlet_wsgi_total_time_seconds summary\n' in text
+        assert 'eventlet_wsgi_total_time_seconds{quantile="0.99"} ' in text
+        assert 'eventlet_wsgi_app_time_seconds_count 4\n' in text
+
+    def test_metrics_shed(self):
+        metrics = wsgi.ServerMetrics()
+        release = eventlet.Event()
+
+        def wsgi_app(environ, start_response):
+            release.wait()
+            start_response('200 OK', [])
+            return [b'ok']
+
+        self.spawn_server(site=wsgi_app, metrics=metrics, max_outstanding=1)
+        busy = eventlet.connect(self.server_addr)
+        busy.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        eventlet.sleep(0.01)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        read_http(sock)
+        snapshot = metrics.snapshot()
+        assert snapshot['errors'] == {'shed': 1}
+        assert snapshot['outstanding_requests'] == 1
+        assert snapshot['connections']['active'] == 1
+        release.send()
+        read_http(busy)
+
     def test_log_disable(self):
         self.spawn_server(log_output=False)
         sock = eventlet.connect(self.server_addr)
@@ -1665,6 +2135,155 @@ class ProxiedIterableAlreadyHandledTest(IterableAlreadyHandledTest):
         super(ProxiedIterableAlreadyHandledTest, self).tearDown()
 
 
+class TestCompression(_TestBase):
+    text = b'{"key": "value", "list": [1, 2, 3]}\n' * 200
+
+    def set_site(self):
+        self.site = self.application
+
+    def tearDown(self):
+        tpool.killall()
+        super(TestCompression, self).tearDown()
+
+    def application(self, env, start_response):
+        path = env['PATH_INFO']
+        content_type = 'image/png' if path == '/png' else 'application/json; charset=utf-8'
+        body = self.text[:100] if path == '/small' else self.text
+        start_response('200 OK', [('Content-Type', content_type), ('Vary', 'Cookie')])
+        return [body[:1000], body[1000:]]
+
+    def request(self, path='/', accept_encoding='gzip, deflate', method='GET', version='1.1'):
+        sock = eventlet.connect(self.server_addr)
+        request = '{0} {1} HTTP/{2}\r\nHost: localhost\r\n'.format(method, path, version)
+        if accept_encoding is not None:
+            request += 'Accept-Encoding: {0}\r\n'.format(accept_encoding)
+        sock.sendall((request + '\r\n').encode('ascii'))
+        result = read_http(sock)
+        sock.close()
+        return result
+
+    def test_whole_body(self):
+        self.spawn_server(compression=True)
+        result = self.request()
+        assert result.headers_lower['content-encoding'] == 'gzip'
+        assert result.headers_lower['vary'] == 'Cookie, Accept-Encoding'
+        assert int(result.headers_lower['content-length']) == len(result.body)
+        assert len(result.body) < len(self.text) // 10
+        assert zlib.decompress(result.body, 16 + zlib.MAX_WBITS) == self.text
+
+    def test_deflate(self):
+        self.spawn_server(compression=True)
+        result = self.request(accept_encoding='gzip;q=0, deflate')
+        assert result.headers_lower['content-encoding'] == 'deflate'
+        assert zlib.decompress(result.body) == self.text
+
+    def test_not_compressed(self):
+        self.spawn_server(compression=True)
+        for path, accept_encoding, vary in [
+                ('/', None, 'Cookie, Accept-Encoding'),
+                ('/', 'identity', 'Cookie, Accept-Encoding'),
+                ('/small', 'gzip', 'Cookie, Accept-Encoding'),
+                ('/png', 'gzip', 'Cookie')]:
+            result = self.request(path, accept_encoding)
+            assert 'content-encoding' not in result.headers_lower, path
+            assert result.headers_lower['vary'] == vary, (path, accept_encoding)
+            assert result.body in (self.text, self.text[:100]), path
+        result = self.request(method='HEAD')
+        assert 'content-encoding' not in result.headers_lower
+
+    def test_disabled(self):
+        self.spawn_server()
+        result = self.request()
+        assert 'content-encoding' not in result.headers_lower
+        assert result.headers_lower['vary'] == 'Cookie'
+        assert result.body == self.text
+
+    def test_streaming(self):
+        release = eventlet.Event()
+        part = b'x' * 5000
+
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            yield part
+            release.wait()
+            yield part
+
+        self.spawn_server(site=wsgi_app, compression=True)
+        sock = eventlet.connect(self.server_addr)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n')
+        fd = sock.makefile('rb')
+        head = b''
+        while not head.endswith(b'\r\n\r\n'):
+            head += fd.readline()
+        assert b'Content-Encoding: gzip\r\n' in head
+        assert b'Transfer-Encoding: chunked\r\n' in head
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        def read_chunk():
+            size = int(fd.readline(), 16)
+            data = fd.read(size)
+            fd.readline()
+            return data
+
+        # the first part arrives before the response is complete
+        assert decompressor.decompress(read_chunk()) == part
+        release.send()
+        body = b''
+        while True:
+            data = read_chunk()
+            if not data:
+                break
+            body += decompressor.decompress(data)
+        assert body + decompressor.flush() == part
+        assert decompressor.unused_data == b''
+
+    def test_empty_streaming(self):
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return iter([])
+
+        self.spawn_server(site=wsgi_app, compression={'min_size': 0})
+        # HTTP/1.0: the body ends when the connection is closed
+        result = self.request(version='1.0')
+        assert result.headers_lower['content-encoding'] == 'gzip'
+        assert zlib.decompress(result.body, 16 + zlib.MAX_WBITS) == b''
+
+    def test_tpool(self):
+        self.spawn_server(compression={'tpool_size': 1000})
+        result = self.request()
+        assert zlib.decompress(result.body, 16 + zlib.MAX_WBITS) == self.text
+
+    def test_error(self):
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            raise RuntimeError('x' * 2000)
+
+        self.spawn_server(site=wsgi_app, compression=True)
+        result = self.request()
+        assert result.status == 'HTTP/1.1 500 Internal Server Error'
+        assert b'RuntimeError' in result.body
+
+    def test_accepted_coding(self):
+        for header, coding in [
+                (None, None),
+                ('', None),
+                ('identity', None),
+                ('gzip', 'gzip'),
+                ('x-gzip', 'gzip'),
+                ('deflate, gzip', 'gzip'),
+                ('gzip;q=0.5, deflate', 'deflate'),
+                ('GZIP ; Q=0', None),
+                ('*', 'gzip'),
+                ('*;q=0, deflate', 'deflate'),
+                ('gzip;q=bad', None)]:
+            assert wsgi._accepted_coding(header) == coding, header
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, wsgi._compression_options, {'size': 1})
+        self.assertRaises(ValueError, wsgi._compression_options, {'level': 10})
+        assert wsgi._compression_options(False) is None
+
+
 class TestChunkedInput(_TestBase):
     validator = None
 
@@ -1683,6 +2302,18 @@ class TestChunkedInput(_TestBase):
         elif pi == "/ping":
             input.read()
             response.append(b"pong")
+        elif pi == "/readinto":
+            buf = bytearray(3)
+            while True:
+                n = input.readinto(buf)
+                if not n:
+                    break
+                response.append(bytes(buf[:n]))
+        elif pi == "/iter_chunks":
+            chunks = [chunk.tobytes() for chunk in input.iter_chunks(5)]
+            response.append(b'|'.join(chunks))
+        elif pi == "/unread":
+            response.append(b"ok")
         elif pi.startswith("/yield_spaces"):
             if pi.endswith('override_min'):
                 env['eventlet.minimum_write_chunk_size'] = 1
@@ -1728,6 +2359,43 @@ class TestChunkedInput(_TestBase):
         fd.sendall(b"GET /ping HTTP/1.1\r\n\r\n")
         self.assertEqual(read_http(fd).body, b"pong")
 
+    def test_readinto(self):
+        fd = self.connect()
+        req = "POST /readinto HTTP/1.1\r\ntransfer-encoding: Chunked\r\n\r\n" + self.body()
+        fd.sendall(req.encode())
+        self.assertEqual(read_http(fd).body, b"this is chunked\nline 2\nline3")
+
+        fd.sendall(b"POST /readinto HTTP/1.1\r\nContent-Length: 8\r\n\r\n12345678")
+        self.assertEqual(read_http(fd).body, b"12345678")
+        self.ping(fd)
+        fd.close()
+
+    def test_iter_chunks(self):
+        fd = self.connect()
+        req = "POST /iter_chunks HTTP/1.1\r\ntransfer-encoding: Chunked\r\n\r\n" + self.body()
+        fd.sendall(req.encode())
+        self.assertEqual(read_http(fd).body, b"this |is ch|unked|\nline| 2\nli|ne3")
+
+        fd.sendall(b"POST /iter_chunks HTTP/1.1\r\nContent-Length: 8\r\n\r\n12345678")
+        self.assertEqual(read_http(fd).body, b"12345|678")
+        fd.close()
+
+    def test_discard_large_body(self):
+        fd = self.connect()
+        body = b"x" * (1 << 20)
+        fd.sendall(b"POST /unread HTTP/1.1\r\nContent-Length: " +
+                   str(len(body)).encode() + b"\r\n\r\n")
+        sender = eventlet.spawn(fd.sendall, body)
+        self.assertEqual(read_http(fd).body, b"ok")
+        sender.wait()
+        self.ping(fd)
+
+        req = "POST /unread HTTP/1.1\r\ntransfer-encoding: Chunked\r\n\r\n" + self.body()
+        fd.sendall(req.encode())
+        self.assertEqual(read_http(fd).body, b"ok")
+        self.ping(fd)
+        fd.close()
+
     def test_short_read_with_content_length(self):
         body = self.body()
         req = "POST /short-read HTTP/1.1\r\ntransfer-encoding: Chunked\r\n" \